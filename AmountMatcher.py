@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, datetime
+
+# -----------------------------------
+# Open items
+# -----------------------------------
+OpenItem = namedtuple("OpenItem", ["reference", "cents", "due_date", "doc_number", "doc_type", "client", "posting_date"],
+                      defaults=[None, None])
+Candidate = namedtuple("Candidate", ["items", "total_cents", "diff_cents"])
+
+def to_cents(amount) -> int:
+    """
+    Converts an amount into integer cents so sums are compared exactly.
+
+    Parameters:
+    - amount (float | int | str): Amount in euros
+
+    Returns:
+    - int: Amount in cents
+    """
+    return round(float(amount) * 100)
+
+def read_open_items(rows: list, client_code, detail: dict) -> list:
+    """
+    Builds the open items of one client (or of every client) from the rows of an FBL5N export.
+
+    Parameters:
+    - rows (list[list]): Export rows (header included, as read from the sheet)
+    - client_code: Client whose items are kept (compared as text); None keeps every client
+    - detail (dict): 'open_items_detail' block from SAP_info.json (1-based columns, plus
+      'posting_date_col' when the posting date is needed)
+
+    Returns:
+    - list[OpenItem]: Open items sorted by due date (oldest first)
+    """
+    def cell(row, key):
+        if not detail.get(key):
+            return None
+        index = detail[key] - 1
+        return row[index] if index < len(row) else None
+
+    def day(value):
+        return value.date() if isinstance(value, datetime) else value
+
+    client = _code(client_code) if client_code is not None else None
+    items = []
+    for row in rows[detail["start_row"] - 1:]:
+        amount = cell(row, "amount_col")
+        row_client = _code(cell(row, "client_col"))
+        if amount in (None, "") or client is not None and row_client != client:
+            continue
+        items.append(OpenItem(cell(row, "reference_col"), to_cents(amount), day(cell(row, "due_date_col")),
+                              cell(row, "doc_number_col"), cell(row, "doc_type_col"),
+                              row_client, day(cell(row, "posting_date_col"))))
+    items.sort(key=lambda item: item.due_date if isinstance(item.due_date, date) else date.max)
+    return items
+
+def _code(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value or "").strip()
+
+# -----------------------------------
+# Amount combinations
+# -----------------------------------
+class _Deadline:
+    # Time budget polled from the inner loops: the clock is read every `every` ticks,
+    # so the search stops close to the budget without paying for a clock call per step
+    def __init__(self, seconds: float, every: int = 256):
+        self.at = time.perf_counter() + seconds
+        self.every = every
+        self.ticks = 0
+        self.passed = False
+
+    def tick(self) -> bool:
+        self.ticks += 1
+        if not self.passed and self.ticks % self.every == 0:
+            self.passed = time.perf_counter() > self.at
+        return self.passed
+
+def _contiguous(cents: list, low: int, high: int, deadline: _Deadline) -> list:
+    # Runs of consecutive items in due date order ("pays the oldest invoices"), O(n) per start
+    found = []
+    for start in range(len(cents)):
+        total = 0
+        for end in range(start, len(cents)):
+            if deadline.tick():
+                return found
+            total += cents[end]
+            if low <= total <= high:
+                found.append(tuple(range(start, end + 1)))
+    return found
+
+def _subset_sums(indices: list, cents: list, deadline: _Deadline) -> list:
+    sums = [(0, ())]
+    for index in indices:
+        step = []
+        for total, chosen in sums:
+            if deadline.tick():
+                return sums + step
+            step.append((total + cents[index], chosen + (index,)))
+        sums += step
+    return sums
+
+def _meet_in_the_middle(cents: list, low: int, high: int, deadline: _Deadline, limit: int) -> list:
+    half = len(cents) // 2
+    left = _subset_sums(list(range(half)), cents, deadline)
+    right = sorted(_subset_sums(list(range(half, len(cents))), cents, deadline))
+    right_sums = [total for total, _ in right]
+    found = []
+    for total, chosen in left:
+        for position in range(bisect_left(right_sums, low - total), bisect_right(right_sums, high - total)):
+            if deadline.tick():
+                return found
+            combination = chosen + right[position][1]
+            if combination:
+                found.append(combination)
+            if len(found) >= limit:
+                return found
+        if deadline.tick():
+            break
+    return found
+
+def _bounded_dp(cents: list, low: int, high: int, deadline: _Deadline, ways: int) -> list:
+    # Reachable sums → up to `ways` index tuples, bounded by `high`. Credit notes (negative items)
+    # go first, so every later step only adds and a sum above `high` can never come back down
+    order = [index for index, value in enumerate(cents) if value < 0] + \
+            [index for index, value in enumerate(cents) if value > 0]
+    reachable = {0: [()]}
+    for index in order:
+        if deadline.passed:
+            break
+        value = cents[index]
+        # Sums reached in this step are kept apart, so an item is never added twice to a combination
+        step = {}
+        for total, combinations in reachable.items():
+            if deadline.tick():
+                break
+            new_total = total + value
+            if new_total > high:
+                continue
+            room = ways - len(reachable.get(new_total, ())) - len(step.get(new_total, ()))
+            if room > 0:
+                step.setdefault(new_total, []).extend(chosen + (index,) for chosen in combinations[:room])
+        for total, combinations in step.items():
+            deadline.tick()
+            reachable.setdefault(total, []).extend(combinations)
+    return [tuple(sorted(chosen)) for total in range(low, high + 1) for chosen in reachable.get(total, ()) if chosen]
+
+def find_combinations(amount, items: list, tolerance=0.0, max_candidates: int = 5,
+                      max_exact_items: int = 24, time_budget: float = 2.0) -> list:
+    """
+    Finds the combinations of open items whose amounts add up to a payment.
+
+    Workflow:
+    - Works in integer cents, accepting totals within ±`tolerance`
+    - Always tries runs of consecutive items in due date order (the usual way clients pay)
+    - Up to `max_exact_items` items: exhaustive meet-in-the-middle over both halves
+    - Above that: bounded dynamic programming over every item, credit notes included (sums ≤ amount + tolerance)
+    - Stops searching when `time_budget` seconds are spent and ranks what was found
+
+    Parameters:
+    - amount (float): Payment amount
+    - items (list[OpenItem]): Client open items (oldest first)
+    - tolerance (float, optional): Accepted difference in euros
+    - max_candidates (int, optional): Number of candidates returned
+    - max_exact_items (int, optional): Largest item count searched exhaustively
+    - time_budget (float, optional): Seconds allowed for the search
+
+    Returns:
+    - list[Candidate]: Candidates ranked by difference, number of items and age of the items
+    """
+    deadline = _Deadline(time_budget)
+    target = to_cents(amount)
+    margin = to_cents(tolerance)
+    low, high = target - margin, target + margin
+    cents = [item.cents for item in items]
+    found = set(_contiguous(cents, low, high, deadline))
+    limit = max_candidates * 20
+    if len(items) <= max_exact_items:
+        found.update(_meet_in_the_middle(cents, low, high, deadline, limit))
+    else:
+        found.update(_bounded_dp(cents, low, high, deadline, max_candidates))
+    totals = {chosen: sum(cents[index] for index in chosen) for chosen in found}
+    ranked = sorted(totals, key=lambda chosen: (abs(totals[chosen] - target), len(chosen), sum(chosen)))
+    return [Candidate([items[index] for index in sorted(chosen)], totals[chosen], totals[chosen] - target)
+            for chosen in ranked[:max_candidates]]
+
+def describe(candidate: Candidate) -> str:
+    """
+    One-line description of a candidate for the selection dialog.
+
+    Parameters:
+    - candidate (Candidate): Ranked candidate
+
+    Returns:
+    - str: e.g. '3 partidas · 1.234,56 € · dif. 0,00 € · F001, F002, F003'
+    """
+    def euros(cents):
+        text = f"{cents / 100:,.2f}"
+        return text.replace(",", "X").replace(".", ",").replace("X", ".")
+    references = ", ".join(str(item.reference) for item in candidate.items)
+    return (f"{len(candidate.items)} partidas · {euros(candidate.total_cents)} € · "
+            f"dif. {euros(candidate.diff_cents)} € · {references}")
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+import Load_SAP_info
+from LocalStore import sender_matches
+
+# -----------------------------------
+# Bank description rule engine
+# -----------------------------------
+ConceptMatch = namedtuple("ConceptMatch", ["rule", "concept", "keep", "action", "client"])
+
+class ConceptRules:
+    """
+    Ordered bank description rules compiled into a single matcher.
+
+    Every rule from 'bank_concept_rules' becomes one lookahead branch of a combined regex,
+    so one `match` call per description finds the first rule (in configuration order) whose
+    pattern appears anywhere in the text, with its capture groups.
+
+    Rule keys:
+    - name (str): Rule name used in the match counters
+    - pattern (str): Regex searched in the description (numbered groups only)
+    - template (str): Concept template; {1}, {2}… are the rule groups, {description} and {date} are available
+    - keep (bool, optional): False drops the movement even if it matches (default True)
+    - action (str, optional): Default 'Acción' for the movement
+    - client (str, optional): Default client code for the movement
+    """
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.counts = Counter()
+        branches = []
+        self._offsets = {}
+        group_index = 1
+        for rule in rules:
+            pattern = re.compile(rule["pattern"])
+            if pattern.groupindex:
+                raise ValueError(f"La regla '{rule['name']}' usa grupos con nombre; usa grupos numerados")
+            # Wrapper group index → (rule, first index of its own groups, number of groups)
+            self._offsets[group_index] = (rule, group_index + 1, pattern.groups)
+            branches.append(f"(?=.*?({rule['pattern']}))")
+            group_index += pattern.groups + 1
+        self._matcher = re.compile("|".join(branches)) if branches else None
+
+    def classify(self, description: str, doc_date: str = "") -> ConceptMatch | None:
+        """
+        Classifies one description with the combined matcher.
+
+        Parameters:
+        - description (str): Bank description
+        - doc_date (str, optional): Document date embedded in templates using {date}
+
+        Returns:
+        - ConceptMatch or None: Matching rule and built concept, or None if no rule applies
+        """
+        description = str(description or "")
+        result = None
+        match = self._matcher.match(description) if self._matcher else None
+        if match:
+            # The wrapper group closes last, so lastindex points to the matching rule
+            rule, first, count = self._offsets[match.lastindex]
+            groups = [(match.group(i) or "").strip() for i in range(first, first + count)]
+            concept = rule["template"].format(match.group(first - 1), *groups,
+                                              description=description, date=doc_date)
+            result = ConceptMatch(rule["name"], concept, rule.get("keep", True),
+                                  rule.get("action"), rule.get("client"))
+        self.counts[result.rule if result else None] += 1
+        return result
+
+    def classify_all(self, descriptions, doc_dates) -> list:
+        """
+        Classifies a whole description column in one pass (repeated descriptions are matched once).
+
+        Parameters:
+        - descriptions (iterable[str]): Bank descriptions
+        - doc_dates (iterable[str]): Document dates, aligned with `descriptions`
+
+        Returns:
+        - list[ConceptMatch | None]: One result per description
+        """
+        seen = {}
+        results = []
+        for description, doc_date in zip(descriptions, doc_dates):
+            key = (description, doc_date)
+            if key not in seen:
+                seen[key] = self.classify(description, doc_date)
+            else:
+                result = seen[key]
+                self.counts[result.rule if result else None] += 1
+            results.append(seen[key])
+        return results
+
+    def summary(self) -> str:
+        """
+        Returns the match counters per rule as a single line (unmatched shown as 'sin regla').
+
+        Returns:
+        - str: e.g. 'transferencia: 120, ingreso: 4, sin regla: 9'
+        """
+        names = [rule["name"] for rule in self.rules] + [None]
+        return ", ".join(f"{name or 'sin regla'}: {self.counts[name]}" for name in names if self.counts[name])
+
+_RULES = None
+
+def concept_rules() -> ConceptRules:
+    """
+    Returns the rule engine built from 'bank_concept_rules' in SAP_info.json, compiling it once.
+
+    Returns:
+    - ConceptRules: Shared engine
+    """
+    global _RULES
+    if _RULES is None:
+        _RULES = ConceptRules(Load_SAP_info.config["bank_concept_rules"])
+    return _RULES
+
+# -----------------------------------
+# Sender → client/action auto-match
+# -----------------------------------
+_CONCEPT_SENDER_RE = re.compile(r"^Tr (.*) \d{2}/\d{2}/\d{4}$")
+
+def normalize_sender(text: str) -> str:
+    """
+    Normalizes a sender name so spelling variants of the same payer compare equal
+    (upper case, no accents, no punctuation, single spaces, "S A" → "SA").
+
+    Parameters:
+    - text (str): Sender name as written by the bank
+
+    Returns:
+    - str: Normalized sender
+    """
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode("ascii")
+    text = " ".join(re.sub(r"[^A-Z0-9 ]", " ", text.upper()).split())
+    return re.sub(r"\b(\w) (?=\w\b)", r"\1", text)
+
+def sender_from_concept(concept) -> str | None:
+    """
+    Extracts the normalized sender from a transfer concept ("Tr <remitente> dd/mm/yyyy").
+
+    Parameters:
+    - concept (str): Concept from column F
+
+    Returns:
+    - str or None: Normalized sender, or None if the concept is not a transfer
+    """
+    match = _CONCEPT_SENDER_RE.match(str(concept or ""))
+    if not match:
+        return None
+    return normalize_sender(match.group(1)) or None
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SenderIndex:
+    """
+    Sender → (client code, action) index built from the movements applied in past runs.
+
+    Exact lookups hit a dict of normalized senders; otherwise candidates sharing trigrams
+    are found through an inverted index and scored by Jaccard similarity. The confidence
+    is that similarity times the share of the sender's uses taken by its most used
+    (client, action) pair.
+    """
+    def __init__(self, matches, min_similarity: float = 0.6):
+        self.min_similarity = min_similarity
+        uses = defaultdict(Counter)
+        for sender, client_code, action, count in matches:
+            uses[sender][(client_code, action)] += count
+        self._best = {}
+        for sender, counter in uses.items():
+            (client_code, action), top = counter.most_common(1)[0]
+            self._best[sender] = (client_code, action, top / sum(counter.values()))
+        self._grams = {sender: _trigrams(sender) for sender in self._best}
+        self._by_gram = defaultdict(set)
+        for sender, grams in self._grams.items():
+            for gram in grams:
+                self._by_gram[gram].add(sender)
+
+    def __len__(self):
+        return len(self._best)
+
+    def lookup(self, sender: str):
+        """
+        Finds the client code and action most often used for a sender.
+
+        Parameters:
+        - sender (str): Normalized sender
+
+        Returns:
+        - tuple or None: (client_code, action, confidence 0–1), or None below `min_similarity`
+        """
+        if not sender:
+            return None
+        if sender in self._best:
+            client_code, action, share = self._best[sender]
+            return client_code, action, round(share, 2)
+        grams = _trigrams(sender)
+        shared = Counter()
+        for gram in grams:
+            for candidate in self._by_gram.get(gram, ()):
+                shared[candidate] += 1
+        best, similarity = None, 0.0
+        for candidate, common in shared.items():
+            score = common / (len(grams) + len(self._grams[candidate]) - common)
+            if score > similarity:
+                best, similarity = candidate, score
+        if best is None or similarity < self.min_similarity:
+            return None
+        client_code, action, share = self._best[best]
+        return client_code, action, round(similarity * share, 2)
+
+def sender_index() -> SenderIndex:
+    """
+    Builds the sender index from the matches stored in the local store.
+
+    Returns:
+    - SenderIndex: Index ready for lookups
+    """
+    return SenderIndex(sender_matches(), Load_SAP_info.config["sender_match"]["min_similarity"])
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+from collections import Counter
+from datetime import datetime
+
+# -----------------------------------
+# Exit codes
+# -----------------------------------
+EXIT_OK = 0
+EXIT_STOPPED = 1     # The workflow stopped itself (cancelled step, SAP error…)
+EXIT_USAGE = 2       # Wrong command line (argparse)
+EXIT_UNANSWERED = 3  # A prompt had no answer in the decision file
+EXIT_ERROR = 4       # Unexpected exception
+EXIT_SLOW_START = 5  # Startup over its import time budget (or loading a deferred module)
+
+# -----------------------------------
+# Workflows
+# -----------------------------------
+# Subcommand → (module, function, options). Each option is (flag, kind, prompt match, help):
+# its value answers the first prompt of that kind containing the match, as a decision file would.
+# Options of the argument kinds ('path', 'paths', 'flag') are passed to the function as the
+# keyword argument named by the match instead.
+ARGUMENT_KINDS = {"path", "paths", "flag"}
+PATH_KINDS = {"open_file", "save_file", "folder", "path"}
+WORKFLOWS = {
+    "bank_file": ("DailyPaymentsModule", "bank_file", [
+        ("--bank", "open_file", "fichero del banco de hoy", "Fichero del banco de hoy"),
+        ("--previous", "open_file", "pagos del último día", "Pagos del último día"),
+    ]),
+    "daily_payments": ("DailyPaymentsModule", "daily_payments", [
+        ("--bank", "open_file", "banco de hoy tratado", "Fichero del banco de hoy tratado"),
+    ]),
+    "large_format_retailers_file": ("ReportsModule", "large_format_retailers_file", [
+        ("--previous", "open_file", "informe del mes anterior", "Informe del mes anterior"),
+        ("--sheet-name", "text", "nuevo nombre", "Nombre de la primera hoja"),
+        ("--manager-folder", "folder", "ficheros por gestor", "Carpeta de los ficheros por gestor"),
+    ]),
+    "generate_sap_files_balance_report": ("ReportsModule", "generate_sap_files_balance_report", [
+        ("--year", "text", "año del informe", "Año del informe (AAAA)"),
+    ]),
+    "download_files_balance_report": ("ReportsModule", "download_files_balance_report", []),
+    "create_balance_report": ("ReportsModule", "create_balance_report", [
+        ("--files", "paths", "file_paths", "TXT descargados del informe de saldos"),
+        ("--output", "path", "output_path", "Fichero del informe de saldos"),
+    ]),
+    "zaging_1": ("ReportsModule", "zaging_1", [
+        ("--zaging", "open_file", "fichero del zaging", "Fichero del Zaging"),
+        ("--standar", "open_file", "fichero del standar", "Fichero del Standar"),
+    ]),
+    "zaging_2": ("ReportsModule", "zaging_2", [
+        ("--zaging", "open_file", "fichero del zaging", "Fichero del Zaging"),
+        ("--sgl", "open_file", "partidas cme", "Fichero de partidas CME"),
+    ]),
+    "zaging_3": ("ReportsModule", "zaging_3", [
+        ("--zaging", "open_file", "fichero del zaging", "Fichero del Zaging"),
+        ("--pa", "open_file", "partidas abiertas", "Fichero de partidas abiertas"),
+        ("--pc", "open_file", "partidas compensadas", "Fichero de partidas compensadas"),
+        ("--modi", "open_file", "modificaciones", "Fichero de modificaciones"),
+    ]),
+    "refresh_open_items": ("ReportsModule", "refresh_open_items", [
+        ("--delta", "flag", "delta", "Solo las partidas contabilizadas desde la última actualización"),
+    ]),
+}
+
+# -----------------------------------
+# Startup budget
+# -----------------------------------
+# Libraries the workflows bring in, which must not be imported before the window is shown.
+# The entry module's own lazily imported modules come from its DEFERRED_MODULES table
+STARTUP_DEFERRED_LIBRARIES = ["xlwings", "win32com", "pythoncom", "openpyxl", "xlsxwriter", "SAPAux"]
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the command line: one subcommand per workflow plus the common run options.
+
+    Returns:
+    - argparse.ArgumentParser: Parser
+    """
+    parser = argparse.ArgumentParser(prog="python -m CLIRunner",
+                                     description="Ejecuta los procesos sin la ventana principal.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, (_, _, options) in WORKFLOWS.items():
+        sub = subparsers.add_parser(command)
+        for flag, kind, match, help_text in options:
+            if kind == "flag":
+                sub.add_argument(flag, action="store_true", help=help_text)
+            elif kind == "paths":
+                sub.add_argument(flag, nargs="+", help=help_text)
+            else:
+                sub.add_argument(flag, help=help_text)
+        sub.add_argument("--decisions", help="Fichero de decisiones (JSON/YAML) con el resto de respuestas")
+        sub.add_argument("--interactive", action="store_true",
+                         help="Pregunta con diálogos lo que no esté respondido (carga PyQt5 solo entonces)")
+        sub.add_argument("--auto-save", action="store_true",
+                         help="Graba en SAP (Ctrl+S) los asientos confirmados en el fichero de decisiones")
+        sub.add_argument("--repeat", type=int, default=1, help="Número de ejecuciones (pruebas de carga)")
+        sub.add_argument("--timing", help="Fichero JSON Lines donde añadir los tiempos (por defecto, salida estándar)")
+    startup = subparsers.add_parser("startup", help="Comprueba el tiempo de importación del arranque (-X importtime)")
+    startup.add_argument("--module", default="main", help="Módulo de arranque")
+    startup.add_argument("--budget-ms", type=float, default=1500, help="Tiempo máximo de importación acumulado (ms)")
+    startup.add_argument("--runs", type=int, default=3, help="Arranques medidos (se toma el más rápido)")
+    startup.add_argument("--top", type=int, default=10, help="Módulos más lentos a listar")
+    startup.add_argument("--timing", help="Fichero JSON Lines donde añadir el resultado (por defecto, salida estándar)")
+    return parser
+
+def _answers(args, options) -> tuple:
+    # Command line values → (scripted answers, keyword arguments)
+    answers, kwargs = [], {}
+    for flag, kind, match, _ in options:
+        value = getattr(args, flag.lstrip("-").replace("-", "_"))
+        if value is None or value is False:
+            continue
+        if kind == "paths":
+            value = [os.path.abspath(path) for path in value]
+        elif kind in PATH_KINDS:
+            value = os.path.abspath(value)
+        if kind in ARGUMENT_KINDS:
+            kwargs[match] = value
+        else:
+            answers.append({"kind": kind, "match": match, "value": value})
+    return answers, kwargs
+
+def run(args) -> dict:
+    """
+    Runs one workflow once, answering its prompts from the command line and the decision file.
+
+    Workflow:
+    - Sets a scripted input provider (Qt fallback only with --interactive); entries are only saved in SAP with --auto-save
+    - Imports the workflow module (timed separately) and calls the workflow
+    - Classifies the result: finished, stopped by the workflow (ContinueProgram off or an error
+      logged), unanswered prompt or exception
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line
+
+    Returns:
+    - dict: Timing record ('command', 'started', 'exit_code', 'status', 'import_s', 'run_s',
+      'events' per severity, 'unanswered' prompts and 'error')
+    """
+    import Load_SAP_info
+    import RunLog
+    from UserInputs import ScriptedInputProvider, set_input_provider, set_auto_save
+    module_name, function_name, options = WORKFLOWS[args.command]
+    answers, kwargs = _answers(args, options)
+    fallback = None
+    if args.interactive:
+        from QtInputs import QtInputProvider
+        fallback = QtInputProvider()
+    provider = ScriptedInputProvider(args.decisions, answers, fallback)
+    set_input_provider(provider)
+    set_auto_save(True if args.auto_save else None)
+    RunLog.set_workflow(args.command)
+    record = {"command": args.command, "started": datetime.now().isoformat(timespec="seconds"),
+              "exit_code": EXIT_OK, "status": "ok", "import_s": 0.0, "run_s": 0.0, "error": None}
+    start = time.perf_counter()
+    try:
+        workflow = getattr(importlib.import_module(module_name), function_name)
+        record["import_s"] = round(time.perf_counter() - start, 3)
+        Load_SAP_info.ContinueProgram = True
+        start = time.perf_counter()
+        workflow(**kwargs)
+        record["run_s"] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        record["run_s"] = round(time.perf_counter() - start, 3)
+        record.update(exit_code=EXIT_ERROR, status="error", error=f"{type(e).__name__} - {e}")
+    finally:
+        set_input_provider(None)
+        set_auto_save(None)
+    record["unanswered"] = [f"{kind}: {prompt}" for kind, prompt in provider.missing]
+    record["events"] = dict(Counter(severity for _, severity, *_ in RunLog.drain(100000)))
+    if record["status"] == "ok":
+        if provider.missing:
+            record.update(exit_code=EXIT_UNANSWERED, status="unanswered")
+        # A workflow may log an error and return without setting ContinueProgram
+        elif Load_SAP_info.ContinueProgram == False or record["events"].get(RunLog.ERROR):
+            record.update(exit_code=EXIT_STOPPED, status="stopped")
+    return record
+
+def _import_times(module_name: str) -> tuple:
+    # One cold interpreter importing the module → ({module: (self µs, cumulative µs)}, its DEFERRED_MODULES)
+    code = f"import {module_name} as module; print(' '.join(getattr(module, 'DEFERRED_MODULES', ())))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "sin salida")
+    times = {}
+    for line in result.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, result.stdout.split()
+
+def check_startup(args) -> dict:
+    """
+    Startup benchmark: measures the import time of the entry module with '-X importtime'.
+
+    Workflow:
+    - Imports the module in fresh interpreters (--runs) and keeps the fastest run
+    - Fails if the cumulative import time is over --budget-ms
+    - Fails if any library of STARTUP_DEFERRED_LIBRARIES or module of the entry module's
+      DEFERRED_MODULES (the modules its dispatcher imports on first use) was imported at startup
+
+    Parameters:
+    - args (argparse.Namespace): Parsed command line
+
+    Returns:
+    - dict: Record ('command', 'started', 'exit_code', 'status', 'import_ms', 'budget_ms',
+      'deferred_loaded', 'slowest' modules by self time and 'error')
+    """
+    record = {"command": "startup", "module": args.module, "started": datetime.now().isoformat(timespec="seconds"),
+              "exit_code": EXIT_OK, "status": "ok", "import_ms": None, "budget_ms": args.budget_ms,
+              "deferred_loaded": [], "slowest": [], "error": None}
+    try:
+        runs = [_import_times(args.module) for _ in range(max(args.runs, 1))]
+    except Exception as e:
+        record.update(exit_code=EXIT_ERROR, status="error", error=f"{type(e).__name__} - {e}")
+        return record
+    times, deferred = min(runs, key=lambda run: run[0].get(args.module, (0, 0))[1])
+    record["import_ms"] = round(times.get(args.module, (0, 0))[1] / 1000, 1)
+    record["deferred_loaded"] = [name for name in STARTUP_DEFERRED_LIBRARIES + deferred if name in times]
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    record["slowest"] = [[name, round(self_us / 1000, 1)] for name, (self_us, _) in slowest]
+    if record["deferred_loaded"]:
+        record.update(exit_code=EXIT_SLOW_START, status="eager_import")
+    elif record["import_ms"] > args.budget_ms:
+        record.update(exit_code=EXIT_SLOW_START, status="over_budget")
+    return record
+
+def _write(record: dict, timing_path=None):
+    line = json.dumps(record, ensure_ascii=False)
+    if timing_path:
+        with open(timing_path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+    else:
+        print(line)
+
+def main(argv=None) -> int:
+    """
+    Command line entry point ('python -m CLIRunner <workflow> [options]', or
+    'python -m CLIRunner startup [--budget-ms N]' for the startup benchmark).
+    Prints (or appends to --timing) one JSON timing record per run.
+
+    Parameters:
+    - argv (list[str], optional): Arguments (defaults to sys.argv)
+
+    Returns:
+    - int: Exit code of the last failing run (EXIT_OK if all finished)
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == "startup":
+        record = check_startup(args)
+        _write(record, args.timing)
+        return record["exit_code"]
+    exit_code = EXIT_OK
+    for _ in range(max(args.repeat, 1)):
+        record = run(args)
+        _write(record, args.timing)
+        exit_code = record["exit_code"] or exit_code
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,45 +3,62 @@
 @author: JesusMMA
 """
 
-import xlwings as xw
+import os
 import re
-from PyQt5.QtWidgets import QMessageBox, QInputDialog
+import uuid
 
 from datetime import date, datetime
 from SAPAux import (call_transaction, new_entry, new_entry_add_data,
                     search_items, simulate, enter_position, save_entry, get_entry_number,
-                    batch_input)
-from UserInputs import (ask_open_file, show_info,show_question,
-                        show_warning,ask_user_number,save_confirmation
+                    posted_entry_number, batch_input)
+from UserInputs import (ask_open_file, ask_open_files, show_info,show_question,
+                        show_warning,ask_user_string,save_confirmation,show_table,
+                        ask_row_decisions,ask_choice,YES,NO
                         )
-from Utilities import launch_range_selector,check_wb_open,set_data_validation,setup_headers
+from Utilities import (launch_range_selector,check_wb_open,set_data_validation,format_headers,drop_columns,
+                       write_column
+                       )
+from AmountMatcher import OpenItem, read_open_items, find_combinations, describe
+from RemittanceClassifier import cell_text
+from BankRules import concept_rules, sender_from_concept, sender_index
+from LocalStore import (key_part, movement_fingerprint, movement_ids, has_bank_watermark, new_movements, mark_movements_ingested,
+                        save_pending_movements, pending_movements, record_sender_matches, inbox_files,
+                        set_inbox_status, is_mirror_complete, open_items
+                        )
+from HotFolder import BANK_STATEMENT
+from WarmUp import template_path
+from RunLog import log_event, INFO, WARNING, ERROR
+from RunJournal import RunJournal, row_fingerprints, plan_hash, INTENT, POSTED, SPOOL, FAILED
 import Load_SAP_info
 
+# Actions accepted in column I of the treated bank file
+ACTIONS = ["SOLO", "TODO", "HASTA", "ENTRE", "RELACION", "REEMBOLSO", "A CUENTA", "FACTURA"]
+
 # Call back in daily_payments() program 
 def _pass_row(ws,i,title="Cancelado",msg=None):
     """
     Skips processing for the current row by marking it as 'No Aplicado' and formatting it visibly.
-    Displays a warning message to notify the user and applies red font styling to highlight the status.
+    Sends a warning to the run log (no blocking popup) and applies red font styling to highlight the status.
 
     Workflow:
     - If no message is passed, generates a default warning message based on row number
-    - Shows warning popup with provided title and message
+    - Logs a warning with provided title and message in the run log
     - Marks the payment row in column 12 as 'No Aplicado'
     - Applies red font color to the full row for visual tracking
 
     Parameters:
     - ws (Worksheet): Excel worksheet where the payment row exists
     - i (int): Row index to be marked as skipped
-    - title (str, optional): Title of the warning popup (defaults to "Cancelado")
+    - title (str, optional): Title of the warning (defaults to "Cancelado")
     - msg (str, optional): Message content; auto-generated if not provided
 
     Returns:
-    - None: modifies worksheet directly and shows message dialog
+    - None: modifies worksheet directly and logs the message
     """
     # Default title and msg to _pass_row
     if msg is None:
         msg=f'Fila {i}: se omite y pasa al siguiente.'
-    show_warning(title,msg)
+    log_event(WARNING, f"{title}: {msg}", row=i)
     ws.cells(i, 12).value = "No Aplicado"
     ws.range(f'{i}:{i}').api.Font.Color = 255
 
@@ -49,13 +66,11 @@ def _pass_row(ws,i,title="Cancelado",msg=None):
 def _new_concept(description, doc_date):
     """
     Extracts and formats the payment concept from a bank transaction description.
-    Matches sender details for transfers or retains original label for specific keywords.
+    Kept as a single-description wrapper over the compiled rule engine ('bank_concept_rules').
 
     Workflow:
-    - Uses regex to detect standard bank transfer format and extract the sender
-    - Formats concept as "Tr [Sender] [Date]" using the document date
-    - If keywords "INGRESO" or "PAGO" are present, retains original description
-    - If no match is found, returns None
+    - Runs the description through the ordered concept rules (e.g. transfers → "Tr [Sender] [Date]")
+    - Returns None if no rule matches or the matching rule drops the movement
 
     Parameters:
     - description (str): Raw transaction description from bank file
@@ -64,16 +79,442 @@ def _new_concept(description, doc_date):
     Returns:
     - str or None: Formatted concept string or None if no valid match is found
     """
-    match = re.search(r"Transferencia(?: Inmediata)? De\s+(.*?)(,|$)", description)
-    if match:
-        remitente = match.group(1).strip()
-        return f"Tr {remitente} {doc_date}"
-    elif "INGRESO" in description or "PAGO" in description:
-        return description
-    return None
+    match = concept_rules().classify(description, str(doc_date))
+    if match is None or not match.keep:
+        return None
+    return match.concept
+
+# Call back in bank_file() program
+def _fit_row(row, width=15):
+    """
+    Pads or trims a row to the bank file layout (A: date … M: entry number, N: match confidence, O: movement id).
+
+    Parameters:
+    - row (list): Row values
+    - width (int, optional): Number of columns of the layout
+
+    Returns:
+    - list: Row with exactly `width` values
+    """
+    row = list(row[:width])
+    return row + [None] * (width - len(row))
+
+# Call back in bank_file() program
+def _bank_date(value) -> date:
+    """
+    Reads a bank file date whether Excel kept it as 'dd/mm/yyyy' text or converted it to a date.
+
+    Parameters:
+    - value: Raw cell value
+
+    Returns:
+    - date: Document date
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value).strip(), "%d/%m/%Y").date()
+
+# Call back in bank_file() program
+def _clean_bank_rows(raw_rows):
+    """
+    Cleans the raw bank rows in memory: removes dots from the raw description column (C),
+    applies the configured column deletions of 'bank_file_detail' and skips rows without date.
+
+    Parameters:
+    - raw_rows (list[list]): Bank rows starting at the bank column header row
+
+    Returns:
+    - list[list]: Header plus movement rows (A: date, B: description, C: amount, …)
+    """
+    rows = [list(row) for row in raw_rows]
+    for row in rows:
+        if len(row) > 2 and isinstance(row[2], str):
+            row[2] = row[2].replace(".", "")
+    rows = drop_columns(rows, Load_SAP_info.config["bank_file_detail"]["delete_columns"])
+    return [_fit_row(rows[0])] + [_fit_row(row) for row in rows[1:] if row and row[0] not in (None, "")]
+
+# Call back in bank_file() program
+def _bank_movements(rows) -> list:
+    """
+    Fingerprints every movement of the cleaned statement (date, reference, amount, description).
+
+    Parameters:
+    - rows (list[list]): Header plus movement rows from `_clean_bank_rows`
+
+    Returns:
+    - list[tuple]: (fingerprint, movement date ISO) per movement row
+    """
+    movements = []
+    for row in rows[1:]:
+        movement_date = _bank_date(row[0])
+        movements.append((movement_fingerprint(movement_date, row[1], row[2], row[3]), movement_date.isoformat()))
+    return movements
+
+# Call back in bank_file() program
+def _treat_bank_rows(rows):
+    """
+    Turns the new bank movements into the treated table, entirely in memory.
+
+    Workflow:
+    - Classifies the whole description column with the concept rule engine
+    - Drops negative amounts and descriptions without a rule (or with a drop rule)
+    - Fills concept (F), concept length (G) and assignment (H), plus the rule's default
+      client (D) and action (I) when the file leaves them empty
+
+    Parameters:
+    - rows (list[list]): Header plus movement rows from `_clean_bank_rows`
+
+    Returns:
+    - list[list]: Header plus treated rows
+    """
+    table = [rows[0]]
+    rules = concept_rules()
+    rules.counts.clear()
+    doc_dates = [_bank_date(row[0]) for row in rows[1:]]
+    matches = rules.classify_all((str(row[1]) for row in rows[1:]),
+                                 (doc_date.strftime("%d/%m/%Y") for doc_date in doc_dates))
+    for row, doc_date, match in zip(rows[1:], doc_dates, matches):
+        row = list(row)
+        amount = row[2]
+        if amount is None or amount < 0:
+            continue
+        if match is None or not match.keep:
+            continue
+        row[0] = doc_date.strftime("%d/%m/%Y")
+        row[5] = match.concept
+        row[6] = len(match.concept)
+        row[7] = doc_date.strftime("%Y%m%d")
+        # Rule defaults never overwrite values already in the file
+        if match.client and not row[3]:
+            row[3] = match.client
+        if match.action and not row[8]:
+            row[8] = match.action
+        table.append(row)
+    return table
+
+# Call back in bank_file() program
+def _prefill_senders(rows, index):
+    """
+    Prefills client code (D) and action (I) of transfer rows from the sender history,
+    writing the match confidence in column N. Values already in the file are kept.
+
+    Parameters:
+    - rows (list[list]): Header plus treated rows
+    - index (SenderIndex): Sender → client/action index
+
+    Returns:
+    - int: Number of rows prefilled
+    """
+    filled = 0
+    for row in rows[1:]:
+        hit = index.lookup(sender_from_concept(row[5]))
+        if hit is None:
+            continue
+        client_code, action, confidence = hit
+        if not row[3]:
+            row[3] = client_code
+        if not row[8]:
+            row[8] = action
+        row[13] = confidence
+        filled += 1
+    return filled
+
+# Call back in bank_file() and daily_payments() programs
+def _record_senders(rows) -> int:
+    """
+    Adds the sender → client/action pairs of applied transfer rows to the sender history.
+
+    Parameters:
+    - rows (list[list]): Bank file rows marked 'Aplicado'
+
+    Returns:
+    - int: Number of uses recorded
+    """
+    return record_sender_matches((sender_from_concept(row[5]), row[3], row[8]) for row in rows
+                                 if len(row) > 8 and sender_from_concept(row[5]))
+
+# Call back in bank_file() program
+def _import_sender_history():
+    """
+    Seeds the sender history from already processed bank files (columns D, F and I of 'Aplicado' rows).
+
+    Returns:
+    - None: sender history is updated
+    """
+    ask = show_question("Autocompletado", "No hay histórico de remitentes.\n¿Cargar ficheros del banco ya tratados?")
+    if ask != YES:
+        return
+    paths = ask_open_files("Abre los ficheros del banco ya tratados")
+    if not paths:
+        return
+    recorded = 0
+    for path in paths:
+        wb_hist = check_wb_open(path)
+        rows = wb_hist.sheets[0].used_range.options(ndim=2).value
+        wb_hist.close()
+        recorded += _record_senders([row for row in rows[1:] if len(row) > 11 and row[11] == "Aplicado"])
+    print(f"[INFO] Histórico de remitentes: {recorded} usos cargados")
+
+# Call back in daily_payments()
+def _invoice_references(search_data1, search_data2) -> list | None:
+    """
+    Reads the list of invoice references of a FACTURA row (J and K, separated by commas, semicolons or spaces).
+
+    Parameters:
+    - search_data1: Search data 1 (J)
+    - search_data2: Search data 2 (K)
+
+    Returns:
+    - list[str] or None: References when J lists several of them, None for the single reference / range form
+    """
+    first = re.split(r"[,;\s]+", cell_text(search_data1).strip())
+    if len(first) < 2:
+        return None
+    second = re.split(r"[,;\s]+", cell_text(search_data2).strip())
+    return [reference for reference in first + second if reference]
+
+# Call back in daily_payments()
+def preflight_check(rows) -> dict:
+    """
+    Checks every pending row of the treated bank file against the rules of its action
+    before anything is posted, so rows that cannot succeed never reach SAP.
+
+    Rules:
+    - Every row: known action, valid date (A), numeric amount (C) and client code (D)
+    - HASTA / SOLO: search data 1 (J) must be a date
+    - ENTRE: search data 1 and 2 (J, K) must be dates, in order
+    - FACTURA: invoice reference in search data 1 (J); several references may be listed in J/K
+      separated by commas, semicolons or spaces
+    - REEMBOLSO: OS number in search data 1 (J)
+
+    Parameters:
+    - rows (list[list]): Sheet rows read in one block (header first)
+
+    Returns:
+    - dict: {row number: [problems]} for every invalid row
+    """
+    problems = {}
+    for i, row in enumerate(rows[1:], start=2):
+        row = _fit_row(row)
+        if str(row[11] or "").strip() == "Aplicado":
+            continue
+        errors = []
+        action = str(row[8] or "").strip().upper()
+        search_data1, search_data2 = row[9], row[10]
+        if not action:
+            errors.append("No se indicó acción")
+        elif action not in ACTIONS:
+            errors.append(f"Acción '{action}' no reconocida")
+        try:
+            _bank_date(row[0])
+        except (TypeError, ValueError):
+            errors.append(f"Fecha no válida: {row[0]}")
+        if not isinstance(row[2], (int, float)):
+            errors.append(f"Importe no numérico: {row[2]}")
+        if not row[3]:
+            errors.append("Falta el código de cliente")
+        if action in ("HASTA", "SOLO") and not isinstance(search_data1, (date, datetime)):
+            errors.append("Búsqueda 1 debe ser una fecha")
+        if action == "ENTRE":
+            if not isinstance(search_data1, (date, datetime)) or not isinstance(search_data2, (date, datetime)):
+                errors.append("Búsqueda 1 y 2 deben ser fechas")
+            elif search_data1 > search_data2:
+                errors.append("Búsqueda 1 es posterior a Búsqueda 2")
+        if action == "FACTURA" and not search_data1:
+            errors.append("Falta la referencia de la factura en Búsqueda 1")
+        if action == "REEMBOLSO" and not search_data1:
+            errors.append("Falta el número de OS en Búsqueda 1")
+        if errors:
+            problems[i] = errors
+    return problems
 
 # Call back in daily_payments()
-def _load_template(doc_date , client_category:str = "",client_code:str ="" ):
+def _exclude_rows(ws, rows, problems):
+    """
+    Marks every invalid row as 'No Aplicado' (status column written in one block, red font)
+    and lists all problems in a non-modal table.
+
+    Parameters:
+    - ws: Excel Worksheet of the treated bank file
+    - rows (list[list]): Sheet rows read in one block (header first)
+    - problems (dict): Result of `preflight_check`
+
+    Returns:
+    - None: updates Excel file and shows the problems window
+    """
+    statuses = [_fit_row(row)[11] for row in rows[1:]]
+    for i in problems:
+        statuses[i - 2] = "No Aplicado"
+    write_column(ws, "L", 2, statuses)
+    for i in problems:
+        ws.range(f'{i}:{i}').api.Font.Color = 255
+    table = [[i, _fit_row(rows[i - 1])[8], error] for i, errors in sorted(problems.items()) for error in errors]
+    show_table("Validación previa", f"{len(problems)} filas no se aplicarán:", ["Fila", "Acción", "Problema"], table)
+
+# Call back in daily_payments()
+def _resume_rows(ws, rows, journal, fingerprints):
+    """
+    Brings the sheet up to date with the run journal before scheduling, so a crashed run resumes where it stopped.
+
+    Workflow:
+    - Rows already posted in a previous run get 'Aplicado' and their entry number back (the workbook may not have been saved)
+    - Rows left between intent and result ask once whether the entry was saved in SAP:
+        - Yes: the entry number is asked and journaled, and the row is marked 'Aplicado'
+        - No: the interrupted attempt is journaled as failed and the row stays pending
+    - Posted rows whose spool was not saved are reported in the run log
+
+    Parameters:
+    - ws: Excel Worksheet of the treated bank file
+    - rows (list[list]): Sheet rows read in one block (header first), updated in place
+    - journal (RunJournal): Journal of the workflow
+    - fingerprints (list[str]): Fingerprint per sheet row, aligned with `rows`
+
+    Returns:
+    - None: updates Excel file, `rows` and the journal
+    """
+    for i in range(2, len(rows) + 1):
+        row = rows[i - 1] = _fit_row(rows[i - 1])
+        fingerprint = fingerprints[i - 1]
+        if journal.interrupted(fingerprint):
+            ask = show_question("Ejecución interrumpida",
+                                f"Fila {i} ({row[5]} {row[2]}) quedó a medias en la ejecución anterior.\n"
+                                "¿Se llegó a grabar el asiento en SAP?", explicit=True)
+            entry_num = ask_user_string("número de asiento", explicit=True) if ask == YES else None
+            if entry_num:
+                journal.record(POSTED, fingerprint, row=i, entry_num=entry_num)
+            else:
+                journal.record(FAILED, fingerprint, row=i, reason="Ejecución interrumpida")
+        entry_num = journal.entry_number(fingerprint)
+        if entry_num is None:
+            continue
+        if journal.spool_pending(fingerprint):
+            log_event(WARNING, f"El asiento {entry_num} no tiene el spool guardado", row=i)
+        if str(row[11] or "").strip() != "Aplicado" or str(row[12] or "") != str(entry_num):
+            log_event(INFO, f"Ya contabilizada con el asiento {entry_num}; se recupera su estado", row=i)
+            row[11], row[12] = "Aplicado", entry_num
+            ws.cells(i, 12).value = "Aplicado"
+            ws.cells(i, 13).value = entry_num
+            ws.range(f'{i}:{i}').api.Font.ColorIndex = -4105
+
+# SAP screen used by each action: F-04 item searches share the selection screen, the rest differ
+_ACTION_GROUPS = {"FACTURA": 0, "TODO": 0, "HASTA": 0, "SOLO": 0, "ENTRE": 0,
+                  "A CUENTA": 1, "REEMBOLSO": 2, "RELACION": 3}
+
+# Call back in daily_payments()
+def schedule_rows(rows, excluded, categories=None) -> list:
+    """
+    Orders the pending rows so consecutive postings reuse the same transaction and screens:
+    grouped by SAP screen, then action, then client category, then client, keeping the
+    bottom-up order inside each group. Consecutive F-04 rows stay on its initial screen
+    (see call_transaction's `reuse`).
+
+    Parameters:
+    - rows (list[list]): Sheet rows read in one block (header first)
+    - excluded (dict | set): Row numbers left out (e.g. pre-flight problems)
+    - categories (dict, optional): Client category per row number (from the decision grid)
+
+    Returns:
+    - list[int]: Row numbers in processing order
+    """
+    pending = []
+    for i in range(len(rows), 1, -1):
+        row = _fit_row(rows[i - 1])
+        if i in excluded or str(row[11] or "").strip() == "Aplicado":
+            continue
+        action = str(row[8] or "").strip().upper()
+        category = (categories or {}).get(i, "D")
+        pending.append((_ACTION_GROUPS.get(action, len(_ACTION_GROUPS)), action, category, key_part(row[3]), -i))
+    return [-position for *_, position in sorted(pending)]
+
+# Call back in daily_payments()
+def _write_audit(wb, audit):
+    """
+    Writes the processing order of the run to the 'Auditoría' sheet in one block.
+
+    Parameters:
+    - wb: Excel Workbook of the treated bank file
+    - audit (list[list]): Order, row, action, client, start time, F-04 screen, status and entry number per row
+
+    Returns:
+    - None: updates Excel file
+    """
+    try:
+        ws_audit = wb.sheets["Auditoría"]
+        ws_audit.clear()
+    except Exception:
+        ws_audit = wb.sheets.add(after=wb.sheets[-1])
+        ws_audit.name = "Auditoría"
+    ws_audit.range("A1").value = [["Orden", "Fila", "Acción", "Cliente", "Inicio", "F-04", "Estado", "Asiento"]] + audit
+    ws_audit.range("A1:H1").font.bold = True
+    ws_audit.autofit()
+
+# Call back in daily_payments()
+def _default_decisions(rows, pending) -> dict:
+    """
+    Presets every row decision from the configuration, so the grid (or a decision file) only
+    has to confirm or correct them: where the detail of a RELACION payment is comes from
+    'relacion_detail' (per client code, or its default) instead of a question per row.
+    Manual amounts start empty and are typed in the grid.
+
+    Parameters:
+    - rows (list[list]): Sheet rows read in one block (header first)
+    - pending (list[int]): Row numbers to post
+
+    Returns:
+    - dict: {row number: {"category", "no_pa", "detail", "manual", "amounts"}}
+    """
+    config = Load_SAP_info.config.get("relacion_detail", {})
+    by_client = {key_part(code): source for code, source in config.get("clients", {}).items()}
+    return {i: {"category": "D", "no_pa": False, "manual": "no", "amounts": [],
+                "detail": by_client.get(key_part(rows[i - 1][3]), config.get("default", "fichero"))}
+            for i in pending}
+
+# Call back in daily_payments()
+def _match_open_items(amount, client_code):
+    """
+    Proposes the client's open items that add up to a payment without remittance detail.
+
+    Workflow:
+    - Reads the client's open items from the open-items mirror after a recent full refresh (a delta one
+      keeps cleared items), otherwise from an FBL5N export (columns from 'open_items_detail')
+    - Searches item combinations matching the amount exactly or within the configured tolerance
+    - Lets the user pick one of the ranked candidates
+
+    Parameters:
+    - amount (float): Payment amount
+    - client_code: SAP client code
+
+    Returns:
+    - list or None: References of the chosen items, or None to select them manually
+    """
+    detail = Load_SAP_info.config["open_items_detail"]
+    if is_mirror_complete():
+        items = [OpenItem(reference, cents, date.fromisoformat(due_date) if due_date else None, doc_number, doc_type, client)
+                 for client, reference, cents, due_date, doc_number, doc_type in open_items([client_code])]
+    else:
+        export_path = ask_open_file(f"Abre las partidas abiertas (FBL5N) del cliente {client_code}")
+        if not export_path:
+            Load_SAP_info.ContinueProgram = True  # Falls back to manual selection instead of skipping the row
+            return None
+        wb_items = check_wb_open(export_path)
+        rows = wb_items.sheets[0].used_range.options(ndim=2).value
+        wb_items.close()
+        items = read_open_items(rows, client_code, detail)
+    candidates = find_combinations(amount, items, detail["tolerance"], detail["max_candidates"],
+                                   detail["max_exact_items"], detail["time_budget"])
+    if not candidates:
+        show_warning("Sin combinación", f"No hay partidas del cliente {client_code} que sumen {amount}.\nSelecciónalas manualmente.")
+        return None
+    labels = [describe(candidate) for candidate in candidates]
+    choice = ask_choice("Combinaciones", f"Pago de {amount} €:", labels)
+    if choice is None:
+        return None
+    return [item.reference for item in candidates[labels.index(choice)].items]
+
+# Call back in daily_payments()
+def _load_template(doc_date , client_category:str = "",client_code:str ="", references:list | None = None):
     """
     Loads and prepares the SAP batch template for invoice entry.
     Clears prior data, sets required metadata fields, and invokes manual invoice selection.
@@ -85,20 +526,21 @@ def _load_template(doc_date , client_category:str = "",client_code:str ="" ):
         - Document date
         - Client category (if provided)
         - Client code (placeholder; requires field verification)
-    - Launches manual invoice selector from specified cell
+    - Writes the given invoice references from D10, or launches manual invoice selector from that cell
     - Saves and closes the updated template
     
     Parameters:
     - doc_date (date): Date to assign to the SAP document fields
     - client_category (str, optional): SAP category indicator (e.g. 'D' for customer)
     - client_code (str, optional): SAP client code (currently inactive, pending field review)
+    - references (list, optional): Invoice references already chosen (e.g. by the amount matcher)
     
     Returns:
     - str: Path to the modified batch template file
     """
     # Open Template file
-    batch_template_path = Load_SAP_info.config["batch_template_path"]
-    wb_template = xw.Book(batch_template_path)
+    batch_template_path = template_path("batch_template_path")
+    wb_template = check_wb_open(batch_template_path)
     ws_template = wb_template.sheets[0]
    
     # Clear template before insert data
@@ -119,7 +561,10 @@ def _load_template(doc_date , client_category:str = "",client_code:str ="" ):
         ws_template.cells().value = client_code # revisar
     
     # Callback the range selector Class to select the invoinces
-    launch_range_selector(wb_template, 'D10')
+    if references:
+        ws_template.range("D10").options(transpose=True).value = references
+    else:
+        launch_range_selector(wb_template, 'D10')
     wb_template.save()
     wb_template.close()
     return batch_template_path
@@ -133,77 +578,89 @@ def bank_file():
 
     Cleans, formats, and validates today's bank data; reinserts not applied rows from the previous day;
     and prompts the user for row-level decisions to proceed with SAP posting.
+    The whole table is prepared in memory: each workbook is read once and the result is written back
+    in a single block, with validation and conditional formatting applied once.
 
     Workflow:
-    - Open today's bank file and remove header rows
-    - Replace dots from column C for cleaner matching
-    - Open yesterday's payments file and identify "No Aplicado"(not apply) entries
-    - Locate last matched payment from yesterday and truncate remaining rows from today's file
-    - Remove unused columns to simplify layout
-    - Set up dropdown validation for SAP action options
-    - For each row:
-        - Delete negative amounts and rows with unmatched descriptions
-        - Assign concept, calculate text length, format assignment date
-    - Create headers and apply conditional formatting
-    - Reinsert "No Aplicado"(not apply) rows from previous day into today's sheet
+    - Read today's bank file (without the 7 bank header rows), offering the one found by the hot folder
+    - Replace dots from the description column for cleaner matching
+    - Remove unused columns to simplify layout (same column list as `setup_headers`)
+    - Keep only movements not ingested yet, diffing their fingerprints against the local watermark
+      (first run only: open yesterday's payments file and cut at its last payment instead)
+    - For each new row:
+        - Drop negative amounts and rows with unmatched descriptions
+        - Assign concept, its text length and the assignment date
+    - Prefill client code, action and match confidence from the sender history
+    - Append "No Aplicado"(not apply) rows from previous day (from the local store)
+    - Stamp every row with its movement id (O), which keys the posting journal while the row is carried over
+    - Write the table, create headers, dropdown validation and conditional formatting
+    - Move the watermark past every movement of the statement
     - Prompt user to review and begin row-by-row processing
 
     Returns:
     - None: updated Excel workbook is saved and ready for SAP interaction
     """
-    # Open today's bank file
-    bank_path = ask_open_file('Abre el fichero del banco de hoy')  
+    # Open today's bank file (the latest one the hot folder found, if the user takes it) and read it once,
+    # skipping the first 7 rows "bank headers"
+    bank_path = None
+    inbox = [entry for entry in inbox_files(BANK_STATEMENT) if os.path.exists(entry[1])]
+    if inbox:
+        ask = show_question("Bandeja de entrada", f"¿Usar el extracto {os.path.basename(inbox[-1][1])} de la bandeja de entrada?")
+        if ask == YES:
+            bank_path = inbox[-1][1]
+    if not bank_path:
+        bank_path = ask_open_file('Abre el fichero del banco de hoy')  
     wb = check_wb_open(bank_path)
     ws = wb.sheets[0]
-    # Delete first 7 rows "bank headers"
-    ws.range('1:7').delete()
-    # Replace "." in column C
-    col_c = ws.range('C:C')
-    col_c.api.Replace(What=".", Replacement="", LookAt=2, MatchCase=False, SearchFormat=False, ReplaceFormat=False)
-    # Open yesterday's payments file
-    yest_file_path = ask_open_file('Abre los pagos del último día')
-    wb_yest = check_wb_open(yest_file_path)
-    ws_yest = wb_yest.sheets[0]
-    # Get the Descriptio of the last payment
-    last_pay = ws_yest.range('B2').value
-    # Search for last payment in bank file and get its row
-    find_result = col_c.api.Find(last_pay)
-    if not find_result:
-        print("Last payment not found.")
-        return
-    find_result_row = find_result.Row
-    # Get No Aplicado rows
-    dic_no_apply = {}
-    end_row_yest = ws_yest.range("C1").end("down").row
-    for i in range(2, end_row_yest + 1):
-        if ws_yest.cells(i, 12).value == "No Aplicado":
-            dic_no_apply[i] = i
-    # Deletes all rows following the last known payment found in today's bank file
-    last_row = ws.range("C1").end("down").row
-    ws.range(f"{find_result_row}:{last_row}").delete()
-    # Remove non-essential columns to simplify structure and setup headers
-    setup_headers(ws, "bank_file")
+    # Explicit range from row 8, wherever the used range starts (blank leading rows or columns)
+    last_cell = ws.used_range.last_cell
+    rows = _clean_bank_rows(ws.range((8, 1), (last_cell.row, last_cell.column)).options(ndim=2).value)
+    movements = _bank_movements(rows)
+    bank_account = Load_SAP_info.config["bank_account"]
+    if has_bank_watermark(bank_account):
+        # Keep only the movements not ingested yet and carry over the stored "No Aplicado" rows
+        is_new = new_movements(bank_account, movements)
+        carry_rows = [_fit_row(row) for row in pending_movements(bank_account)]
+    else:
+        # First run: locate yesterday's last payment as before to seed the watermark
+        yest_file_path = ask_open_file('Abre los pagos del último día')
+        wb_yest = check_wb_open(yest_file_path)
+        yest_rows = wb_yest.sheets[0].used_range.options(ndim=2).value
+        wb_yest.close()
+        last_pay = yest_rows[1][1] if len(yest_rows) > 1 else None
+        cut = next((index for index, row in enumerate(rows[1:]) if last_pay and str(last_pay) in str(row[1] or "")), None)
+        if cut is None:
+            print("Last payment not found.")
+            return
+        is_new = [index < cut for index in range(len(movements))]
+        carry_rows = [_fit_row(row) for row in yest_rows[1:] if len(row) > 11 and row[11] == "No Aplicado"]
+    # Rows carried over from before movement ids existed get a new one (they were never posted)
+    for row in carry_rows:
+        if not row[14]:
+            row[14] = uuid.uuid4().hex
+    # Every movement keeps its watermark id (O), the key of the posting journal from day to day
+    for row, movement_id in zip(rows[1:], movement_ids(movements)):
+        row[14] = movement_id
+    rows = _treat_bank_rows([rows[0]] + [row for row, new in zip(rows[1:], is_new) if new])
+    print(f"[INFO] Reglas de concepto: {concept_rules().summary()}")
+    # Prefill client and action from the sender history
+    index = sender_index()
+    if not len(index):
+        _import_sender_history()
+        index = sender_index()
+    print(f"[INFO] Filas autocompletadas: {_prefill_senders(rows, index)}")
+    # Write the final table in one block (dates and assignments kept as text)
+    end_row = len(rows) + len(carry_rows)
+    ws.clear()
+    ws.range("A:A").number_format = "@"
+    ws.range("H:H").number_format = "@"
+    ws.range("N:N").number_format = "0%"
+    ws.range("A1").value = rows + carry_rows
+    format_headers(ws, "bank_file")
+    if carry_rows:
+        ws.range(f"{len(rows) + 1}:{end_row}").api.Font.Color = 255
     # Add validation list
-    end_row = ws.range("A1").end("down").row
-    val_list = ["SOLO", "TODO", "HASTA", "ENTRE", "RELACION", "REEMBOLSO", "A CUENTA", "FACTURA"]
-    set_data_validation(ws,9,end_row,val_list,False)
-    # Process rows: Delete negatives, format info
-    for i in reversed(range(2, end_row + 1)):
-        doc_date = datetime.strptime(ws.cells(i, 1).value, "%d/%m/%Y").date()
-        assignment = doc_date.strftime("%Y%m%d")
-        doc_date = doc_date.strftime("%d/%m/%Y")
-        description = str(ws.cells(i, 2).value)
-        amount = ws.cells(i, 3).value
-        ws.cells(i, 7).formula = f"=LEN(F{i})"
-        ws.cells(i, 8).value = assignment
-        if amount < 0:
-            ws.range(f"{i}:{i}").delete()
-            continue
-        concept =_new_concept(description, doc_date)
-        if concept is None:
-            ws.range(f"{i}:{i}").delete()
-            continue
-        ws.cells(i, 6).value = concept
+    set_data_validation(ws,9,end_row,ACTIONS,False)
     # Conditional formatting
     data_range = ws.range(f'G2:G{end_row}')
     data_range.api.FormatConditions.Add(1, 1, 1, "=50")  # xlCellValue, xlLessEqual
@@ -212,15 +669,11 @@ def bank_file():
     data_range.api.FormatConditions.Add(1, 1, 1, ">50")
     data_range.api.FormatConditions(2).Font.Color = -16776961
     data_range.api.FormatConditions(2).Interior.Color = 13551615
-    # Reinsert No Aplicado rows
-    insert_row = ws.range("A1").end("down").row
-    if dic_no_apply:
-        for row in dic_no_apply:
-            ws_yest.range(f"{row}:{row}").copy()
-            insert_row += 1
-            ws.range(f"A{insert_row}").paste()
-    wb_yest.close()
     wb.save()
+    mark_movements_ingested(bank_account, movements)
+    for file_hash, path, _, _ in inbox:
+        if path == bank_path:
+            set_inbox_status(file_hash, "processed")
     show_info("User Inputs", "Selecciona que hacer con cada pago")
     
     
@@ -231,18 +684,26 @@ def daily_payments():
     and executes entries using GUI scripting. ⚠️ Each accounting entry must be manually saved in SAP by the user.
     
     Workflow:
-    - Load daily Excel file containing treated bank payments
-    - Prompt for bank account configuration and client category
+    - Load daily Excel file containing treated bank payments, reading every row once
+    - Pre-flight check of every row; invalid rows are marked 'No Aplicado' and listed in a non-modal table
+    - Resume from the run journal (keyed by movement id): rows posted by a crashed run get their status back, interrupted ones are confirmed
+    - Ask client category, PA, detail source and manual entries of every pending row in one decision grid
+    - Order pending rows by SAP screen, action, category and client (already applied and invalid rows are left out)
     - For each payment row:
-        - Skip already marked rows
+        - Stay on the F-04 initial screen left by the previous posting instead of re-entering the transaction
         - Determine posting logic based on the 'Acción' field (e.g., RELACION, FACTURA, TODO, etc.)
         - Load invoice detail or prepare manual input if needed
         - Apply debit and credit entries via SAP session
         - Handle custom scenarios like A CUENTA or REEMBOLSO
         - Simulate and confirm SAP transactions
         - Fill autogenerated accounting fields
-        - Store SAP spool, mark row as 'Aplicado', and log entry number
+        - Journal the intent (plan hash) before posting, refusing rows that already have an entry number
+        - Journal the entry number (read from the status bar), mark row as 'Aplicado', and log entry number
+    - Save the spool of every posted entry and journal its status
+    - Write the processing order, F-04 screen reuse and final status of each row to the 'Auditoría' sheet
     - Save the Excel workbook with status updates and notify user
+    - Store the 'No Aplicado' rows so the next bank file carries them over
+    - Add the applied rows' sender → client/action pairs to the sender history
 
     Returns:
     - None: entries are posted to SAP, results written to Excel, and confirmation shown at completion
@@ -259,33 +720,66 @@ def daily_payments():
     wb = check_wb_open(bank_path)
     ws = wb.sheets[0]  # Sheet index starts at 0
     end_row = ws.range("A1").end("down").row
+    # Read every row once and exclude the ones that cannot be posted
+    rows = ws.range((1, 1), (end_row, 15)).options(ndim=2).value
+    problems = preflight_check(rows)
+    if problems:
+        _exclude_rows(ws, rows, problems)
+    # Rows are identified by the movement id stamped at ingestion (O), which stays the same while a row is carried
+    # over; files treated before it existed fall back to date, bank description and amount.
+    # The journal restores what a crashed run already posted
+    journal = RunJournal("daily_payments")
+    fallback = row_fingerprints((row[0], row[1], row[2]) for row in rows)
+    fingerprints = [str(row[14]) if len(row) > 14 and row[14] else key for row, key in zip(rows, fallback)]
+    _resume_rows(ws, rows, journal, fingerprints)
     # SAP G/L Bank Account 
     bank_account = Load_SAP_info.config["bank_account"]
-    # Prompt for vendor account context
-    acc_confirmation = show_question("Confirmación","¿Hay alguna cuenta de Acreedor?")
-    # Customer default category (Vendor category K, G/L category S)
-    client_category = "D"
-    # Iterate from bottom to top to preserve row integrity during actions
-    for i in range(end_row, 1, -1):
-        # Skip already processed rows
-        if (ws.cells(i, 12).value or "").strip() == "Aplicado":
-            show_info("Salto", f"Fila {i}: ya aplicado, se salta.")
-            continue
+    # Ask every row decision (category, PA, detail source, manual entries) upfront in one grid
+    pending = schedule_rows(rows, problems)
+    defaults = _default_decisions(rows, pending)
+    decisions = ask_row_decisions([(i, (rows[i - 1][8] or "").strip().upper(), rows[i - 1][3],
+                                    rows[i - 1][2], rows[i - 1][5]) for i in sorted(pending)], defaults)
+    if decisions is None:
+        return
+    # Decisions left out (e.g. by a decision file) keep their configured default
+    decisions = {i: {**defaults[i], **decisions.get(i, {})} for i in pending}
+    applied_rows = []
+    # Group rows so consecutive postings reuse the same transaction, category and client
+    order = schedule_rows(rows, problems, {i: decision["category"] for i, decision in decisions.items()})
+    started = {}
+    # F-04 initial screen per row: True if reused from the previous posting, False if entered
+    reused = {}
+    # Entries posted in this run, their spools are saved once the postings are done
+    posted = []
+    last_intent = None
+    for i in order:
+        # A row whose posting stopped early ('No Aplicado') closes its intent as failed
+        if last_intent and journal.interrupted(fingerprints[last_intent - 1]):
+            journal.record(FAILED, fingerprints[last_intent - 1], row=last_intent, reason="No Aplicado")
+        row = _fit_row(rows[i - 1])
+        started[i] = datetime.now()
         # Set payment metadata
-        doc_date = datetime.strptime(ws.cells(i, 1).value,"%d/%m/%Y").date()
+        doc_date = _bank_date(row[0])
         due_date = datetime.strftime(doc_date,"%d.%m.%Y")
-        assignment = ws.cells(i,8).value
-        amount = float(ws.cells(i, 3).value)
-        commentary = ws.cells(i, 6).value
-        client_code = ws.cells(i, 4).value
-        search_data1 = ws.cells(i, 10).value
-        search_data2 = ws.cells(i, 11).value
-        action = (ws.cells(i, 9).value or "").strip().upper()
-        # Ask user for account category if needed
-        if acc_confirmation == QMessageBox.Yes:
-            cat, ok = QInputDialog.getText(None, "Categoría", f"Cliente Nº {client_code}\nD = Deudor / K = Acreedor:")
-            if ok and cat.strip().upper() in ["D", "K"]:
-                client_category = cat.strip().upper()
+        assignment = row[7]
+        amount = float(row[2])
+        commentary = row[5]
+        client_code = row[3]
+        search_data1 = row[9]
+        search_data2 = row[10]
+        action = (row[8] or "").strip().upper()
+        # Customer category from the decision grid (Vendor category K)
+        decision = decisions[i]
+        client_category = decision["category"]
+        # Idempotency: never post twice a row that already has an entry number
+        fingerprint = fingerprints[i - 1]
+        if journal.entry_number(fingerprint) is not None:
+            log_event(WARNING, f"Ya contabilizada con el asiento {journal.entry_number(fingerprint)}; no se vuelve a aplicar", row=i)
+            continue
+        journal.record(INTENT, fingerprint, row=i,
+                       plan=plan_hash({"action": action, "client": client_code, "amount": amount, "date": due_date,
+                                       "search": [search_data1, search_data2], "decision": decision}))
+        last_intent = i
         # Handle missing action with status update
         if not action:
             title="Acción faltante"
@@ -294,23 +788,32 @@ def daily_payments():
             continue
         # RELACION: load invoice details and handle manual entries if nedded
         elif action == "RELACION":
-           # Confirm if invoinces must be selected
-           no_pa = show_question("Confirmacion", "¿Es un pago sin PA?")
-           # Confirm if the detail is in the Bank file (another worksheet)
-           ask  = show_question("Confrimación", "¿Está la relación en el fichero del banco?")
-           # Open file with the payment detail if ask match
-           if ask == QMessageBox.No:
+           # Decisions taken in the grid: PA / no PA and where the detail is
+           no_pa = YES if decision["no_pa"] else NO
+           wb_payment_detail = None
+           references = None
+           # Open file with the payment detail when it comes apart from the bank file
+           if decision["detail"] == "fichero":
                payment_detail_path = ask_open_file(f"Abre el archivo con el detalle de Facturas {ws.range(f'f{i}').value} {ws.range(f'c{i}').value}")
+               if Load_SAP_info.ContinueProgram == False:
+                   _pass_row(ws,i)
+                   continue
                wb_payment_detail=check_wb_open(payment_detail_path)
+           # Without a remittance detail, look for the open items adding up to the amount (a payment without PA needs none)
+           elif decision["detail"] == "sin" and no_pa == NO:
+               references = _match_open_items(amount, client_code)
            # Copy invoices into the template for SAP upload
-           if no_pa == QMessageBox.No:
-               batch_template_path = _load_template(doc_date,client_category)
+           if no_pa == NO:
+               batch_template_path = _load_template(doc_date,client_category,references=references)
+               if Load_SAP_info.ContinueProgram == False:
+                   _pass_row(ws,i)
+                   continue
                # Callback the SAP Transaction to load the Template
                batch_input(batch_template_path)
                if Load_SAP_info.ContinueProgram == False: pass
            # Process payments without associated invoices or item selection—typically used for manual input of multiple entries (Payment on account).
            else:
-               call_transaction( "F-04")
+               reused[i] = call_transaction("F-04", reuse=True)
            new_entry( "40", bank_account) # New Debit entry into G/L account
            if Load_SAP_info.ContinueProgram == False:
                _pass_row(ws,i)
@@ -319,50 +822,43 @@ def daily_payments():
            if Load_SAP_info.ContinueProgram == False:
                _pass_row(ws,i)
                continue
-           # Loop for manual input Payment on account
+           # Manual input Payment on account
            aux = True
            while aux:
-               ask_SA = show_question("Confirmación", "¿Tiene algún apunte manual?")
-               if ask_SA == QMessageBox.No:
-                   aux = False
+               aux = False
+               if decision["manual"] == "no":
                    break
-               ask_Rng =show_question("Confirmación", "¿Es un rango de apuntes?")
-               # Apply manual entries
-               if ask_Rng == QMessageBox.No:
-                   VAC = ask_user_number("Introduce el importe del Apunte:")
-                   if VAC is None:
-                       _pass_row(ws, i)
-                       break
-                   if VAC > 0:
-                       new_entry( "16", client_code) # New Credit entry into client account
-                       if Load_SAP_info.ContinueProgram == False:
-                           _pass_row(ws,i)
-                           break
-                       new_entry_add_data(VAC, due_date,commentary,"-1",assignment)
-                       if Load_SAP_info.ContinueProgram == False:
-                           _pass_row(ws,i)
-                           break
-                   elif VAC < 0:
-                       VAC=VAC*-1
-                       new_entry( "06", client_code) # New Debit entry into client account
-                       if Load_SAP_info.ContinueProgram == False:
-                           _pass_row(ws,i)
-                           break
-                       new_entry_add_data(VAC, due_date,commentary,"-1",assignment)
-                       if Load_SAP_info.ContinueProgram == False:
-                           _pass_row(ws,i)
-                           break
-                   ask_more=show_question("Confirmación", "¿Hay más apuntes manuales?")
-                   if ask_more == QMessageBox.No:
-                       aux =False
-                       break
+               ask_Rng = YES if decision["manual"] == "rango" else NO
+               # Apply manual entries typed in the decision grid
+               if ask_Rng == NO:
+                   if not decision["amounts"]:
+                       log_event(WARNING, "Apuntes manuales sin importes en la rejilla", row=i)
+                   for VAC in decision["amounts"]:
+                       if VAC > 0:
+                           new_entry( "16", client_code) # New Credit entry into client account
+                           if Load_SAP_info.ContinueProgram == False:
+                               _pass_row(ws,i)
+                               break
+                           new_entry_add_data(VAC, due_date,commentary,"-1",assignment)
+                           if Load_SAP_info.ContinueProgram == False:
+                               _pass_row(ws,i)
+                               break
+                       elif VAC < 0:
+                           VAC=VAC*-1
+                           new_entry( "06", client_code) # New Debit entry into client account
+                           if Load_SAP_info.ContinueProgram == False:
+                               _pass_row(ws,i)
+                               break
+                           new_entry_add_data(VAC, due_date,commentary,"-1",assignment)
+                           if Load_SAP_info.ContinueProgram == False:
+                               _pass_row(ws,i)
+                               break
                # Request input range and apply selected amounts (Amouts are Selected, left cell commentary)
                else:
-                   aux = False
-                   if ask == QMessageBox.Yes:
-                       range_selected=launch_range_selector(wb_payment_detail)
-                   else:
-                       range_selected=launch_range_selector(wb)    
+                   range_selected=launch_range_selector(wb_payment_detail or wb)
+                   if range_selected is None:
+                       _pass_row(ws,i)
+                       break
                    # Iterating over individual cells
                    for row in range_selected.rows:
                         for cel in row:
@@ -370,7 +866,7 @@ def daily_payments():
                             try:
                                 ComVal = cel.offset(0, -1).value
                             except Exception as e:
-                                show_warning("Error", f"No se pudo obtener el comentario: {e}")
+                                log_event(WARNING, f"No se pudo obtener el comentario: {e}", row=i)
                                 ComVal = ""
                             if ApVal > 0:
                                 new_entry( "16", client_code)
@@ -391,13 +887,13 @@ def daily_payments():
                                 if Load_SAP_info.ContinueProgram == False:
                                     _pass_row(ws,i)
                                     break
-           if ask == QMessageBox.No:
+           if wb_payment_detail:
                wb_payment_detail.close()
         # Other predefined actions
         # Handle specific 'Acción' scenarios like FACTURA, TODO, HASTA, SOLO, ENTRE, A CUENTA, REEMBOLSO
         else:
             # Call the add new entry SAP Transaction
-            call_transaction("F-04")
+            reused[i] = call_transaction("F-04", reuse=True)
             new_entry("40", bank_account, "", due_date) # New Debit entry into client account
             if Load_SAP_info.ContinueProgram == False:
                 _pass_row(ws,i)
@@ -406,9 +902,13 @@ def daily_payments():
             if Load_SAP_info.ContinueProgram == False:
                 _pass_row(ws,i)
                 continue
-            # Search for a specific Open Item (invoice) and select it
+            # Search for a specific Open Item (invoice) and select it; several references are selected in one pass
             if action == "FACTURA":
-                search_items(client_category, 5, search_data1, "", client_code, search_data2) 
+                references = _invoice_references(search_data1, search_data2)
+                if references:
+                    search_items(client_category, 5, references, "", client_code)
+                else:
+                    search_items(client_category, 5, search_data1, "", client_code, search_data2) 
                 if Load_SAP_info.ContinueProgram == False:
                     _pass_row(ws,i)
                     continue
@@ -467,7 +967,7 @@ def daily_payments():
                     continue
             # No additional actions are defined at this stage
             else:
-                QMessageBox.warning(None, "Acción no válida", f"Fila {i}: Acción '{action}' no reconocida.")
+                log_event(ERROR, f"Acción '{action}' no reconocida.", row=i)
                 continue
         # Simulate accounting entry and generate final positions
         pos_ini, pos_fin = simulate(client_code,due_date)
@@ -486,23 +986,43 @@ def daily_payments():
         if Load_SAP_info.ContinueProgram == False:
             _pass_row(ws, i)
             continue
-        # Retrieve the entry number generated during the accounting process
-        entry_num = get_entry_number()
-        if Load_SAP_info.ContinueProgram == False:
-            _pass_row(ws,i)
-            continue
-        # Store the generated spool document on the server as a backup copy
-        save_entry(save_path)
+        # Retrieve the entry number generated during the accounting process (FB03 only if the status bar lacks it)
+        entry_num = posted_entry_number() or get_entry_number()
         if Load_SAP_info.ContinueProgram == False:
             _pass_row(ws,i)
             continue
+        journal.record(POSTED, fingerprint, row=i, entry_num=entry_num)
+        posted.append((i, fingerprint, entry_num))
         # Update row with new status
         ws.cells(i, 12).value = "Aplicado"
         ws.cells(i, 13).value = entry_num
+        applied_rows.append(i)
         ws.range(f'{i}:{i}').api.Font.ColorIndex  = -4105
+    if last_intent and journal.interrupted(fingerprints[last_intent - 1]):
+        journal.record(FAILED, fingerprints[last_intent - 1], row=last_intent, reason="No Aplicado")
+    print(f"[INFO] Pantalla F-04 reutilizada en {sum(reused.values())} de {len(reused)} filas")
+    # Store the generated spool documents on the server as a backup copy
+    for i, fingerprint, entry_num in posted:
+        Load_SAP_info.ContinueProgram = True
+        save_entry(save_path, entry_num)
+        journal.record(SPOOL, fingerprint, row=i, saved=Load_SAP_info.ContinueProgram)
+        # The entry is already saved in SAP: a missing spool is reported but the row stays applied
+        if Load_SAP_info.ContinueProgram == False:
+            log_event(WARNING, f"Asiento {entry_num} grabado sin guardar el spool", row=i)
+    Load_SAP_info.ContinueProgram = True
     # Save the workbook and prompt user to review everything
     ws.range("L:M").autofit()
+    # Audit of the processing order with the final status of each row
+    final_rows = ws.range((1, 1), (end_row, 15)).options(ndim=2).value
+    screens = {True: "Reutilizada", False: "Entrada"}
+    _write_audit(wb, [[seq, i, final_rows[i - 1][8], final_rows[i - 1][3], started[i], screens.get(reused.get(i), ""),
+                       final_rows[i - 1][11], final_rows[i - 1][12]] for seq, i in enumerate(order, start=1)])
     wb.save(bank_path)
+    # Keep the rows still pending so tomorrow's bank file carries them over
+    rows = ws.used_range.options(ndim=2).value
+    save_pending_movements(bank_account, [row for row in rows[1:] if len(row) > 11 and row[11] == "No Aplicado"])
+    # Learn sender → client/action pairs from the rows applied in this run
+    _record_senders([rows[i - 1] for i in applied_rows])
     show_info("Finalizado", "Pagos diarios aplicados correctamente.\nRevisa los números de asiento.")
 
 # ---------
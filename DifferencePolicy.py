@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+from collections import namedtuple
+from AmountMatcher import to_cents
+from LocalStore import key_part
+from RunLog import log_event, INFO
+import Load_SAP_info
+
+# -----------------------------------
+# Posting difference policy
+# -----------------------------------
+ROUND = "round_dif"
+TO_ACCOUNT = "to_account"
+
+Decision = namedtuple("Decision", ["action", "limit"])
+
+class DifferencePolicy:
+    """
+    Thresholds from 'difference_policy' in SAP_info.json that resolve posting differences without asking.
+
+    Checked in this order, on the absolute difference in integer cents:
+    - round_max: up to this amount the difference goes to the rounding account (`round_dif`)
+    - to_account_max: up to this amount it is booked on the client account (`to_account_dif`)
+    - anything above is escalated to the operator (difference popup)
+
+    'invoices_max' is the invoice difference up to which payment_batch_template adds the
+    unloaded invoices as manual lines without asking. A zero threshold disables its rule.
+    'clients' overrides any threshold per SAP client code.
+
+    Parameters:
+    - config (dict): 'difference_policy' block
+    """
+    KEYS = ("round_max", "to_account_max", "invoices_max")
+
+    def __init__(self, config: dict):
+        self.defaults = {key: to_cents(config.get(key, 0)) for key in self.KEYS}
+        self.clients = {key_part(code): {key: to_cents(limit) for key, limit in limits.items() if key in self.KEYS}
+                        for code, limits in config.get("clients", {}).items()}
+
+    def limits(self, account) -> dict:
+        """
+        Thresholds (in cents) that apply to a client.
+
+        Parameters:
+        - account: SAP client code (or None)
+
+        Returns:
+        - dict: {'round_max', 'to_account_max', 'invoices_max'} in cents
+        """
+        return {**self.defaults, **self.clients.get(key_part(account), {})}
+
+    def decide(self, diff: float, account=None) -> Decision:
+        """
+        Decides how a posting difference is resolved.
+
+        Parameters:
+        - diff (float): Difference reported by SAP
+        - account: SAP client code the difference would be booked on
+
+        Returns:
+        - Decision: (ROUND, TO_ACCOUNT or None to ask the operator, threshold applied in euros)
+        """
+        cents = abs(to_cents(diff))
+        limits = self.limits(account)
+        if 0 < cents <= limits["round_max"]:
+            return Decision(ROUND, limits["round_max"] / 100)
+        if 0 < cents <= limits["to_account_max"]:
+            return Decision(TO_ACCOUNT, limits["to_account_max"] / 100)
+        return Decision(None, None)
+
+    def adjust_invoices(self, diff: float, account=None) -> bool:
+        """
+        Tells whether an invoice difference is adjusted with manual invoice lines without asking.
+
+        Parameters:
+        - diff (float): Difference reported by SAP
+        - account: SAP client code of the payment
+
+        Returns:
+        - bool: True if the difference is within 'invoices_max'
+        """
+        return 0 < abs(to_cents(diff)) <= self.limits(account)["invoices_max"]
+
+_POLICY = None
+
+def difference_policy() -> DifferencePolicy:
+    """
+    Returns the policy built from 'difference_policy' in SAP_info.json, once.
+
+    Returns:
+    - DifferencePolicy: Shared policy
+    """
+    global _POLICY
+    if _POLICY is None:
+        _POLICY = DifferencePolicy(Load_SAP_info.config.get("difference_policy", {}))
+    return _POLICY
+
+def auto_difference(diff: float, account=None) -> str | None:
+    """
+    Applies the policy to a posting difference and records the decision in the run log.
+
+    Parameters:
+    - diff (float): Difference reported by SAP
+    - account: SAP client code the difference would be booked on
+
+    Returns:
+    - str or None: ROUND or TO_ACCOUNT, or None if the operator has to decide
+    """
+    decision = difference_policy().decide(diff, account)
+    if decision.action == ROUND:
+        log_event(INFO, f"Diferencia {diff} redondeada automáticamente (hasta {decision.limit})")
+    elif decision.action == TO_ACCOUNT:
+        log_event(INFO, f"Diferencia {diff} a la cuenta {account} automáticamente (hasta {decision.limit})")
+    return decision.action
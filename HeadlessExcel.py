@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+# -----------------------------------
+# Streaming xlsx writer (no Excel needed)
+# -----------------------------------
+def open_workbook(path: str, constant_memory: bool = True):
+    """
+    Creates an xlsx workbook with xlsxwriter and the shared cell formats used by the reports.
+    In constant-memory mode every row is flushed to disk as soon as the next one starts,
+    so the memory used does not grow with the number of rows.
+
+    Parameters:
+    - path (str): Destination xlsx path
+    - constant_memory (bool, optional): Flush rows as they are written (default True)
+
+    Returns:
+    - tuple: (xlsxwriter Workbook, dict of named formats)
+    """
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": constant_memory,
+                                          "default_date_format": "dd/mm/yyyy"})
+    formats = {
+        "header": workbook.add_format({"bold": True, "border": 2, "bg_color": "#C0C0C0"}),
+        "date": workbook.add_format({"num_format": "dd/mm/yyyy"}),
+        "amount": workbook.add_format({"num_format": "#,##0.00"}),
+    }
+    return workbook, formats
+
+def write_row(ws, row_index: int, values: list, formats: dict):
+    """
+    Writes one row choosing the cell format from the Python type of each value.
+
+    Parameters:
+    - ws: xlsxwriter Worksheet
+    - row_index (int): 0-based row index
+    - values (list): Row values (date, float/int, str or None)
+    - formats (dict): Formats returned by `open_workbook`
+
+    Returns:
+    - None: row is written to the worksheet
+    """
+    for col_index, value in enumerate(values):
+        if value is None or value == "":
+            continue
+        if isinstance(value, (date, datetime)):
+            ws.write_datetime(row_index, col_index, value, formats["date"])
+        elif isinstance(value, float):
+            ws.write_number(row_index, col_index, value, formats["amount"])
+        elif isinstance(value, int):
+            ws.write_number(row_index, col_index, value)
+        else:
+            ws.write_string(row_index, col_index, str(value))
+
+def write_sheet(workbook, sheet_name: str, header: list, rows, formats: dict,
+                header_format: str = "header") -> int:
+    """
+    Adds a worksheet and streams the header plus every row of `rows` into it.
+
+    Workflow:
+    - Adds the sheet and writes the header with bold/border formatting
+    - Writes each row in order (rows may be any iterable, including a generator)
+    - Freezes the header row and enables the autofilter over the written range
+
+    Parameters:
+    - workbook: xlsxwriter Workbook
+    - sheet_name (str): Name for the new sheet (max. 31 characters)
+    - header (list[str]): Header labels
+    - rows (iterable[list]): Data rows
+    - formats (dict): Formats returned by `open_workbook`
+    - header_format (str, optional): Key of the format used for the header row
+
+    Returns:
+    - int: Number of data rows written
+    """
+    ws = workbook.add_worksheet(sheet_name[:31])
+    for col_index, label in enumerate(header):
+        ws.write_string(0, col_index, str(label), formats[header_format])
+    ws.freeze_panes(1, 0)
+    row_index = 0
+    for row_index, values in enumerate(rows, start=1):
+        write_row(ws, row_index, values, formats)
+    if header:
+        ws.autofilter(0, 0, max(row_index, 1), len(header) - 1)
+    return row_index
+
+# -----------------------------------
+# Standalone workbooks in worker processes
+# -----------------------------------
+def _color_hex(rgb) -> str:
+    return "#{:02X}{:02X}{:02X}".format(*rgb)
+
+def write_list_workbook(job: dict) -> tuple:
+    """
+    Writes one standalone, formatted workbook: a data sheet plus the reference sheets its
+    dropdown lists point to. Built to run inside a worker process (plain picklable input).
+
+    Workflow:
+    - Writes the data sheet header, using the given fill color per column when present
+    - Streams the data rows and applies each list validation once over the whole column
+    - Adds the reference sheets (e.g. 'ACCIONES') the list validations point to
+
+    Parameters:
+    - job (dict):
+        - path (str): Destination xlsx path
+        - sheet_name (str): Name of the data sheet
+        - header (list[str]): Header labels
+        - rows (list[list]): Data rows
+        - header_colors (dict, optional): {0-based column: [r, g, b]}
+        - reference_sheets (dict, optional): {sheet name: rows incl. header}
+        - validations (list, optional): (0-based column, reference sheet, 0-based source column) tuples
+
+    Returns:
+    - tuple: (path, number of data rows written)
+    """
+    workbook, formats = open_workbook(job["path"])
+    try:
+        references = job.get("reference_sheets") or {}
+        ws = workbook.add_worksheet(job["sheet_name"][:31])
+        header_colors = job.get("header_colors") or {}
+        for col_index, label in enumerate(job["header"]):
+            fmt = formats["header"]
+            if col_index in header_colors:
+                fmt = workbook.add_format({"bold": True, "border": 2,
+                                           "bg_color": _color_hex(header_colors[col_index])})
+            ws.write_string(0, col_index, str(label), fmt)
+        ws.freeze_panes(1, 0)
+        row_index = 0
+        for row_index, values in enumerate(job["rows"], start=1):
+            write_row(ws, row_index, values, formats)
+        if job["header"]:
+            ws.autofilter(0, 0, max(row_index, 1), len(job["header"]) - 1)
+        for col_index, ref_name, ref_col in job.get("validations") or []:
+            ref_rows = references.get(ref_name, [])
+            # Last filled row (not the count of filled cells): the list may have gaps
+            last_ref = max((index for index, row in enumerate(ref_rows) if index
+                            and ref_col < len(row) and row[ref_col] not in (None, "")), default=0)
+            if not last_ref or not row_index:
+                continue
+            letter = xl_col_to_name(ref_col)
+            ws.data_validation(1, col_index, row_index, col_index, {
+                "validate": "list",
+                "source": f"='{ref_name[:31]}'!${letter}$2:${letter}${last_ref + 1}",
+            })
+        for name, ref_rows in references.items():
+            ws_ref = workbook.add_worksheet(name[:31])
+            for ref_index, values in enumerate(ref_rows):
+                write_row(ws_ref, ref_index, values, formats)
+    finally:
+        workbook.close()
+    return job["path"], row_index
+
+def write_workbooks(jobs: list, max_workers: int | None = None) -> list:
+    """
+    Writes several standalone workbooks at once, one per worker process, so the total time
+    is that of the largest file instead of the sum of all of them.
+
+    Parameters:
+    - jobs (list[dict]): Jobs accepted by `write_list_workbook`
+    - max_workers (int, optional): Worker processes (defaults to one per CPU, capped by jobs)
+
+    Returns:
+    - list[tuple]: (path, rows written) per job, in the same order as `jobs`
+    """
+    workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [write_list_workbook(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(write_list_workbook, jobs))
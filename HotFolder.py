@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import sys
+import struct
+import pickle
+import select
+import hashlib
+import threading
+from datetime import date, datetime
+from RemittanceClassifier import read_values, parse_remittance, cell_text
+from LocalStore import claim_inbox_file, is_inbox_file
+from RunLog import log_event, INFO, WARNING, ERROR
+import Load_SAP_info
+
+# -----------------------------------
+# Remittance format fingerprints
+# -----------------------------------
+REMITTANCE = "remittance"
+BANK_STATEMENT = "bank_statement"
+UNKNOWN = "unknown"
+# Keys every remittance detail profile has (other '_detail' blocks are not remittances)
+_PROFILE_KEYS = {"amount_col", "start_row", "corp_name", "due_date", "payment_number"}
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_date(value) -> bool:
+    if isinstance(value, (date, datetime)):
+        return True
+    try:
+        datetime.strptime(str(value).strip(), "%d/%m/%Y")
+        return True
+    except ValueError:
+        return False
+
+class FormatIndex:
+    """
+    Header-cell fingerprint index of the remittance formats in SAP_info.json.
+
+    Every '<client>_detail' profile is turned once into the cell checks its layout implies:
+    - Required: a number in the amount column at 'start_row' and no number right above it (header)
+    - Scored: total cell holds a number, due date cell (or column) holds a date, corporate name cell
+      (or column) contains one of the '<client>_dic' keys, payment number cell is filled and the
+      document type column holds an allowed type
+
+    Profiles are grouped by (start_row, amount column), so a file is only scored against the
+    profiles whose required cells match. The bank statement is recognised by a date in the first
+    data row below its header row ('hot_folder_detail').
+    """
+    def __init__(self, config: dict):
+        self.bank = config["hot_folder_detail"]["bank_statement"]
+        self._by_anchor = {}
+        for profile, detail in config.items():
+            if not profile.endswith("_detail") or not isinstance(detail, dict) or not _PROFILE_KEYS <= detail.keys():
+                continue
+            clients = list(config.get(f"{profile.split('_')[0]}_dic", {}))
+            anchor = (detail["start_row"], detail["amount_col"])
+            self._by_anchor.setdefault(anchor, []).append((profile, self._checks(detail, clients)))
+
+    @staticmethod
+    def _checks(detail: dict, clients: list) -> list:
+        # (row, col, test, weight) per header cell
+        start_row = detail["start_row"]
+        checks = []
+        if detail.get("total_amount"):
+            checks.append((*detail["total_amount"], _is_number, 1))
+        due_date = detail["due_date"]
+        if len(due_date) > 1:
+            checks.append((*due_date, _is_date, 1))
+        else:
+            checks.append((start_row, due_date[0], _is_date, 1))
+        corp_name = detail["corp_name"]
+        def has_client(value):
+            text = cell_text(value).strip().upper()
+            return any(key in text for key in clients)
+        if isinstance(corp_name, list):
+            checks.append((*corp_name, has_client, 2))
+        elif isinstance(corp_name, int):
+            checks.append((start_row, corp_name, has_client, 2))
+        if isinstance(detail["payment_number"], list):
+            checks.append((*detail["payment_number"], lambda value: cell_text(value).strip() != "", 1))
+        if detail.get("doc_type_col"):
+            types = {value for key in ("invoices_allowed", "credit_allowed", "debit_allowed", "ajd_allowed")
+                     for value in detail.get(key, [])}
+            checks.append((start_row, detail["doc_type_col"], lambda value: cell_text(value).upper() in types, 1))
+        return checks
+
+    def identify(self, values: list) -> tuple:
+        """
+        Identifies the format of a sheet from its header cells.
+
+        Parameters:
+        - values (list[list]): Sheet values from A1
+
+        Returns:
+        - tuple: (kind, detail profile keys with the best score); kind is REMITTANCE, BANK_STATEMENT or UNKNOWN
+        """
+        def cell(row, col):
+            line = values[row - 1] if 0 < row <= len(values) else []
+            return line[col - 1] if 0 < col <= len(line) else None
+
+        best, profiles = 0, []
+        for (start_row, amount_col), candidates in self._by_anchor.items():
+            if not _is_number(cell(start_row, amount_col)) or _is_number(cell(start_row - 1, amount_col)):
+                continue
+            for profile, checks in candidates:
+                score = 1 + sum(weight for row, col, test, weight in checks if test(cell(row, col)))
+                if score > best:
+                    best, profiles = score, [profile]
+                elif score == best:
+                    profiles.append(profile)
+        if profiles:
+            return REMITTANCE, profiles
+        if _is_date(cell(self.bank["header_row"] + 1, self.bank["date_col"])):
+            return BANK_STATEMENT, []
+        return UNKNOWN, []
+
+# -----------------------------------
+# Ingestion
+# -----------------------------------
+def content_hash(path: str) -> str:
+    """
+    SHA-1 of a file content (same file renamed or copied → same hash).
+
+    Parameters:
+    - path (str): File path
+
+    Returns:
+    - str: Hex hash
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_parsed(parsed_path: str) -> dict | None:
+    """
+    Loads a remittance pre-parsed by the hot folder.
+
+    Parameters:
+    - parsed_path (str): Pre-parsed result file
+
+    Returns:
+    - dict or None: Result of `parse_remittance`, or None if it is not available
+    """
+    if not parsed_path or not os.path.exists(parsed_path):
+        return None
+    with open(parsed_path, "rb") as file:
+        return pickle.load(file)
+
+def ingest(path: str, index: FormatIndex) -> str | None:
+    """
+    Identifies a new inbox file and queues it for its pipeline, pre-parsing remittances.
+
+    Workflow:
+    - Skips contents already registered (files renamed after posting are not queued again)
+    - Reads the first sheet without Excel and identifies its format with the fingerprint index
+    - Remittances with a single matching profile are parsed and classified now, and the result is kept
+      in 'local_data_path/inbox' for the payment queue
+    - Registers the file in the local store with its pipeline and profile
+
+    Parameters:
+    - path (str): New file in the inbox
+    - index (FormatIndex): Fingerprint index
+
+    Returns:
+    - str or None: Pipeline of the file, or None if it was already registered or unreadable
+    """
+    try:
+        file_hash = content_hash(path)
+        if is_inbox_file(file_hash):
+            return None
+        kind, profiles = index.identify(read_values(path))
+    except Exception as e:
+        log_event(WARNING, f"Bandeja: no se pudo leer {os.path.basename(path)} ({type(e).__name__} - {e})")
+        return None
+    profile = profiles[0] if len(profiles) == 1 else None
+    parsed_path = None
+    if kind == REMITTANCE and profile:
+        config = Load_SAP_info.config
+        result = parse_remittance({"path": path, "client_detail": config[profile],
+                                   "clients_dic": config[f"{profile.split('_')[0]}_dic"]})
+        if result["error"]:
+            log_event(ERROR, f"Bandeja: {os.path.basename(path)}: {result['error']}")
+        else:
+            parsed_path = os.path.join(Load_SAP_info.config["local_data_path"], "inbox", f"{file_hash}.pickle")
+            os.makedirs(os.path.dirname(parsed_path), exist_ok=True)
+            with open(parsed_path, "wb") as file:
+                pickle.dump(result, file)
+    if claim_inbox_file(file_hash, path, kind, profile, parsed_path):
+        detail = profile or (", ".join(profiles) if profiles else "")
+        log_event(INFO, f"Bandeja: {os.path.basename(path)} → {kind} {detail}".rstrip())
+    return kind
+
+# -----------------------------------
+# Watcher (inotify on Linux, polling elsewhere)
+# -----------------------------------
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct("iIII")
+
+def _inotify(folder: str):
+    # Returns an inotify descriptor watching `folder` for finished writes and moves, or None if inotify is not available
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        fd = libc.inotify_init()
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(folder), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+class InboxWatcher(threading.Thread):
+    """
+    Background thread that ingests every file dropped into the inbox folder ('inbox_path').
+
+    Files already in the folder are ingested on start. Then, on Linux, inotify reports each file
+    as soon as it is closed after writing or moved in; elsewhere the folder is polled and a file
+    is ingested once its size and modification time stop changing between two polls.
+
+    Parameters:
+    - folder (str): Inbox folder
+    - poll_interval (float, optional): Seconds between polls (and between stop checks with inotify)
+    """
+    def __init__(self, folder: str, poll_interval: float = 2.0):
+        super().__init__(daemon=True, name="InboxWatcher")
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.extensions = tuple(Load_SAP_info.config["hot_folder_detail"]["extensions"])
+        self.index = FormatIndex(Load_SAP_info.config)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _wanted(self, name: str) -> bool:
+        # Excel lock files (~$name.xlsx) are never ingested
+        return name.lower().endswith(self.extensions) and not name.startswith("~$")
+
+    def _ingest(self, name: str):
+        path = os.path.join(self.folder, name)
+        if self._wanted(name) and os.path.isfile(path):
+            ingest(path, self.index)
+
+    def _scan(self) -> dict:
+        # {name: (size, modification time)} of the wanted files now in the folder
+        current = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and self._wanted(entry.name):
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime)
+        return current
+
+    def run(self):
+        scanned = self._scan()
+        for name in scanned:
+            self._ingest(name)
+        fd = _inotify(self.folder)
+        if fd is None:
+            self._poll(scanned)
+            return
+        try:
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not ready:
+                    continue
+                data = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                    start = offset + _EVENT_HEADER.size
+                    name = data[start:start + length].rstrip(b"\0").decode(errors="replace")
+                    offset = start + length
+                    if name:
+                        self._ingest(name)
+        finally:
+            os.close(fd)
+
+    def _poll(self, scanned: dict):
+        # Files ingested by the startup scan are not read again unless they change
+        previous = dict(scanned)
+        done = dict(scanned)
+        while not self._stop_event.wait(self.poll_interval):
+            current = self._scan()
+            for name, signature in current.items():
+                # Ingested once the file stopped changing since the previous poll
+                if done.get(name) != signature and previous.get(name) == signature:
+                    self._ingest(name)
+                    done[name] = signature
+            done = {name: signature for name, signature in done.items() if name in current}
+            previous = current
+
+def start_watcher() -> InboxWatcher | None:
+    """
+    Starts the inbox watcher if 'inbox_path' is configured and reachable.
+
+    Returns:
+    - InboxWatcher or None: Running watcher
+    """
+    folder = Load_SAP_info.config.get("inbox_path")
+    if not folder or not os.path.isdir(folder):
+        print(f"[WARNING] Bandeja de entrada no disponible: {folder}")
+        return None
+    watcher = InboxWatcher(folder, Load_SAP_info.config["hot_folder_detail"]["poll_interval"])
+    watcher.start()
+    return watcher
+
+# ---------
+# Service
+# ---------
+# Run as 'python HotFolder.py' (e.g. scheduled at logon) so files are pre-parsed before the app is opened
+if __name__ == "__main__":
+    watcher = start_watcher()
+    if watcher:
+        print(f"[INFO] Vigilando {watcher.folder}")
+        try:
+            while watcher.is_alive():
+                watcher.join(1)
+        except KeyboardInterrupt:
+            watcher.stop()
@@ -10,4 +10,10 @@ def load_SAP_info(path="SAP_info.json"):
     with open(path, "r") as file:
         return json.load(file)
 
-config = load_SAP_info()
+def __getattr__(name):
+    # 'config' is read from SAP_info.json the first time it is used, not at import (faster startup)
+    global config
+    if name == "config":
+        config = load_SAP_info()
+        return config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
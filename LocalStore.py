@@ -0,0 +1,684 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime
+import Load_SAP_info
+
+# -----------------------------------
+# Connection
+# -----------------------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_comments (
+    f TEXT NOT NULL,
+    g TEXT NOT NULL,
+    j TEXT NOT NULL,
+    report_date TEXT NOT NULL,
+    comments,
+    control,
+    balance,
+    PRIMARY KEY (f, g, j, report_date)
+);
+CREATE TABLE IF NOT EXISTS reference_sheets (
+    sheet_name TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    values_json TEXT NOT NULL,
+    PRIMARY KEY (sheet_name, row_index)
+);
+CREATE TABLE IF NOT EXISTS bank_movements (
+    bank_account TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    movement_date TEXT NOT NULL,
+    ingested_on TEXT NOT NULL,
+    PRIMARY KEY (bank_account, fingerprint, occurrence)
+);
+CREATE INDEX IF NOT EXISTS bank_movements_date ON bank_movements (bank_account, movement_date);
+CREATE TABLE IF NOT EXISTS pending_movements (
+    bank_account TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    values_json TEXT NOT NULL,
+    PRIMARY KEY (bank_account, row_index)
+);
+CREATE TABLE IF NOT EXISTS sender_matches (
+    sender TEXT NOT NULL,
+    client_code TEXT NOT NULL,
+    action TEXT NOT NULL,
+    uses INTEGER NOT NULL,
+    last_used TEXT NOT NULL,
+    PRIMARY KEY (sender, client_code, action)
+);
+CREATE TABLE IF NOT EXISTS inbox_files (
+    content_hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    profile TEXT,
+    parsed_path TEXT,
+    status TEXT NOT NULL,
+    detected_on TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS open_items (
+    client_code TEXT NOT NULL,
+    doc_number TEXT NOT NULL,
+    reference TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    due_date TEXT,
+    doc_type TEXT,
+    posting_date TEXT,
+    PRIMARY KEY (client_code, doc_number, reference)
+);
+CREATE INDEX IF NOT EXISTS open_items_reference ON open_items (reference);
+CREATE TABLE IF NOT EXISTS open_items_refresh (
+    kind TEXT PRIMARY KEY,
+    refreshed_on TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS report_runs (
+    kind TEXT PRIMARY KEY,
+    run_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS template_cache (
+    config_key TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    modified REAL NOT NULL,
+    size INTEGER NOT NULL,
+    cached_path TEXT NOT NULL
+);
+"""
+
+def store_path() -> str:
+    """
+    Returns the path of the local SQLite store inside the configured local data folder.
+
+    Returns:
+    - str: Full path to 'local_store.db'
+    """
+    return os.path.join(Load_SAP_info.config["local_data_path"], "local_store.db")
+
+@contextmanager
+def connect():
+    """
+    Opens the local SQLite store, creating the folder and the schema if needed.
+    Commits on success, rolls back on error and always closes the file.
+
+    Returns:
+    - Iterator[sqlite3.Connection]: Open connection for the `with` block
+    """
+    path = store_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def key_part(value) -> str:
+    """
+    Normalizes an Excel cell value so keys built from different sheets compare equal
+    (e.g. 112233.0 → '112233', datetimes → 'YYYY-MM-DD', None → '').
+
+    Parameters:
+    - value: Raw cell value
+
+    Returns:
+    - str: Normalized key text
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+def cell_value(value):
+    """
+    Converts an Excel cell value into something SQLite/JSON can store unchanged
+    (dates become ISO strings, everything else is kept).
+
+    Parameters:
+    - value: Raw cell value
+
+    Returns:
+    - Storable value
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+# -----------------------------------
+# Large retailer report comments
+# -----------------------------------
+def has_report_comments() -> bool:
+    """
+    Tells whether the comment store already holds at least one saved report.
+
+    Returns:
+    - bool: True if comments are stored
+    """
+    with connect() as conn:
+        return conn.execute("SELECT 1 FROM report_comments LIMIT 1").fetchone() is not None
+
+def mark_report_run(kind: str):
+    """
+    Records when the comment store last got comments back from the account managers ('returned')
+    or was last used to generate a report ('generated').
+
+    Parameters:
+    - kind (str): 'returned' or 'generated'
+
+    Returns:
+    - None: store is updated
+    """
+    with connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO report_runs VALUES (?, ?)", (kind, datetime.now().isoformat()))
+
+def has_returned_comments() -> bool:
+    """
+    Tells whether the account managers' comments reached the store after the last report was generated,
+    so the next report can be joined against the store instead of last month's report.
+
+    Returns:
+    - bool: True if the store holds comments returned since the last report
+    """
+    with connect() as conn:
+        runs = dict(conn.execute("SELECT kind, run_at FROM report_runs").fetchall())
+    returned_at, generated_at = runs.get("returned"), runs.get("generated")
+    return returned_at is not None and (generated_at is None or returned_at > generated_at)
+
+def latest_report_comments() -> dict:
+    """
+    Returns the most recent comments, control and balance values stored for every (F, G, J) key.
+
+    Returns:
+    - dict: {(f, g, j): (comments, control, balance)}
+    """
+    with connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT f, g, j, comments, control, balance FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY f, g, j ORDER BY report_date DESC) AS rn
+                FROM report_comments)
+            WHERE rn = 1
+            """
+        ).fetchall()
+    return {(f, g, j): (comments, control, balance) for f, g, j, comments, control, balance in rows}
+
+def save_report_comments(rows, report_date: str) -> int:
+    """
+    Stores the comments of a saved report incrementally: only keys whose comments,
+    control or balance changed since the latest stored version get a new dated row,
+    so the table doubles as the comment history.
+
+    Parameters:
+    - rows (iterable): (f, g, j, comments, control, balance) tuples with raw cell values
+    - report_date (str): Report date in ISO format (YYYY-MM-DD)
+
+    Returns:
+    - int: Number of keys inserted or updated
+    """
+    latest = latest_report_comments()
+    changes = []
+    for f, g, j, comments, control, balance in rows:
+        key = (key_part(f), key_part(g), key_part(j))
+        values = (cell_value(comments), cell_value(control), cell_value(balance))
+        if not any(v not in (None, "") for v in values) and key not in latest:
+            continue  # Nothing worth storing for a brand-new empty row
+        if latest.get(key) == values:
+            continue
+        changes.append((*key, report_date, *values))
+    with connect() as conn:
+        conn.executemany("INSERT OR REPLACE INTO report_comments VALUES (?, ?, ?, ?, ?, ?, ?)", changes)
+    return len(changes)
+
+def comment_history(f, g, j) -> list:
+    """
+    Returns every stored version of the comments for one (F, G, J) key, oldest first.
+
+    Parameters:
+    - f, g, j: Key cell values (raw or normalized)
+
+    Returns:
+    - list[tuple]: (report_date, comments, control, balance)
+    """
+    with connect() as conn:
+        return conn.execute(
+            "SELECT report_date, comments, control, balance FROM report_comments "
+            "WHERE f = ? AND g = ? AND j = ? ORDER BY report_date",
+            (key_part(f), key_part(g), key_part(j)),
+        ).fetchall()
+
+def save_reference_sheet(sheet_name: str, rows: list):
+    """
+    Replaces the stored copy of a small reference sheet (e.g. 'ACCIONES', 'CUENTAS CON GESTOR').
+
+    Parameters:
+    - sheet_name (str): Name of the sheet
+    - rows (list[list]): Cell values by row
+
+    Returns:
+    - None: store is updated
+    """
+    with connect() as conn:
+        conn.execute("DELETE FROM reference_sheets WHERE sheet_name = ?", (sheet_name,))
+        conn.executemany(
+            "INSERT INTO reference_sheets VALUES (?, ?, ?)",
+            [(sheet_name, index, json.dumps([cell_value(v) for v in row])) for index, row in enumerate(rows)],
+        )
+
+def reference_sheet(sheet_name: str) -> list:
+    """
+    Returns the stored rows of a reference sheet.
+
+    Parameters:
+    - sheet_name (str): Name of the sheet
+
+    Returns:
+    - list[list]: Cell values by row (empty if never stored)
+    """
+    with connect() as conn:
+        rows = conn.execute(
+            "SELECT values_json FROM reference_sheets WHERE sheet_name = ? ORDER BY row_index", (sheet_name,)
+        ).fetchall()
+    return [json.loads(values_json) for (values_json,) in rows]
+
+# -----------------------------------
+# Bank statement ingestion watermark
+# -----------------------------------
+def movement_fingerprint(movement_date, description, amount, reference="") -> str:
+    """
+    Builds the fingerprint of a bank movement from its date, reference, amount (in cents)
+    and a hash of its description.
+
+    Parameters:
+    - movement_date: Value date of the movement (date or ISO text)
+    - description (str): Bank description
+    - amount (float): Movement amount
+    - reference (optional): Bank reference, if the statement has one
+
+    Returns:
+    - str: Hex fingerprint
+    """
+    description_hash = hashlib.sha1(str(description or "").strip().encode("utf-8")).hexdigest()
+    cents = round(float(amount or 0) * 100)
+    text = f"{key_part(movement_date)}|{key_part(reference)}|{cents}|{description_hash}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def has_bank_watermark(bank_account: str) -> bool:
+    """
+    Tells whether any statement of the bank account has already been ingested.
+
+    Parameters:
+    - bank_account (str): SAP G/L bank account
+
+    Returns:
+    - bool: True if the account has ingested movements
+    """
+    with connect() as conn:
+        return conn.execute("SELECT 1 FROM bank_movements WHERE bank_account = ? LIMIT 1",
+                            (bank_account,)).fetchone() is not None
+
+def _movement_keys(fingerprints) -> list:
+    # Identical movements in one statement are told apart by their occurrence number
+    seen = {}
+    keys = []
+    for fingerprint in fingerprints:
+        seen[fingerprint] = seen.get(fingerprint, 0) + 1
+        keys.append((fingerprint, seen[fingerprint]))
+    return keys
+
+def movement_ids(movements: list) -> list:
+    """
+    Returns the identity of every statement movement ('fingerprint#occurrence', the key the watermark
+    stores). It is written next to the movement, so the row keeps it while it is carried over.
+
+    Parameters:
+    - movements (list[tuple]): (fingerprint, movement date ISO) per statement row
+
+    Returns:
+    - list[str]: Movement id per row, aligned with `movements`
+    """
+    return [f"{fingerprint}#{occurrence}" for fingerprint, occurrence
+            in _movement_keys(fingerprint for fingerprint, _ in movements)]
+
+def new_movements(bank_account: str, movements: list) -> list:
+    """
+    Diffs a statement against the movements already ingested for the account with a hash set,
+    so overlapping multi-day statements only yield the movements not seen before.
+
+    Parameters:
+    - bank_account (str): SAP G/L bank account
+    - movements (list[tuple]): (fingerprint, movement date ISO) per statement row
+
+    Returns:
+    - list[bool]: True for every row not ingested yet, aligned with `movements`
+    """
+    if not movements:
+        return []
+    first_date = min(movement_date for _, movement_date in movements)
+    with connect() as conn:
+        ingested = set(conn.execute(
+            "SELECT fingerprint, occurrence FROM bank_movements WHERE bank_account = ? AND movement_date >= ?",
+            (bank_account, first_date),
+        ).fetchall())
+    return [key not in ingested for key in _movement_keys(fingerprint for fingerprint, _ in movements)]
+
+def mark_movements_ingested(bank_account: str, movements: list):
+    """
+    Moves the account watermark past every movement of the statement.
+
+    Parameters:
+    - bank_account (str): SAP G/L bank account
+    - movements (list[tuple]): (fingerprint, movement date ISO) per statement row
+
+    Returns:
+    - None: store is updated
+    """
+    today = date.today().isoformat()
+    keys = _movement_keys(fingerprint for fingerprint, _ in movements)
+    with connect() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO bank_movements VALUES (?, ?, ?, ?, ?)",
+            [(bank_account, fingerprint, occurrence, movement_date, today)
+             for (fingerprint, occurrence), (_, movement_date) in zip(keys, movements)],
+        )
+
+def save_pending_movements(bank_account: str, rows: list):
+    """
+    Replaces the movements of the account still waiting to be applied ("No Aplicado"),
+    so the next bank file carries them over without opening the previous workbook.
+
+    Parameters:
+    - bank_account (str): SAP G/L bank account
+    - rows (list[list]): Bank file rows (A … M)
+
+    Returns:
+    - None: store is updated
+    """
+    with connect() as conn:
+        conn.execute("DELETE FROM pending_movements WHERE bank_account = ?", (bank_account,))
+        conn.executemany(
+            "INSERT INTO pending_movements VALUES (?, ?, ?)",
+            [(bank_account, index, json.dumps([cell_value(v) for v in row])) for index, row in enumerate(rows)],
+        )
+
+def pending_movements(bank_account: str) -> list:
+    """
+    Returns the stored "No Aplicado" rows of the account.
+
+    Parameters:
+    - bank_account (str): SAP G/L bank account
+
+    Returns:
+    - list[list]: Bank file rows (empty if none)
+    """
+    with connect() as conn:
+        rows = conn.execute(
+            "SELECT values_json FROM pending_movements WHERE bank_account = ? ORDER BY row_index", (bank_account,)
+        ).fetchall()
+    return [json.loads(values_json) for (values_json,) in rows]
+
+# -----------------------------------
+# Sender → client/action history
+# -----------------------------------
+def sender_matches() -> list:
+    """
+    Returns every stored (sender, client code, action) combination with its number of uses.
+
+    Returns:
+    - list[tuple]: (sender, client_code, action, uses)
+    """
+    with connect() as conn:
+        return conn.execute("SELECT sender, client_code, action, uses FROM sender_matches").fetchall()
+
+def record_sender_matches(matches) -> int:
+    """
+    Adds one use to each (sender, client code, action) applied in a run.
+
+    Parameters:
+    - matches (iterable[tuple]): (normalized sender, client code, action)
+
+    Returns:
+    - int: Number of uses recorded
+    """
+    today = date.today().isoformat()
+    rows = [(sender, key_part(client), key_part(action), today)
+            for sender, client, action in matches if sender and key_part(client)]
+    with connect() as conn:
+        conn.executemany(
+            "INSERT INTO sender_matches VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT (sender, client_code, action) DO UPDATE SET uses = uses + 1, last_used = excluded.last_used",
+            rows,
+        )
+    return len(rows)
+
+# -----------------------------------
+# Hot folder inbox
+# -----------------------------------
+def claim_inbox_file(content_hash: str, path: str, kind: str, profile: str | None, parsed_path: str | None) -> bool:
+    """
+    Registers a file found in the inbox, once per content (a renamed or copied file is not queued twice).
+
+    Parameters:
+    - content_hash (str): Hash of the file content
+    - path (str): File path
+    - kind (str): Pipeline ('remittance', 'bank_statement' or 'unknown')
+    - profile (str, optional): Detail profile key of a remittance
+    - parsed_path (str, optional): Pre-parsed result file
+
+    Returns:
+    - bool: True if the file was new
+    """
+    with connect() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO inbox_files VALUES (?, ?, ?, ?, ?, 'ready', ?)",
+            (content_hash, path, kind, profile, parsed_path, datetime.now().isoformat(timespec="seconds")),
+        )
+    return cursor.rowcount == 1
+
+def is_inbox_file(content_hash: str) -> bool:
+    """
+    Tells whether a file content was already registered from the inbox.
+
+    Parameters:
+    - content_hash (str): Hash of the file content
+
+    Returns:
+    - bool: True if registered
+    """
+    with connect() as conn:
+        return conn.execute("SELECT 1 FROM inbox_files WHERE content_hash = ?", (content_hash,)).fetchone() is not None
+
+def inbox_files(kind: str, status: str = "ready") -> list:
+    """
+    Returns the inbox files of a pipeline waiting to be processed, oldest first.
+
+    Parameters:
+    - kind (str): Pipeline ('remittance' or 'bank_statement')
+    - status (str, optional): File status
+
+    Returns:
+    - list[tuple]: (content_hash, path, profile, parsed_path)
+    """
+    with connect() as conn:
+        return conn.execute(
+            "SELECT content_hash, path, profile, parsed_path FROM inbox_files WHERE kind = ? AND status = ? "
+            "ORDER BY detected_on", (kind, status),
+        ).fetchall()
+
+def set_inbox_status(content_hash: str, status: str):
+    """
+    Updates the status of an inbox file (e.g. 'posted' once applied in SAP).
+
+    Parameters:
+    - content_hash (str): Hash of the file content
+    - status (str): New status
+
+    Returns:
+    - None: store is updated
+    """
+    with connect() as conn:
+        conn.execute("UPDATE inbox_files SET status = ? WHERE content_hash = ?", (status, content_hash))
+
+# -----------------------------------
+# Open items mirror (FBL5N)
+# -----------------------------------
+# Set when this process refreshes the mirror, cleared when a payment run starts
+_refreshed_in_run = False
+
+def save_open_items(items, full: bool) -> int:
+    """
+    Loads the open items of an FBL5N export into the mirror.
+    A full export replaces the mirror (cleared items disappear); a delta export (items posted
+    since the last refresh) is added on top of it.
+
+    Parameters:
+    - items (iterable[OpenItem]): Items read with `read_open_items` (every client, posting date included)
+    - full (bool): True for a full export
+
+    Returns:
+    - int: Number of items stored
+    """
+    rows = [(key_part(item.client), key_part(item.doc_number), key_part(item.reference), item.cents,
+             key_part(item.due_date) or None, key_part(item.doc_type) or None, key_part(item.posting_date) or None)
+            for item in items]
+    global _refreshed_in_run
+    today = date.today().isoformat()
+    with connect() as conn:
+        if full:
+            conn.execute("DELETE FROM open_items")
+        conn.executemany("INSERT OR REPLACE INTO open_items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        kinds = ("full", "delta") if full else ("delta",)
+        conn.executemany("INSERT OR REPLACE INTO open_items_refresh VALUES (?, ?)", [(kind, today) for kind in kinds])
+    _refreshed_in_run = True
+    return len(rows)
+
+def open_items_refreshed_on() -> tuple:
+    """
+    Returns when the mirror was last refreshed.
+
+    Returns:
+    - tuple[date | None, date | None]: (last full refresh, last refresh of any kind)
+    """
+    with connect() as conn:
+        dates = dict(conn.execute("SELECT kind, refreshed_on FROM open_items_refresh").fetchall())
+    full_on, last_on = dates.get("full"), dates.get("delta")
+    return (date.fromisoformat(full_on) if full_on else None,
+            date.fromisoformat(last_on) if last_on else None)
+
+def is_mirror_fresh() -> bool:
+    """
+    Tells whether the mirror was refreshed within 'open_items_mirror' → 'max_age_days'.
+
+    Returns:
+    - bool: True if selections can be pre-resolved against the mirror
+    """
+    _, last_on = open_items_refreshed_on()
+    max_age = Load_SAP_info.config["open_items_mirror"]["max_age_days"]
+    return last_on is not None and (date.today() - last_on).days <= max_age
+
+def is_mirror_complete() -> bool:
+    """
+    Tells whether the mirror can stand for the client's list of open items: it is fresh and its last
+    full refresh (the only kind that drops cleared items) is within 'open_items_mirror' → 'full_max_age_days'.
+
+    Returns:
+    - bool: True if the mirror holds no items cleared before the last full refresh window
+    """
+    full_on, _ = open_items_refreshed_on()
+    max_age = Load_SAP_info.config["open_items_mirror"]["full_max_age_days"]
+    return is_mirror_fresh() and full_on is not None and (date.today() - full_on).days <= max_age
+
+def begin_open_items_run():
+    """
+    Starts a payment run: the mirror is not used to tell which references are not open
+    until it is refreshed again in this run (see `open_item_references`).
+
+    Returns:
+    - None
+    """
+    global _refreshed_in_run
+    _refreshed_in_run = False
+
+def mirror_refreshed_in_run() -> bool:
+    """
+    Tells whether the mirror was refreshed since the current payment run started.
+
+    Returns:
+    - bool: True if refreshed in this run
+    """
+    return _refreshed_in_run
+
+def open_items(client_codes) -> list:
+    """
+    Returns the mirrored open items of the given clients, oldest due date first.
+
+    Parameters:
+    - client_codes (iterable): SAP client codes
+
+    Returns:
+    - list[tuple]: (client_code, reference, amount_cents, due_date, doc_number, doc_type), dates as ISO text
+    """
+    codes = sorted({key_part(code) for code in client_codes})
+    with connect() as conn:
+        return conn.execute(
+            f"SELECT client_code, reference, amount_cents, due_date, doc_number, doc_type FROM open_items "
+            f"WHERE client_code IN ({', '.join('?' * len(codes))}) ORDER BY due_date IS NULL, due_date", codes,
+        ).fetchall()
+
+def open_item_references(client_codes) -> set | None:
+    """
+    Returns the references open in SAP for the given clients, if the mirror was refreshed in this run.
+    A reference missing from the set is treated as not open, so an older mirror (even from earlier
+    today) would leave out invoices posted after its refresh.
+
+    Parameters:
+    - client_codes (iterable): SAP client codes
+
+    Returns:
+    - set[str] or None: Open references, or None if the mirror was not refreshed in this run
+    """
+    if not mirror_refreshed_in_run():
+        return None
+    return {reference for _, reference, *_ in open_items(client_codes)}
+
+# -----------------------------------
+# Local template copies
+# -----------------------------------
+def cached_template(config_key: str) -> tuple | None:
+    """
+    Returns the local copy recorded for a configured template.
+
+    Parameters:
+    - config_key (str): SAP_info.json key of the template path (e.g. 'batch_template_path')
+
+    Returns:
+    - tuple or None: (source, modified, size, cached_path) of the shared file when it was copied
+    """
+    with connect() as conn:
+        return conn.execute("SELECT source, modified, size, cached_path FROM template_cache WHERE config_key = ?",
+                            (config_key,)).fetchone()
+
+def save_cached_template(config_key: str, source: str, modified: float, size: int, cached_path: str):
+    """
+    Records the local copy of a configured template.
+
+    Parameters:
+    - config_key (str): SAP_info.json key of the template path
+    - source (str): Shared template path
+    - modified (float): Modification time of the shared file that was copied
+    - size (int): Size of the shared file that was copied
+    - cached_path (str): Local copy
+    """
+    with connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO template_cache VALUES (?, ?, ?, ?, ?)",
+                     (config_key, source, modified, size, cached_path))
@@ -3,21 +3,69 @@
 @author: JesusMMA
 """
 
-import xlwings as xw
 import os
-from PyQt5.QtWidgets import QMessageBox
-from datetime import datetime
+from datetime import date, datetime
 from SAPAux import (call_transaction, new_entry, new_entry_add_data,
                     search_items, simulate, enter_position, get_entry_number,
                     batch_input,back_to_main,enter_ajd,sap_data,items_found_sap,
                     handle_dif
 )
-from UserInputs import show_info,show_question,show_warning,save_confirmation
-from Utilities import detail_handler
+from UserInputs import (show_info,show_question,show_warning,save_confirmation,ask_user_string,
+                        ask_open_files,ask_payment_queue,show_table,YES,NO
+                        )
+from Utilities import detail_handler, fill_batch_template, check_wb_open, read_detail_block
+from RemittanceClassifier import profile_keys, parse_remittance, parse_remittances, DetailClassifier
+from LocalStore import inbox_files, set_inbox_status, open_item_references
+from ReportsModule import ensure_open_items
+from DifferencePolicy import difference_policy
+from HotFolder import load_parsed, content_hash, REMITTANCE
+from WarmUp import template_path
+from RunLog import log_event, INFO, WARNING, ERROR
+import RunLog
+from RunJournal import RunJournal, row_fingerprints, plan_hash, INTENT, POSTED, FAILED
 import Load_SAP_info
 
 
 
+def _invoice_rows(invoices_dic: dict) -> dict:
+    # Detail row → its invoice references (a 7-character reference is searched as X<ref> and V<ref>)
+    rows = {}
+    for reference, row in invoices_dic.items():
+        rows.setdefault(row, []).append(reference)
+    return rows
+
+def _enter_unloaded_invoice(reference, detail_row, clients_dic, due_date, due_date_assignment):
+    """
+    Enters an invoice SAP cannot clear as a manual line for its client:
+    'PAGA FACTURA' (credit) for a positive amount, 'SE DESCUENTA ABONO' (debit) for a negative one.
+
+    Parameters:
+    - reference (str): Invoice reference for the commentary
+    - detail_row (DetailRow): Classified detail row of the invoice
+    - clients_dic (dict): Client keys → SAP codes
+    - due_date (str): Due date ('dd.mm.yyyy')
+    - due_date_assignment (str): Assignment ('yyyymmdd')
+
+    Returns:
+    - None: Adds the line to the open SAP entry
+    """
+    inv_amount = detail_row.amount
+    for name_key in clients_dic:
+        if name_key in detail_row.corp_name:
+            client_code_loop = clients_dic[name_key]
+            if inv_amount > 0:
+                inv_commentary = f"PAGA FACTURA {reference}"
+                new_entry( "16", client_code_loop)
+                if Load_SAP_info.ContinueProgram == False: return
+                new_entry_add_data(inv_amount, due_date,inv_commentary,"-1",due_date_assignment)
+                if Load_SAP_info.ContinueProgram == False: return
+            elif inv_amount < 0:
+                inv_commentary = f"SE DESCUENTA ABONO {reference}"
+                new_entry( "06", client_code_loop)
+                if Load_SAP_info.ContinueProgram == False: return
+                new_entry_add_data(inv_amount * -1, due_date,inv_commentary,"-1",due_date_assignment)
+                if Load_SAP_info.ContinueProgram == False: return
+
 def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dict, wb, ws, payment_detail_path:str):
     """
     From validated detail file, populates and submits SAP batch entries for accounting,
@@ -30,20 +78,22 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
     - Inserts main payment entry with Special G/L indicator
     - Loops through clients to load debit and credit entries
     - Processes unmatched entries individually based on corporate name
-    - Validates SAP data and resolves discrepancies if detected
+    - Enters the invoices the open-items mirror (refreshed in this run) knows are not open as manual lines
+    - Validates SAP data and resolves discrepancies if detected (small ones by 'difference_policy', without asking)
     - Simulates final accounting positions and submits for confirmation
     - Retrieves SAP entry number, saves output file, and deletes original source
 
     Parameters:
     - clients_dic (dict): Dictionary mapping client names to their SAP codes
     - client_detail (dict): Dictionary with structural info from config about file layout and metadata
-    - payment_dic (dict): Dictionary containing aggregated payment data
-    - wb (Workbook): Workbook object of the source Excel file
-    - ws (Worksheet): Worksheet object of the source Excel file
+    - payment_dic (dict): Dictionary containing aggregated payment data and the classified detail rows ('detail_rows')
+    - wb (Workbook): Workbook object of the source Excel file (None for queued payments)
+    - ws (Worksheet): Worksheet object of the source Excel file (None for queued payments)
     - payment_detail_path (str): Path to the original file to be replaced
 
     Returns:
-    - None: writes results to disk, logs SAP entry number, and removes source file
+    - str or None: SAP entry number (None if the process stops); with a workbook, also writes
+      results to disk and removes source file
     """
     # Flag
     Load_SAP_info.ContinueProgram = True
@@ -86,33 +136,25 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
     payment_method = client_detail["payment_method"]
     SGLIndicador = client_detail["SGLIndicator"]
     start_row = client_detail["start_row"]
-    amount_col=client_detail["amount_col"]
-    inv_ref_col = client_detail["inv_ref_col"]
     entry_comment = client_detail["entry_comment"]   
-    # Manage all possibles corp_names data     
-    corp_name_detail = client_detail["corp_name"]
-    if isinstance(corp_name_detail, list):
-        corp_name_row = corp_name_detail[0]
-        corp_name_col = corp_name_detail[1]
-        corp_name = (ws.cells(corp_name_row,corp_name_col).api.Text).strip().upper()
-    elif isinstance(corp_name_detail, str):
-        corp_name = corp_name_detail
-    # Retrieve the payment number from the file
-    payment_number = client_detail["payment_number"]
-    if isinstance(payment_number, int):
-        payment_number_col = payment_number
-        payment_number_row = start_row
-    elif isinstance(payment_number, list):
-        payment_number_row = payment_number[0]
-        payment_number_col = payment_number[1]
-    payment_number = ws.cells(payment_number_row,payment_number_col).api.Text
+    # Retrieve the payment number from the file (already parsed when the payment comes from the queue)
+    payment_number = payment_dic.get("payment_number")
+    if payment_number is None:
+        payment_number = client_detail["payment_number"]
+        if isinstance(payment_number, int):
+            payment_number_col = payment_number
+            payment_number_row = start_row
+        elif isinstance(payment_number, list):
+            payment_number_row = payment_number[0]
+            payment_number_col = payment_number[1]
+        payment_number = ws.cells(payment_number_row,payment_number_col).api.Text
     # Calculate commentary lines for clarity in SAP logs
     commentary = f"{payment_method}. {client_name} {payment_number} vto. {due_date}"
     debt_commentary = f"TOTAL CARGOS {client_name} {payment_number} vto. {due_date}"
     cred_commentary = f"TOTAL ABONOS {client_name} {payment_number} vto. {due_date}"
     ajd_comentary = f"GASTOS AJD {client_name} {payment_number} vto. {due_date}"
     # Callback the SAP Transaction to load the template
-    batch_template_path = Load_SAP_info.config["batch_template_path"]
+    batch_template_path = template_path("batch_template_path")
     batch_input(batch_template_path)
     if Load_SAP_info.ContinueProgram == False: return
     # Initiate promissory note debit with appropriate GL indicator
@@ -141,17 +183,15 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
             if Load_SAP_info.ContinueProgram == False: return
             new_entry_add_data(credit, due_date,cred_commentary,"-1",due_date_assignment)
             if Load_SAP_info.ContinueProgram == False: return
-    if isinstance(inv_ref_col, list):
-        inv_ref_col = inv_ref_col[1]
+    # Detail rows already read and classified by detail_handler (no cell reads per entry)
+    detail_rows = payment_dic["detail_rows"]
     # Iterate through each direct entries and assign it to the corresponding client
     for entry_key in entries_dic:
-        amount = float(ws.cells(entry_key,amount_col).value)
-        inv_ref = ws.cells(entry_key,inv_ref_col).api.Text
-        entry_commentary = f"CARGO {inv_ref} {entry_comment}"
-        if isinstance(corp_name_detail, int):
-            corp_name = (ws.cells(entry_key,corp_name_detail).api.Text).strip().upper()        
+        detail_row = detail_rows[entry_key]
+        amount = detail_row.amount
+        entry_commentary = f"CARGO {detail_row.entry_ref} {entry_comment}"
         for name_key in clients_dic:
-            if name_key in corp_name:
+            if name_key in detail_row.corp_name:
                 client_code_loop = clients_dic[name_key]
                 # Add credit entry to the appropriate client
                 if amount > 0:
@@ -172,6 +212,20 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
     if ajd_amount != 0:
         enter_ajd(ajd_amount,ajd_assignment,ajd_comentary,due_date)
         if Load_SAP_info.ContinueProgram == False: return
+    # Invoices the open-items mirror knows are not open in SAP are entered manually now,
+    # instead of scraping the loaded items after the difference shows up
+    invoice_rows = _invoice_rows(invoices_dic)
+    open_refs = open_item_references(clients_dic.values())
+    missing_rows = {}
+    if open_refs is not None:
+        missing_rows = {row: references for row, references in invoice_rows.items()
+                        if not any(reference in open_refs for reference in references)}
+    for row, references in missing_rows.items():
+        _enter_unloaded_invoice(references[0], detail_rows[row], clients_dic, due_date, due_date_assignment)
+        if Load_SAP_info.ContinueProgram == False: return
+    if missing_rows:
+        log_event(INFO, f"{len(missing_rows)} facturas no abiertas en SAP se han añadido manualmente")
+    invoices_amount = round(invoices_amount - sum(detail_rows[row].amount for row in missing_rows), 2)
     # Retrieve critical data from the SAP entry
     result_data = sap_data()
     if Load_SAP_info.ContinueProgram == False: return
@@ -181,43 +235,29 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
     total_amount = result_data["total_amount"]
     # Check for differences in the SAP entry and handle them accordingly
     if dif_amount != 0:
-        total_invoices = len(invoices_dic)
+        total_invoices = len(invoice_rows) - len(missing_rows)
         invoices_dif = invoices_amount - items_amount
         # Fix unloaded invoices by tracing missing references and add entry
+        # (needed when the mirror was not refreshed in this run or an item was cleared after its last refresh)
         if  invoices_dif != 0 and total_invoices != total_items_loaded:
-            ask = show_question("Confirmación",
-                                f"Hay diferencia en las Facturas: {dif_amount}\n¿Quieres ajustar la diferencia?")
-            if ask == QMessageBox.No:
-                show_info("Cancelación", "No se ha ajustado la diferencia")
-                return
+            if difference_policy().adjust_invoices(dif_amount, client_code):
+                log_event(INFO, f"Diferencia en las Facturas {dif_amount} ajustada automáticamente")
+            else:
+                ask = show_question("Confirmación",
+                                    f"Hay diferencia en las Facturas: {dif_amount}\n¿Quieres ajustar la diferencia?")
+                if ask == NO:
+                    show_info("Cancelación", "No se ha ajustado la diferencia")
+                    return
             invoices_SAP_ref = items_found_sap()
-            for inv_key in invoices_dic:
-                if not inv_key in invoices_SAP_ref:
-                    inv_row = invoices_dic[inv_key]
-                    inv_amount = ws.cells(inv_row,amount_col).value
-                    if isinstance(corp_name_detail, int):
-                        inv_corp = (ws.cells(inv_row,corp_name_detail).api.Text).strip().upper()
-                    else:
-                        inv_corp = (ws.cells(inv_row,corp_name_col).api.Text).strip().upper()
-                    for name_key in clients_dic:
-                        if name_key in inv_corp:
-                            client_code_loop = clients_dic[name_key]
-                            if inv_amount > 0:
-                                inv_commentary = f"PAGA FACTURA {inv_key}"
-                                new_entry( "16", client_code_loop)
-                                if Load_SAP_info.ContinueProgram == False: return
-                                new_entry_add_data(inv_amount, due_date,inv_commentary,"-1",due_date_assignment)
-                                if Load_SAP_info.ContinueProgram == False: return
-                            elif inv_amount < 0:
-                                inv_amount = inv_amount * -1
-                                inv_commentary = f"SE DESCUENTA ABONO {inv_key}"
-                                new_entry( "06", client_code_loop)
-                                if Load_SAP_info.ContinueProgram == False: return
-                                new_entry_add_data(inv_amount, due_date,inv_commentary,"-1",due_date_assignment)
-                                if Load_SAP_info.ContinueProgram == False: return
+            for row, references in invoice_rows.items():
+                if row in missing_rows or any(reference in invoices_SAP_ref for reference in references):
+                    continue
+                _enter_unloaded_invoice(references[0], detail_rows[row], clients_dic, due_date, due_date_assignment)
+                if Load_SAP_info.ContinueProgram == False: return
         # If discrepancy is due to rounding, apply final adjustment to match totals
         elif invoices_dif != 0 and total_invoices == total_items_loaded:
-            show_info("Diferencia", "La diferencia esta en centimos acumulados")
+            if difference_policy().decide(dif_amount, client_code).action is None:
+                show_info("Diferencia", "La diferencia esta en centimos acumulados")
             handle_dif(dif_amount,client_code,due_date)
             if Load_SAP_info.ContinueProgram == False: return
     # Simulate accounting entry and generate final positions
@@ -236,6 +276,9 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
     # Retrieve the entry number generated during the accounting process
     entry_num = get_entry_number()
     if Load_SAP_info.ContinueProgram == False: return
+    # Queued payments have no open workbook: the queue renames the file when all its payments are posted
+    if wb is None:
+        return entry_num
     # Save updated Excel file using SAP entry number within the filename
     folder = os.path.dirname(payment_detail_path)
     new_path = os.path.join(folder, f"{entry_num} {client_name} {payment_amount}.xlsx")    
@@ -248,6 +291,7 @@ def payment_batch_template(clients_dic:dict, client_detail:dict, payment_dic:dic
         print("Old file deleted.")
     else:
         print("Old file not found.")     
+    return entry_num
 
 def payment_search_amount(client_name,client_aux_name=""):
     """
@@ -278,6 +322,7 @@ def payment_search_amount(client_name,client_aux_name=""):
             - Searches matching SAP entries
             - Simulates and confirms each accounting position
         - SAP reference number is saved to worksheet
+    - Every promissory note is journaled (intent, entry number) so a crashed run resumes without posting twice
  
     Parameters:
     - client_name (str): Client identifier used for template protection and naming
@@ -295,9 +340,8 @@ def payment_search_amount(client_name,client_aux_name=""):
         company_code = Load_SAP_info.config["company_code"]
         client_detail = Load_SAP_info.config[f"{client_name_lower}_pag_detail"]
         ajd_assignment = client_detail["ajd_assignment"]
-        # Open and clear previous template data
-        template_path = Load_SAP_info.config["unify_template_path"]
-        wb = xw.Book(template_path)
+        # Open and clear previous template data (on the share: the entry numbers are saved into it)
+        wb = check_wb_open(Load_SAP_info.config["unify_template_path"])
         ws = wb.sheets[0]
         ws.api.Unprotect(Password=client_name)
         end_row = ws.range("A1").end("down").row
@@ -306,13 +350,18 @@ def payment_search_amount(client_name,client_aux_name=""):
         # Prompt user to prepare the input worksheet before starting
         ask = show_question("Input de Usuario", "Prepare el fichero con los datos necesarios")
         # Exit early if user cancels or SAP session cannot be initiated
-        if ask == QMessageBox.No:
+        if ask == NO:
             show_info("Cancelación", "Cancelado por el Usuario")
             return
         ws.api.Unprotect(Password=client_name)
         end_row = ws.range("A1").end("down").row
         # Iterate through rows and parse all relevant fields for each promissory note
+        journal = RunJournal(f"payment_{client_name_lower}")
+        last_intent = None
         for i in range(2, end_row + 1):
+            # A promissory note whose posting stopped early closes its intent as failed
+            if last_intent and journal.interrupted(last_intent):
+                journal.record(FAILED, last_intent, reason="Cancelado")
             # SAP due_date
             due_date = datetime().strptime(ws.cells(i, 7).value,"%d/%m/%Y").date() # Due Date
             due_date_assignment = due_date.strftime("%Y%m%d")
@@ -336,6 +385,25 @@ def payment_search_amount(client_name,client_aux_name=""):
             ws.cells(i, 6).value = commentary
             ws.cells(i, 8).value = due_date_assignment
             ws.cells(i, 10).value = search_amount
+            # Idempotency: a promissory note that already has an entry number is never posted again
+            fingerprint = row_fingerprints([(doc_date, amount, payment_number, due_date)])[0]
+            if journal.interrupted(fingerprint):
+                ask = show_question("Ejecución interrumpida",
+                                    f"El pagaré {payment_number} quedó a medias en la ejecución anterior.\n"
+                                    "¿Se llegó a grabar el asiento en SAP?", explicit=True)
+                entry_num = ask_user_string("número de asiento", explicit=True) if ask == YES else None
+                if entry_num:
+                    journal.record(POSTED, fingerprint, row=i, entry_num=entry_num)
+                else:
+                    journal.record(FAILED, fingerprint, row=i, reason="Ejecución interrumpida")
+            if journal.entry_number(fingerprint) is not None:
+                ws.cells(i, 11).value = journal.entry_number(fingerprint)
+                log_event(INFO, f"Pagaré {payment_number} ya contabilizado con el asiento {journal.entry_number(fingerprint)}", row=i)
+                continue
+            journal.record(INTENT, fingerprint, row=i,
+                           plan=plan_hash({"client": client_code, "amount": amount, "ajd": ajd, "search": search_amount,
+                                           "commentary": commentary, "due_date": due_date}))
+            last_intent = fingerprint
             # Begin SAP input flow
             # Call the new entry transaction
             call_transaction("F-04")
@@ -374,7 +442,10 @@ def payment_search_amount(client_name,client_aux_name=""):
             # Store SAP-generated reference number into the worksheet
             entry_num = get_entry_number()
             if Load_SAP_info.ContinueProgram == False: continue
+            journal.record(POSTED, fingerprint, row=i, entry_num=entry_num)
             ws.cells(i, 11).value = entry_num
+        if last_intent and journal.interrupted(last_intent):
+            journal.record(FAILED, last_intent, reason="Cancelado")
         # Finalize file and reapply protection
         ws.api.Protect(Password=client_name)
         wb.save()
@@ -383,11 +454,39 @@ def payment_search_amount(client_name,client_aux_name=""):
             pass
         else:
             show_warning("Error",f"{type(e).__name__} - {str(e)}")
+            Load_SAP_info.ContinueProgram = False
 
 # ------------------
 # Specific Programs
 # ------------------
 
+def _detail_profile(client_name):
+    """
+    Maps a client as listed in the Pagarés / Confirming tabs to the names detail_handler expects.
+
+    Parameters:
+    - client_name (str): Listed client name (e.g. 'El Corte Ingles Web', 'Alcampo Pago Unif')
+
+    Returns:
+    - tuple[str, str]: (client name, auxiliary name selecting the '<aux>_detail' profile, or "")
+    """
+    client_aux_name = ""
+    if client_name == "Cecosa":
+        client_aux_name = "eroski"
+    elif "El Corte Ingles" in client_name:
+        client_aux_name = client_name.replace("El Corte Ingles", "ECI")
+        client_aux_name = client_aux_name.replace(" ","_")
+        client_name = "ECI"
+    elif client_name == "Casa del Libro":
+        client_name = "CDL"
+    elif "Alcampo" in client_name:
+        if "Pago Unif" in client_name:
+            client_aux_name = "alcampo_pago_unif"
+        else:
+            client_aux_name ="alcampo_pag"
+        client_name ="Alcampo"
+    return client_name, client_aux_name
+
 def payment (client_name):
     """
     Entry point for processing a client's  payment workflow.
@@ -395,7 +494,7 @@ def payment (client_name):
 
     Workflow:
     - For 'Alcampo', initiates lump-sum payment automation and AJD handling via `_pag_search_amount`
-    - For other clients, determines auxiliary configuration (e.g. 'Cecosa' → 'eroski')
+    - For other clients, offers to refresh the open-items mirror and determines auxiliary configuration (e.g. 'Cecosa' → 'eroski')
     - Launches promissory note detail handler to categorize and prepare payments via `_pag_detail_handler`
 
     Parameters:
@@ -407,21 +506,183 @@ def payment (client_name):
     if client_name == "Alcampo":
         payment_search_amount(client_name)
     else:
-        if client_name == "Cecosa":
-            client_aux_name = "eroski"
-        elif "El Corte Ingles" in client_name:
-            client_name_aux = client_name.replace("El Corte Ingles", "ECI")
-            client_name_aux = client_name_aux.replace(" ","_")
-            client_name = "ECI"
-        elif client_name == "Casa del Libro":
-            client_name = "CDL"
-        elif "Alcampo" in client_name:
-            if "Pago Unif" in client_name:
-                client_aux_name = "alcampo_pago_unif"
-            else:
-                client_aux_name ="alcampo_pag"
-            client_name ="Alcampo"
-        detail_handler(client_name,client_aux_name)
+        ensure_open_items()
+        detail_handler(*_detail_profile(client_name))
+
+def payment_queue(client_names):
+    """
+    Posts several remittance detail files in one go (e.g. Carrefour, Eroski, ECI and Alcampo on the same morning).
+
+    Workflow:
+    - Offers the detail files the hot folder found in the inbox (client preselected from the detected format),
+      otherwise the operator selects all detail files at once
+    - Operator sets the client and total of each file in one grid
+    - Offers to refresh the open-items mirror, so invoices no longer open are entered without scraping SAP
+    - Every file is read and classified up front, in parallel worker processes (openpyxl, no Excel),
+      unless the hot folder already parsed it with the same profile;
+      files openpyxl cannot read are read through Excel instead
+    - Files whose detail does not add up to the typed total are left out
+    - Each payment (one per payment number and due date) fills the batch template and is posted
+      through `payment_batch_template`, one after another on the SAP session
+    - Every payment is journaled by file content, payment number and due date: payments already posted
+      in an earlier run are skipped, and one left between intent and result is asked about
+    - After a cancelled or failed payment the operator decides whether the queue goes on with the next files
+      (each file starts with the run flag set again) or stops there
+    - Fully posted files are renamed with their entry numbers, partly posted inbox files are marked as such,
+      and a summary table lists every file (the ones left after a stop as not attempted)
+
+    Parameters:
+    - client_names (list[str]): Clients offered in the grid (as listed in the Pagarés / Confirming tabs)
+
+    Returns:
+    - None: posts the payments in SAP and shows the summary
+    """
+    Load_SAP_info.ContinueProgram = True
+    # Files identified (and already parsed) by the hot folder are offered first
+    # (files partly posted in an earlier run are offered again, flagged as such)
+    partial = {path for _, path, _, _ in inbox_files(REMITTANCE, "partial")}
+    inbox = {path: (file_hash, profile, parsed_path)
+             for status in ("ready", "partial")
+             for file_hash, path, profile, parsed_path in inbox_files(REMITTANCE, status) if os.path.exists(path)}
+    paths = None
+    if inbox:
+        pending_note = f" ({len(partial & set(inbox))} aplicados en parte)" if partial & set(inbox) else ""
+        ask = show_question("Bandeja de entrada",
+                            f"Hay {len(inbox)} ficheros de detalle en la bandeja de entrada{pending_note}.\n¿Usarlos?")
+        if ask == YES:
+            paths = list(inbox)
+    if not paths:
+        inbox = {}
+        paths = ask_open_files("Abre los ficheros con el detalle de Facturas")
+    if not paths:
+        return
+    listed_profiles = {name: profile_keys(*_detail_profile(name))[0] for name in client_names}
+    guesses = {}
+    for path in paths:
+        profile = inbox.get(path, (None, None, None))[1]
+        guesses[path] = next((name for name in client_names if profile and listed_profiles[name] == profile), None) or \
+                        next((name for name in client_names if name.lower() in os.path.basename(path).lower()), None)
+    queue = ask_payment_queue(paths, [name for name in client_names if name != "Alcampo"], guesses)
+    if not queue:
+        return
+    ensure_open_items()
+    # Parse and classify every file up front
+    jobs = []
+    for path, listed_name, total in queue:
+        client_name, client_aux_name = _detail_profile(listed_name)
+        profile, clients_key = profile_keys(client_name, client_aux_name)
+        jobs.append({"path": path, "client_name": client_name, "profile": profile,
+                     "client_detail": Load_SAP_info.config[profile], "clients_dic": Load_SAP_info.config[clients_key]})
+    # Reuse the hot folder parse when the operator kept the detected profile
+    parsed = {index: load_parsed(inbox[job["path"]][2]) for index, job in enumerate(jobs)
+              if job["path"] in inbox and inbox[job["path"]][1] == job["profile"]}
+    pending = [job for index, job in enumerate(jobs) if parsed.get(index) is None]
+    parsed_now = iter(parse_remittances(pending))
+    results = [parsed.get(index) or next(parsed_now) for index in range(len(jobs))]
+    journal = RunJournal("payment_queue")
+    summary = []
+    stopped = False
+    for position, ((path, listed_name, total), job, result) in enumerate(zip(queue, jobs, results), start=1):
+        file_name = os.path.basename(path)
+        if stopped:
+            summary.append([file_name, listed_name, total, "", "No intentado"])
+            continue
+        RunLog.set_workflow(listed_name)
+        # A payment cancelled in the previous file must not stop (or half run) this one
+        Load_SAP_info.ContinueProgram = True
+        if result["error"]:
+            # Formats openpyxl cannot read (e.g. .xls) are read through Excel
+            wb = check_wb_open(path)
+            ws = wb.sheets[0]
+            last_cell = ws.used_range.last_cell
+            job["values"] = read_detail_block(ws, DetailClassifier(job["client_detail"], job["clients_dic"]),
+                                              last_cell.row, last_cell.column)
+            wb.close()
+            result = parse_remittance(job)
+        if result["error"]:
+            log_event(ERROR, f"{file_name}: {result['error']}")
+            summary.append([file_name, listed_name, total, "", "Error de lectura"])
+            continue
+        if result["detail_amount"] != total:
+            log_event(WARNING, f"{file_name}: el detalle suma {result['detail_amount']} y se indicó {total}")
+            summary.append([file_name, listed_name, total, "", "No cuadra"])
+            continue
+        # Payments are keyed on the file content, so a renamed or copied file is still recognised
+        file_hash = inbox[path][0] if path in inbox else content_hash(path)
+        fingerprints = row_fingerprints([(file_hash, group["payment_number"], group["due_date"])
+                                         for group in result["groups"]])
+        entries = []
+        for group, fingerprint in zip(result["groups"], fingerprints):
+            classification = group["classification"]
+            if classification.error_row is not None:
+                log_event(ERROR, f"{file_name}: tipo de factura no contemplada", row=classification.error_row)
+                break
+            # Idempotency: a payment that already has an entry number is never posted again
+            if journal.interrupted(fingerprint):
+                ask = show_question("Ejecución interrumpida",
+                                    f"El pago {group['payment_number']} de {file_name} quedó a medias en la ejecución anterior.\n"
+                                    "¿Se llegó a grabar el asiento en SAP?", explicit=True)
+                entry_num = ask_user_string("número de asiento", explicit=True) if ask == YES else None
+                if entry_num:
+                    journal.record(POSTED, fingerprint, file=file_name, entry_num=entry_num)
+                else:
+                    journal.record(FAILED, fingerprint, file=file_name, reason="Ejecución interrumpida")
+            if journal.entry_number(fingerprint) is not None:
+                log_event(INFO, f"{file_name}: pago {group['payment_number']} ya contabilizado "
+                                f"con el asiento {journal.entry_number(fingerprint)}")
+                entries.append(str(journal.entry_number(fingerprint)))
+                continue
+            doc_date = date.today().strftime("%d.%m.%Y")
+            fill_batch_template(job["client_name"], job["client_detail"], job["clients_dic"],
+                                doc_date, classification.template_refs)
+            payment_dic = {"client_name": job["client_name"],
+                           "payment_number": group["payment_number"],
+                           "due_date": group["due_date"].strftime("%d.%m.%Y"),
+                           "due_date_assignment": group["due_date"].strftime("%Y%m%d"),
+                           "doc_date": doc_date,
+                           "doc_date_assignment": date.today().strftime("%Y%m%d"),
+                           "payment_amount": group["amount"],
+                           "invoices_amount": classification.invoices_amount,
+                           "ajd_amount": classification.ajd_amount,
+                           "debit_amounts": classification.debit_amounts,
+                           "credit_amounts": classification.credit_amounts,
+                           "entries_dic": classification.entries_dic,
+                           "invoices_dic": classification.invoices_dic,
+                           "detail_rows": classification.rows}
+            journal.record(INTENT, fingerprint, file=file_name,
+                           plan=plan_hash({"client": job["client_name"], "payment_number": group["payment_number"],
+                                           "due_date": group["due_date"], "amount": group["amount"],
+                                           "invoices": classification.invoices_amount, "ajd": classification.ajd_amount}))
+            entry_num = payment_batch_template(job["clients_dic"], job["client_detail"], payment_dic, None, None, path)
+            if not entry_num:
+                journal.record(FAILED, fingerprint, file=file_name, reason="No aplicado")
+                log_event(WARNING, f"{file_name}: pago {group['payment_number']} no aplicado")
+                back_to_main()
+                if position < len(queue):
+                    ask = show_question("Cola de pagos", f"No se ha aplicado el pago {group['payment_number']} de {file_name}.\n"
+                                        f"¿Continuar con los {len(queue) - position} ficheros restantes?", explicit=True)
+                    stopped = ask != YES
+                break
+            journal.record(POSTED, fingerprint, file=file_name, entry_num=entry_num)
+            log_event(INFO, f"{file_name}: pago {group['payment_number']} aplicado con el asiento {entry_num}")
+            entries.append(str(entry_num))
+        if len(entries) == len(result["groups"]):
+            # Keep the file under its entry numbers, as the single-file flow does
+            extension = os.path.splitext(path)[1]
+            new_name = f"{'-'.join(entries)} {job['client_name']} {total}{extension}"
+            os.replace(path, os.path.join(os.path.dirname(path), new_name))
+            if path in inbox:
+                set_inbox_status(inbox[path][0], "posted")
+            summary.append([file_name, listed_name, total, ", ".join(entries), "Aplicado"])
+        elif entries:
+            # The posted payments are skipped on the next run; the file is no longer offered as untouched
+            if path in inbox:
+                set_inbox_status(inbox[path][0], "partial")
+            summary.append([file_name, listed_name, total, ", ".join(entries), "Aplicado en parte"])
+        else:
+            summary.append([file_name, listed_name, total, ", ".join(entries), "No Aplicado"])
+    show_table("Cola de pagos", f"{len(queue)} ficheros procesados:",
+               ["Fichero", "Cliente", "Total", "Asientos", "Estado"], summary)
               
 # ---------
 # Debug
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import re
+import sys
+from DiffUI import Ui_Form
+from PyQt5.QtWidgets import (
+    QApplication, QMessageBox, QInputDialog, QFileDialog,
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QTableWidget, QTableWidgetItem,
+    QComboBox, QPushButton, QDialogButtonBox, QAbstractItemView, QDoubleSpinBox, QLineEdit
+)
+from PyQt5.QtCore import QLocale
+import xlwings as xw
+from UserInputs import InputProvider, YES, NO, show_info, show_warning
+
+_THOUSANDS_RE = re.compile(r"^[-+]?\d{1,3}(\.\d{3})+$")
+
+# -----------------------------------------------
+#  Qt input provider
+# -----------------------------------------------
+class QtInputProvider(InputProvider):
+    """
+    Asks the operator through PyQt5 dialogs (one method per kind).
+    """
+    def ask(self, kind: str, prompt: str, **context):
+        app = QApplication.instance()
+        if not app:
+            app = QApplication(sys.argv)
+        # Only decision files care whether a prompt needs an explicit answer
+        context.pop("explicit", None)
+        return getattr(self, f"_{kind}")(prompt, **context)
+
+    def _info(self, prompt, title=""):
+        QMessageBox.information(None, title, prompt)
+
+    def _warning(self, prompt, title=""):
+        QMessageBox.warning(None, title, prompt)
+
+    def _question(self, prompt, title="", buttons=YES | NO):
+        return QMessageBox.question(None, title, prompt, QMessageBox.StandardButtons(buttons))
+
+    def _table(self, prompt, title="", headers=(), rows=()):
+        return _table_window(title, prompt, headers, rows)
+
+    def _difference(self, prompt, dif=None):
+        dialog = DiffDialog(dif)
+        return dialog.result if dialog.exec_() == QDialog.Accepted else None
+
+    def _row_decisions(self, prompt, rows=(), defaults=None):
+        dialog = DecisionGrid(rows, defaults)
+        return dialog.decisions() if dialog.exec_() == QDialog.Accepted else None
+
+    def _payment_queue(self, prompt, paths=(), clients=(), guesses=None):
+        dialog = PaymentQueueGrid(paths, clients, guesses)
+        return dialog.jobs() if dialog.exec_() == QDialog.Accepted else None
+
+    def _open_file(self, prompt):
+        return QFileDialog.getOpenFileName(None, prompt)[0] or None
+
+    def _open_files(self, prompt):
+        return QFileDialog.getOpenFileNames(None, prompt)[0] or None
+
+    def _save_file(self, prompt, default_name=""):
+        return QFileDialog.getSaveFileName(None, prompt, default_name, "Archivos de Excel (*.xlsx)")[0] or None
+
+    def _folder(self, prompt):
+        return QFileDialog.getExistingDirectory(None, prompt) or None
+
+    def _date(self, prompt):
+        text, ok = QInputDialog.getText(None, "Introduce Fecha", prompt)
+        return text if ok else None
+
+    def _number(self, prompt):
+        dialog = QInputDialog()
+        dialog.setInputMode(QInputDialog.DoubleInput)
+        dialog.setLabelText(f"Introduce el importe de {prompt}:")
+        dialog.setWindowTitle("Introduce importe")
+        dialog.setLocale(QLocale(QLocale.English, QLocale.UnitedStates))  # Forces dot as decimal
+        dialog.setDoubleDecimals(2)
+        dialog.setDoubleRange(0.0, 9999999999.0)
+        dialog.setDoubleValue(0.0)
+        return dialog.doubleValue() if dialog.exec_() == QInputDialog.Accepted else None
+
+    def _text(self, prompt):
+        text, ok = QInputDialog.getText(None, "Introduce comentario", f"Introduce el {prompt}:")
+        return text if ok else None
+
+    def _choice(self, prompt, title="", items=()):
+        item, ok = QInputDialog.getItem(None, title, prompt, list(items), 0, False)
+        return item if ok else None
+
+# Non-modal windows must stay referenced or Qt closes them right away
+_open_tables = []
+
+def _table_window(title: str, message: str, headers: list, rows: list) -> QDialog:
+    dialog = QDialog()
+    dialog.setWindowTitle(title)
+    dialog.setModal(False)
+    dialog.resize(700, 400)
+    layout = QVBoxLayout(dialog)
+    layout.addWidget(QLabel(message))
+    table = QTableWidget(len(rows), len(headers))
+    table.setHorizontalHeaderLabels(headers)
+    for row_index, values in enumerate(rows):
+        for col_index, value in enumerate(values):
+            table.setItem(row_index, col_index, QTableWidgetItem("" if value is None else str(value)))
+    table.resizeColumnsToContents()
+    table.horizontalHeader().setStretchLastSection(True)
+    layout.addWidget(table)
+    _open_tables.append(dialog)
+    dialog.finished.connect(lambda _: _open_tables.remove(dialog))
+    dialog.show()
+    return dialog
+
+# -----------------------------------------------
+#  Dialogs
+# -----------------------------------------------
+class DiffDialog(QDialog):
+    """
+    PyQt5 dialog for selecting SAP difference handling strategy (rounding or account assignment).
+    
+    Returns:
+    - result: Set to 'round_dif' or 'to_account' based on user action
+    """
+    def __init__(self, diff_value):
+        super().__init__()
+        self.ui = Ui_Form()
+        self.ui.setupUi(self)
+        self.ui.retranslateUi(self, diff_value)
+
+        self.result:str |None = None
+        self.ui.RoundBtn.clicked.connect(self.handle_round)
+        self.ui.ToAccountBtn.clicked.connect(self.handle_to_account)
+
+    def handle_round(self):
+        self.result = "round_dif"
+        self.accept()  # closes the dialog and sets result to Accepted
+
+    def handle_to_account(self):
+        self.result = "to_account"
+        self.accept()
+
+
+class DecisionGrid(QDialog):
+    """
+    PyQt5 dialog where the operator sets, for every pending bank row at once, the decisions
+    that daily_payments used to ask row by row: client category, PA / no PA, where the
+    remittance detail is and which manual entries the payment has.
+    Manual amounts are typed in the row itself, separated by ';' (negative ones debit the client).
+    A bulk fill bar applies any value to the selected rows (or to all rows if none is selected).
+
+    Parameters:
+    - rows (list[tuple]): (row number, action, client code, amount, concept) per pending row
+    - defaults (dict, optional): Preselected decisions per row number (e.g. the configured detail source)
+
+    Returns:
+    - decisions(): {row number: {"category", "no_pa", "detail", "manual", "amounts"}}
+    """
+    CATEGORIES = {"D": "D - Deudor", "K": "K - Acreedor"}
+    NO_PA = {False: "Con PA", True: "Sin PA"}
+    DETAIL_SOURCES = {"fichero": "Fichero aparte", "banco": "Fichero del banco", "sin": "Sin detalle"}
+    MANUAL_ENTRIES = {"no": "No", "importes": "Importes", "rango": "Rango"}
+    # Decision columns: (key, header, options, applies only to RELACION)
+    COLUMNS = [("category", "Categoría", CATEGORIES, False),
+               ("no_pa", "PA", NO_PA, True),
+               ("detail", "Detalle", DETAIL_SOURCES, True),
+               ("manual", "Apuntes manuales", MANUAL_ENTRIES, True)]
+    INFO_HEADERS = ["Fila", "Acción", "Cliente", "Importe", "Concepto"]
+    AMOUNTS_HEADER = "Importes manuales"
+
+    def __init__(self, rows, defaults=None):
+        super().__init__()
+        self.rows = rows
+        defaults = defaults or {}
+        self.setWindowTitle("Decisiones de los pagos")
+        self.resize(1000, 500)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Revisa las decisiones de cada pago antes de empezar.\n"
+                                "Selecciona filas y usa 'Aplicar' para rellenarlas de una vez."))
+        # Bulk fill bar
+        bar = QHBoxLayout()
+        self.bulk = {}
+        for key, header, options, _ in self.COLUMNS:
+            combo = QComboBox()
+            combo.addItem(f"{header}: —", None)
+            for value, label in options.items():
+                combo.addItem(label, value)
+            self.bulk[key] = combo
+            bar.addWidget(combo)
+        apply_btn = QPushButton("Aplicar")
+        apply_btn.clicked.connect(self.apply_bulk)
+        bar.addWidget(apply_btn)
+        layout.addLayout(bar)
+        # Decision table
+        headers = self.INFO_HEADERS + [header for _, header, _, _ in self.COLUMNS] + [self.AMOUNTS_HEADER]
+        self.table = QTableWidget(len(rows), len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.combos = {}
+        self.amounts = {}
+        for row_index, (row_number, action, client_code, amount, concept) in enumerate(rows):
+            for col_index, value in enumerate([row_number, action, client_code, amount, concept]):
+                self.table.setItem(row_index, col_index, QTableWidgetItem("" if value is None else str(value)))
+            for offset, (key, _, options, relacion_only) in enumerate(self.COLUMNS):
+                if relacion_only and action != "RELACION":
+                    continue
+                combo = QComboBox()
+                for value, label in options.items():
+                    combo.addItem(label, value)
+                default = defaults.get(row_number, {}).get(key)
+                if default is not None and combo.findData(default) >= 0:
+                    combo.setCurrentIndex(combo.findData(default))
+                self.table.setCellWidget(row_index, len(self.INFO_HEADERS) + offset, combo)
+                self.combos[(row_index, key)] = combo
+            if action == "RELACION":
+                amounts = defaults.get(row_number, {}).get("amounts") or []
+                edit = QLineEdit("; ".join(f"{value:.2f}".replace(".", ",") for value in amounts))
+                edit.setPlaceholderText("p. ej. 120,50; -30")
+                # Typing amounts switches the row to manual amounts
+                edit.textEdited.connect(lambda text, row_index=row_index: self.use_amounts(row_index, text))
+                self.table.setCellWidget(row_index, len(headers) - 1, edit)
+                self.amounts[row_index] = edit
+        self.table.resizeColumnsToContents()
+        layout.addWidget(self.table)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def apply_bulk(self):
+        selected = {index.row() for index in self.table.selectionModel().selectedRows()}
+        targets = selected or set(range(len(self.rows)))
+        for key, combo in self.bulk.items():
+            value = combo.currentData()
+            if value is None:
+                continue
+            for row_index in targets:
+                cell = self.combos.get((row_index, key))
+                if cell is not None:
+                    cell.setCurrentIndex(cell.findData(value))
+
+    def use_amounts(self, row_index, text):
+        combo = self.combos.get((row_index, "manual"))
+        if combo is not None and text.strip():
+            combo.setCurrentIndex(combo.findData("importes"))
+
+    @staticmethod
+    def parse_amounts(text) -> list:
+        # '1.234,56; -30; 1.234' → [1234.56, -30.0, 1234.0]
+        amounts = []
+        for part in text.split(";"):
+            part = part.strip().replace(" ", "")
+            if not part:
+                continue
+            if "," in part or _THOUSANDS_RE.match(part):
+                # Spanish notation: dots group thousands, so '1.234' is 1234 and not 1,234
+                part = part.replace(".", "").replace(",", ".")
+            amounts.append(float(part))
+        return amounts
+
+    def accept(self):
+        for row_index, edit in self.amounts.items():
+            try:
+                self.parse_amounts(edit.text())
+            except ValueError:
+                show_warning("Importes manuales", f"Importes no válidos en la fila {self.rows[row_index][0]}: {edit.text()}")
+                return
+        super().accept()
+
+    def decisions(self) -> dict:
+        result = {}
+        for row_index, (row_number, *_) in enumerate(self.rows):
+            result[row_number] = {key: (self.combos[(row_index, key)].currentData()
+                                        if (row_index, key) in self.combos else next(iter(options)))
+                                  for key, _, options, _ in self.COLUMNS}
+            edit = self.amounts.get(row_index)
+            result[row_number]["amounts"] = self.parse_amounts(edit.text()) if edit is not None else []
+        return result
+
+
+class PaymentQueueGrid(QDialog):
+    """
+    PyQt5 dialog listing every remittance detail file dropped into the payment queue,
+    where the operator sets the client of each file and types its total once.
+
+    Parameters:
+    - paths (list[str]): Detail file paths
+    - clients (list[str]): Client names offered (as listed in the Pagarés / Confirming tabs)
+    - guesses (dict, optional): Preselected client per path
+
+    Returns:
+    - jobs(): [(path, client name, total)] in file order
+    """
+    def __init__(self, paths, clients, guesses=None):
+        super().__init__()
+        self.paths = paths
+        self.setWindowTitle("Cola de pagos")
+        self.resize(800, 400)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Indica el cliente y el total de cada fichero de detalle."))
+        self.table = QTableWidget(len(paths), 3)
+        self.table.setHorizontalHeaderLabels(["Fichero", "Cliente", "Total"])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.combos = []
+        self.totals = []
+        for row_index, path in enumerate(paths):
+            self.table.setItem(row_index, 0, QTableWidgetItem(path.replace("\\", "/").split("/")[-1]))
+            combo = QComboBox()
+            combo.addItems(clients)
+            guess = (guesses or {}).get(path)
+            if guess in clients:
+                combo.setCurrentIndex(clients.index(guess))
+            self.table.setCellWidget(row_index, 1, combo)
+            self.combos.append(combo)
+            total = QDoubleSpinBox()
+            total.setLocale(QLocale(QLocale.English, QLocale.UnitedStates))  # Forces dot as decimal
+            total.setDecimals(2)
+            total.setRange(0.0, 9999999999.0)
+            self.table.setCellWidget(row_index, 2, total)
+            self.totals.append(total)
+        self.table.resizeColumnsToContents()
+        layout.addWidget(self.table)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+    def jobs(self) -> list:
+        return [(path, combo.currentText(), round(total.value(), 2))
+                for path, combo, total in zip(self.paths, self.combos, self.totals)]
+
+
+class RangeSelectorWindow(QDialog):
+    """
+    PyQt5 dialog for selecting a cell range in Excel to either store or transfer into a template.
+    Used in SAP-related workflows to handle manual input of invoice ranges and posting entries.
+
+    Workflow:
+    - Launches a modal window prompting the user to select a cell range in Excel
+    - Offers two actions:
+        - 'Pasar a Template': Copies the selected range into a target template sheet
+        - 'Almacenar rango': Saves the selected range to use later in the script
+    - Handles cancellations gracefully by notifying the user
+    - On confirmation, the selected data is either transferred or stored for downstream logic
+
+    Parameters:
+    - wbTemplate (Workbook): The Excel workbook containing the destination sheet
+    - destination_start_cell (str): Top-left cell where copied data should begin (e.g. 'D10')
+
+    Attributes:
+    - selected_range: Stores the user-selected cell range for external use
+
+    Usage:
+    This dialog is typically triggered via `launch_range_selector()` (Utilities) after a workbook is loaded.
+    """
+    def __init__(self, wbTemplate, destination_start_cell):
+        super().__init__()
+        self.wbTemplate = wbTemplate
+        self.destination_start_cell = destination_start_cell
+        self.selected_range = None 
+        self.setWindowTitle("Confirmar Selección")
+        self.setFixedSize(300, 150)
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        label = QLabel("Selecciona el rango en Excel\nLuego haz clic en OK para copiar.")
+        layout.addWidget(label)
+
+        to_template_btn = QPushButton("Pasar a Template")
+        to_template_btn.clicked.connect(self.on_to_template_btn)
+        layout.addWidget(to_template_btn)
+        
+        save_range_btn = QPushButton("Almacenar rango")
+        save_range_btn.clicked.connect(self.on_save_range_btn)
+        layout.addWidget(save_range_btn)
+
+        cancel_btn = QPushButton("Cancelar")
+        cancel_btn.clicked.connect(self.on_cancel)
+        layout.addWidget(cancel_btn)
+
+        self.setLayout(layout)
+        self.show()  # Modeless by default
+
+    def on_to_template_btn(self):
+        selected_range = self.wbTemplate.app.selection
+
+        if not selected_range:
+            show_info("Cancelar","No hay una selección válida.")
+            return
+        self.transfer_range(selected_range)
+        self.accept()
+    def on_save_range_btn(self):
+        selected_range = self.wbTemplate.app.selection
+        if not selected_range:
+            show_info("Cancelar","No hay una selección válida.")
+            return
+        self.selected_range = selected_range
+        self.accept()  # Close the dialog and return control
+        
+    def on_cancel(self):
+        show_info("Cancelar","Selección cancelada por el usuario.")
+        self.cancel()
+
+    def transfer_range(self, selected_range):
+        wsTemplate = self.wbTemplate.sheets[0]
+        start_row = xw.Range(self.destination_start_cell).row
+        start_col = xw.Range(self.destination_start_cell).column
+
+        for i, row in enumerate(selected_range.rows):
+            for j, cell in enumerate(row):
+                wsTemplate.cells(start_row + i, start_col + j).value = cell.value
+        self.wbTemplate.app.status_bar = "Listo"
+
+# ---------
+# Debug
+# ---------   
+# Saveguard
+if __name__ == "__main__":
+    # Optional: test a dialog or widget
+    QtInputProvider().ask("info", "Este módulo se ejecuta directamente.", title="Módulo cargado")
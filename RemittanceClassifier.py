@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from AmountMatcher import to_cents
+import Load_SAP_info
+
+# -----------------------------------
+# Remittance detail classifier
+# -----------------------------------
+DetailRow = namedtuple("DetailRow", ["row", "inv_ref", "entry_ref", "amount", "doc_type", "corp_name"])
+Classification = namedtuple("Classification", ["template_refs", "invoices_dic", "invoices_amount", "entries_dic",
+                                               "debit_amounts", "credit_amounts", "ajd_amount", "rows", "error_row"])
+
+def cell_text(value) -> str:
+    """
+    Text of a cell value as Excel displays it for references and codes (12345678.0 → '12345678').
+
+    Parameters:
+    - value: Raw cell value
+
+    Returns:
+    - str: Cell text ('' for empty cells)
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.strftime("%d/%m/%Y")
+    return str(value)
+
+# Zero-padded number formats ('00000000') used for numeric references
+_ZERO_PAD = re.compile(r"^0+$")
+
+def is_plain_format(number_format) -> bool:
+    """
+    Whether `display_text` reproduces the text Excel shows for a number format.
+
+    Parameters:
+    - number_format (str): Excel number format (None for mixed formats)
+
+    Returns:
+    - bool: True for 'General', text ('@') and zero-padded formats
+    """
+    return number_format in ("General", "@") or bool(_ZERO_PAD.match(number_format or ""))
+
+def display_text(value, number_format: str | None = None) -> str:
+    """
+    Text of a cell as Excel displays it, applying zero-padded number formats.
+
+    >>> display_text(1234567, "00000000")
+    '01234567'
+    >>> display_text(1234567.0, "General")
+    '1234567'
+
+    Parameters:
+    - value: Raw cell value
+    - number_format (str, optional): Excel number format of the cell
+
+    Returns:
+    - str: Displayed text ('' for empty cells)
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and float(value).is_integer() \
+            and _ZERO_PAD.match(number_format or ""):
+        return str(int(value)).zfill(len(number_format))
+    return cell_text(value)
+
+class DetailClassifier:
+    """
+    Classifier of remittance detail rows compiled once per '<client>_detail' profile.
+
+    The allowed document type lists become sets and the client keys of the '<client>_dic'
+    are resolved once per distinct corporate name, so a whole sheet read in one block is
+    classified in a single pass without touching Excel.
+
+    Classification (in this order, per row):
+    - Invoice: document type and first reference character in 'invoices_allowed'
+      (8-character references as is, 7-character ones as X<ref> and V<ref>)
+    - Credit: type in 'credit_allowed' and positive amount → entry if the reference starts with
+      'entry_match', else added to the credit total of every client key found in the corporate name
+    - Debit: type in 'debit_allowed' and negative amount → same as credit, on the debit totals
+    - AJD: type in 'ajd_allowed' → AJD amount (positive)
+    - Anything else: individual entry
+    """
+    def __init__(self, client_detail: dict, clients_dic: dict):
+        self.clients = list(clients_dic)
+        self.amount_col = client_detail["amount_col"]
+        inv_ref_col = client_detail["inv_ref_col"]
+        if isinstance(inv_ref_col, list):
+            self.inv_ref_col, self.entry_ref_col = inv_ref_col
+        else:
+            self.inv_ref_col = self.entry_ref_col = inv_ref_col
+        self.doc_type_col = client_detail["doc_type_col"]
+        self.corp_name = client_detail["corp_name"]
+        self.start_row = client_detail["start_row"]
+        self.invoices_allowed = set(client_detail.get("invoices_allowed", []))
+        self.credit_allowed = set(client_detail.get("credit_allowed", []))
+        self.debit_allowed = set(client_detail.get("debit_allowed", []))
+        self.ajd_allowed = set(client_detail.get("ajd_allowed", []))
+        self.entry_match = set(client_detail.get("entry_match", []))
+        columns = [self.amount_col, self.inv_ref_col, self.entry_ref_col, self.doc_type_col or 1]
+        if isinstance(self.corp_name, int):
+            columns.append(self.corp_name)
+        elif isinstance(self.corp_name, list):
+            columns.append(self.corp_name[1])
+        # Last column the classifier reads, so callers can read the sheet in one block
+        self.last_col = max(columns)
+        # Reference, document type and payment number cells are read as displayed text
+        # (a zero-padded reference 01234567 must not become 1234567)
+        self.text_cols = tuple(sorted({self.inv_ref_col, self.entry_ref_col, self.doc_type_col} - {None}))
+        payment_number = client_detail.get("payment_number")
+        if isinstance(payment_number, int):
+            self.text_cols = tuple(sorted(set(self.text_cols) | {payment_number}))
+            self.text_cells = ()
+        else:
+            self.text_cells = (tuple(payment_number),) if payment_number else ()
+        self._corp_keys = {}
+
+    def is_text(self, row: int, col: int) -> bool:
+        """
+        Whether a cell is read as displayed text (reference, document type or payment number).
+
+        >>> classifier = DetailClassifier({"amount_col": 1, "inv_ref_col": 2, "doc_type_col": None,
+        ...                                "corp_name": "CLIENTE", "start_row": 2, "payment_number": 3}, {})
+        >>> classifier.is_text(2, 2), classifier.is_text(2, 1), classifier.is_text(1, 2)
+        (True, False, False)
+        >>> classifier.read_rows([[], [10.0, display_text(1234567, "00000000"), "P1"]], 2)[0].inv_ref
+        '01234567'
+
+        Parameters:
+        - row (int): Cell row
+        - col (int): Cell column
+
+        Returns:
+        - bool: True for the text columns from 'start_row' and the payment number header cell
+        """
+        return (row >= self.start_row and col in self.text_cols) or (row, col) in self.text_cells
+
+    def corp_keys(self, corp_name: str) -> tuple:
+        """
+        Client keys contained in a corporate name, resolved once per distinct name.
+
+        Parameters:
+        - corp_name (str): Corporate name (upper case)
+
+        Returns:
+        - tuple[str]: Matching keys of the '<client>_dic'
+        """
+        keys = self._corp_keys.get(corp_name)
+        if keys is None:
+            keys = self._corp_keys[corp_name] = tuple(key for key in self.clients if key in corp_name)
+        return keys
+
+    def read_rows(self, values: list, end_row: int) -> list:
+        """
+        Builds the detail rows from the sheet values read in one block.
+
+        Parameters:
+        - values (list[list]): Sheet values from A1 to (`end_row`, `last_col`), with the `is_text`
+          cells already read as displayed text
+        - end_row (int): Last detail row
+
+        Returns:
+        - list[DetailRow]: One row per detail line, from 'start_row' to `end_row`
+        """
+        def cell(row, col):
+            line = values[row - 1]
+            return line[col - 1] if col - 1 < len(line) else None
+
+        if isinstance(self.corp_name, list):
+            corp_name = cell_text(cell(*self.corp_name)).strip().upper()
+        elif isinstance(self.corp_name, str):
+            corp_name = self.corp_name
+        rows = []
+        for i in range(self.start_row, end_row + 1):
+            inv_ref = cell_text(cell(i, self.inv_ref_col)).replace("-", "")
+            if self.doc_type_col:
+                doc_type = cell_text(cell(i, self.doc_type_col)).upper()
+            else:
+                doc_type = inv_ref[:1]
+            if isinstance(self.corp_name, int):
+                corp_name = cell_text(cell(i, self.corp_name)).strip().upper()
+            rows.append(DetailRow(i, inv_ref, cell_text(cell(i, self.entry_ref_col)),
+                                  round(float(cell(i, self.amount_col) or 0), 2), doc_type, corp_name))
+        return rows
+
+    def classify(self, rows: list) -> Classification:
+        """
+        Classifies the detail rows in one pass (amounts added in integer cents).
+
+        Parameters:
+        - rows (list[DetailRow]): Rows from `read_rows`
+
+        Returns:
+        - Classification: Template references, invoices_dic, invoices amount, entries_dic,
+          debit/credit totals per client key, AJD amount, rows by number and the first
+          row with an unsupported invoice reference (None if all are valid)
+        """
+        template_refs = []
+        invoices_dic = {}
+        entries_dic = {}
+        invoices = 0
+        ajd_amount = 0.0
+        debit = dict.fromkeys(self.clients, 0)
+        credit = dict.fromkeys(self.clients, 0)
+        error_row = None
+        for row in rows:
+            left_ref = row.inv_ref[:1]
+            cents = to_cents(row.amount)
+            if row.doc_type in self.invoices_allowed and left_ref in self.invoices_allowed:
+                if len(row.inv_ref) == 8:
+                    references = [row.inv_ref]
+                elif len(row.inv_ref) == 7:
+                    references = [f"X{row.inv_ref}", f"V{row.inv_ref}"]
+                else:
+                    error_row = row.row
+                    break
+                for reference in references:
+                    template_refs.append(reference)
+                    invoices_dic[reference] = row.row
+                invoices += cents
+            elif row.doc_type in self.credit_allowed and cents > 0:
+                if left_ref in self.entry_match:
+                    entries_dic[row.row] = row.row
+                else:
+                    for key in self.corp_keys(row.corp_name):
+                        credit[key] += cents
+            elif row.doc_type in self.debit_allowed and cents < 0:
+                if left_ref in self.entry_match:
+                    entries_dic[row.row] = row.row
+                else:
+                    for key in self.corp_keys(row.corp_name):
+                        debit[key] += cents
+            elif row.doc_type in self.ajd_allowed:
+                ajd_amount = abs(row.amount)
+            else:
+                entries_dic[row.row] = row.row
+        return Classification(template_refs, invoices_dic, invoices / 100, entries_dic,
+                              {key: cents / 100 for key, cents in debit.items()},
+                              {key: cents / 100 for key, cents in credit.items()},
+                              ajd_amount, {row.row: row for row in rows}, error_row)
+
+def profile_keys(client_name: str, client_aux_name: str = "") -> tuple:
+    """
+    Config keys of the detail profile and the client codes of a client (e.g. 'ECI_Codice' → 'ECI_Codice_detail', 'ECI_dic').
+
+    Parameters:
+    - client_name (str): Primary client identifier
+    - client_aux_name (str, optional): Auxiliary identifier for alternate configurations
+
+    Returns:
+    - tuple[str, str]: (detail profile key, client codes key)
+    """
+    if client_aux_name:
+        return f"{client_aux_name}_detail", f"{client_aux_name.split('_')[0]}_dic"
+    return f"{client_name.lower()}_detail", f"{client_name.lower()}_dic"
+
+_CLASSIFIERS = {}
+
+def detail_classifier(profile: str, clients_key: str) -> DetailClassifier:
+    """
+    Returns the classifier of a detail profile from SAP_info.json, compiling it once.
+
+    Parameters:
+    - profile (str): Detail profile key (e.g. 'carrefour_detail')
+    - clients_key (str): Client codes key (e.g. 'carrefour_dic')
+
+    Returns:
+    - DetailClassifier: Shared classifier
+    """
+    key = (profile, clients_key)
+    if key not in _CLASSIFIERS:
+        _CLASSIFIERS[key] = DetailClassifier(Load_SAP_info.config[profile], Load_SAP_info.config[clients_key])
+    return _CLASSIFIERS[key]
+
+# -----------------------------------
+# Up-front parsing (worker processes)
+# -----------------------------------
+def _cell_date(value) -> date | None:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+def read_values(path: str, text=None) -> list:
+    """
+    Reads the first sheet of an xlsx file without Excel.
+
+    Parameters:
+    - path (str): File path
+    - text (callable, optional): (row, col) → True for the cells read as displayed text
+      (e.g. `DetailClassifier.is_text`)
+
+    Returns:
+    - list[list]: Sheet values from A1
+    """
+    # openpyxl is only needed by the payment queue workers and the hot folder
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        if text is None:
+            return [list(row) for row in ws.iter_rows(values_only=True)]
+        return [[display_text(cell.value, cell.number_format) if text(row, col) else cell.value
+                 for col, cell in enumerate(line, start=1)]
+                for row, line in enumerate(ws.iter_rows(), start=1)]
+    finally:
+        wb.close()
+
+def parse_remittance(job: dict) -> dict:
+    """
+    Reads and classifies one remittance detail file without Excel, split into one group per
+    payment number and due date (as detail_handler splits the sheets).
+
+    Parameters:
+    - job (dict): 'path', 'client_detail' and 'clients_dic' (plus 'values' if the sheet was already read,
+      with the text cells as displayed)
+
+    Returns:
+    - dict: 'path', 'detail_amount', 'groups' [{'payment_number', 'due_date', 'amount', 'classification'}]
+      and 'error' (None if the file was parsed)
+    """
+    result = {"path": job["path"], "detail_amount": 0.0, "groups": [], "error": None}
+    try:
+        client_detail = job["client_detail"]
+        classifier = DetailClassifier(client_detail, job["clients_dic"])
+        values = job.get("values") or read_values(job["path"], classifier.is_text)
+        values = [list(row) + [None] * (classifier.last_col - len(row)) for row in values]
+
+        def cell(row, col):
+            line = values[row - 1] if row - 1 < len(values) else []
+            return line[col - 1] if col - 1 < len(line) else None
+
+        start_row = client_detail["start_row"]
+        amount_col = client_detail["amount_col"]
+        # Same block as end("down") on the amount column
+        end_row = start_row
+        while cell(end_row + 1, amount_col) not in (None, ""):
+            end_row += 1
+        rows = classifier.read_rows(values, end_row)
+        # Payment number and due date: header cell or one value per row
+        payment_number = client_detail["payment_number"]
+        due_date = client_detail["due_date"]
+        def group_key(row):
+            number = cell(row, payment_number) if isinstance(payment_number, int) else cell(*payment_number)
+            due = cell(row, due_date[0]) if len(due_date) == 1 else cell(*due_date)
+            return cell_text(number), _cell_date(due)
+        groups = {}
+        for row in rows:
+            groups.setdefault(group_key(row.row), []).append(row)
+        for (number, due), group_rows in groups.items():
+            if due is None:
+                raise ValueError(f"Fecha de vencimiento no válida en la fila {group_rows[0].row}")
+            result["groups"].append({"payment_number": number, "due_date": due,
+                                     "amount": sum(to_cents(row.amount) for row in group_rows) / 100,
+                                     "classification": classifier.classify(group_rows)})
+        result["detail_amount"] = sum(to_cents(row.amount) for row in rows) / 100
+    except Exception as e:
+        result["error"] = f"{type(e).__name__} - {e}"
+    return result
+
+def parse_remittances(jobs: list, max_workers: int | None = None) -> list:
+    """
+    Parses several remittance detail files at once, one per worker process.
+
+    Parameters:
+    - jobs (list[dict]): Jobs accepted by `parse_remittance`
+    - max_workers (int, optional): Worker processes (defaults to one per CPU, capped by jobs)
+
+    Returns:
+    - list[dict]: Results of `parse_remittance`, in the same order as `jobs`
+    """
+    workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [parse_remittance(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_remittance, jobs))
@@ -7,14 +7,26 @@ import Load_SAP_info
 import os
 import time
 from SAPAux import call_transaction, call_variant, SAPSessionManager, back_to_main, run_background_job
-from UserInputs import ask_user_date, ask_open_file, ask_user_string,show_info, ask_open_files,show_warning
-from datetime import datetime, timedelta
+from UserInputs import (ask_user_date, ask_open_file, ask_user_string,show_info, ask_open_files,show_warning,
+                        ask_save_file,show_question,ask_folder,YES
+)
+from datetime import date, datetime, timedelta
 from Utilities import (check_wb_open,split_by_filter,setup_headers,
                        merge_sheets,set_data_validation,
-                       get_unique_column_values
+                       get_unique_column_values,last_row_of,read_block,write_column,write_rows,
+                       sanitize_sheet_name
+)
+from SpoolReader import build_balance_report
+from HeadlessExcel import write_workbooks
+from LocalStore import (has_returned_comments, mark_report_run, latest_report_comments, save_report_comments,
+                        reference_sheet, save_reference_sheet, key_part,
+                        save_open_items, open_items_refreshed_on, begin_open_items_run, mirror_refreshed_in_run
 )
+from AmountMatcher import read_open_items
+from RemittanceClassifier import read_values
+from RunLog import log_event, INFO, ERROR
 
-def _export_sap_file(filename, folder_path):
+def _export_sap_file(filename, folder_path, variant=r"\AM PA GESTOR", work_date=None, fields=None):
     """
     Automates the export of an SAP financial report using transaction FBL5N and a predefined variant.
 
@@ -22,8 +34,8 @@ def _export_sap_file(filename, folder_path):
     - Checks for an active SAP GUI session; initiates connection if missing
     - Launches transaction FBL5N in SAP
     - Applies the configured report variant for consistent filtering
-    - Prompts user for the report’s end-of-month date
-    - Populates the report field and triggers execution
+    - Prompts user for the report’s end-of-month date (unless given)
+    - Populates the report field (and any extra selection field) and triggers execution
     - Handles optional pop-up dialog if present
     - Navigates SAP menu to initiate export functionality
     - Sets export destination path and filename
@@ -32,6 +44,9 @@ def _export_sap_file(filename, folder_path):
     Parameters:
     - filename (str): Desired name of the exported report file
     - folder_path (str): Full path where the report should be saved
+    - variant (str, optional): FBL5N selection variant
+    - work_date (str, optional): Key date ('dd.mm.yyyy'); asked to the user if missing
+    - fields (dict, optional): Extra selection fields (SAP GUI id → text), e.g. a posting date from
 
     Returns:
     - None: Export file to disk
@@ -45,12 +60,15 @@ def _export_sap_file(filename, folder_path):
     call_transaction("FBL5N")
     if Load_SAP_info.ContinueProgram == False: return
     # Load variant for customized report filters/settings
-    call_variant(r"\AM PA GESTOR")
+    call_variant(variant)
     if Load_SAP_info.ContinueProgram == False: return
     # Ask user for report cutoff date
-    work_date = ask_user_date("Introduce el último día del mes")
+    if work_date is None:
+        work_date = ask_user_date("Introduce el último día del mes")
     # Fill date field and run report
     session.findById("wnd[0]/usr/ctxtPA_STIDA").text = work_date
+    for field_id, text in (fields or {}).items():
+        session.findById(field_id).text = text
     session.findById("wnd[0]").sendVKey(0)
     session.findById("wnd[0]/tbar[1]/btn[8]").press()
     # Handle optional pop-up window if present
@@ -69,6 +87,72 @@ def _export_sap_file(filename, folder_path):
     if Load_SAP_info.ContinueProgram == False: return
 
 
+def refresh_open_items(delta: bool = False):
+    """
+    Refreshes the local open-items mirror from an FBL5N export.
+
+    Workflow:
+    - Exports every client's open items at today's key date with the 'open_items_mirror' variant
+      into the local data folder (a delta export only selects items posted since the last refresh)
+    - Reads the export without Excel, with the 'open_items_detail' columns plus the posting date
+    - Replaces the mirror (full) or adds the new items to it (delta)
+
+    Items cleared since the last full refresh stay in the mirror until the next full one, so the
+    amount matcher only reads it after a recent full refresh. The payment flows only treat a reference
+    missing from it as NOT open when it was refreshed in the same run.
+
+    Parameters:
+    - delta (bool, optional): Export only the items posted since the last refresh
+
+    Returns:
+    - int or None: Number of items stored (None if the export did not finish)
+    """
+    Load_SAP_info.ContinueProgram = True
+    mirror = Load_SAP_info.config["open_items_mirror"]
+    folder = Load_SAP_info.config["local_data_path"]
+    filename = mirror["file_name"]
+    export_path = os.path.join(folder, filename)
+    if os.path.exists(export_path):
+        os.remove(export_path)
+    fields = {}
+    _, last_on = open_items_refreshed_on()
+    delta = delta and last_on is not None
+    if delta:
+        fields[mirror["posting_date_field"]] = last_on.strftime("%d.%m.%Y")
+    _export_sap_file(filename, folder, mirror["variant"], date.today().strftime("%d.%m.%Y"), fields)
+    if Load_SAP_info.ContinueProgram == False or not os.path.exists(export_path):
+        log_event(ERROR, "Partidas abiertas: no se ha exportado FBL5N")
+        return None
+    detail = {**Load_SAP_info.config["open_items_detail"], "posting_date_col": mirror["posting_date_col"]}
+    items = read_open_items(read_values(export_path), None, detail)
+    stored = save_open_items(items, full=not delta)
+    log_event(INFO, f"Partidas abiertas: {stored} partidas {'nuevas' if delta else 'cargadas'}")
+    return stored
+
+def ensure_open_items():
+    """
+    Offers to refresh the open-items mirror at the start of a payment run. Selections are only
+    pre-resolved against a mirror refreshed in the run, since an invoice posted after an earlier
+    refresh would be taken as not open.
+    A delta refresh is proposed while the last full one is recent ('full_refresh_days'), a full one otherwise.
+
+    Returns:
+    - bool: True if selections can be pre-resolved against the mirror
+    """
+    begin_open_items_run()
+    full_on, last_on = open_items_refreshed_on()
+    today = date.today()
+    days = Load_SAP_info.config["open_items_mirror"]["full_refresh_days"]
+    delta = full_on is not None and (today - full_on).days < days
+    since = last_on.strftime("%d/%m/%Y") if last_on else "nunca"
+    ask = show_question("Partidas abiertas",
+                        f"Partidas abiertas actualizadas: {since}.\n"
+                        f"¿Actualizarlas ahora desde FBL5N ({'solo nuevas' if delta else 'completas'})?")
+    if ask == YES:
+        refresh_open_items(delta)
+        # A failed refresh does not stop the payment: it runs without pre-resolution
+        Load_SAP_info.ContinueProgram = True
+    return mirror_refreshed_in_run()
 
 def _copy_previous_report(wb, report_path, sheets_to_copy):
     """
@@ -101,15 +185,17 @@ def _compare_and_copy(ws_ini, ws_base, wb):
     """
     Compares rows from an initial sheet with a base sheet using keys based on columns F, G, and J.
     Copies corresponding comments and account manager data into matching rows, and assigns account managers by client code.
+    Runs as an in-memory hash join: both sheets are read in bulk and each result column is written back in one block.
     
     Workflow:
     - Calculates last filled rows in both sheets for accurate range limits
-    - Builds dictionaries from `ws_base` keyed by F|G|J for lookups
-    - Builds a secondary dictionary mapping client codes to row positions
-    - Reads account manager assignments from the "CUENTAS CON GESTOR" sheet
+    - Reads columns F:O of both sheets with a single call each
+    - Builds a dictionary from `ws_base` keyed by F|G|J
+    - Reads account manager assignments from the full used range of the "CUENTAS CON GESTOR" sheet
     - For each row in `ws_ini`, checks for a matching composite key in `dict_base`
-    - If found, transfers values from columns L, M, and O
+    - If found, takes values from columns L, M, and O; unmatched rows are not written (formulas are kept)
     - Assigns account manager to column N based on client code via `gest_dict`
+    - Writes column N back as a single block and L, M, O per run of consecutive matched rows
     
     Parameters:
     - ws_ini: Excel Worksheet with initial report data
@@ -119,33 +205,181 @@ def _compare_and_copy(ws_ini, ws_base, wb):
     Returns:
     - None: updates worksheet cells
     """
-    last_ini_row = ws_ini.range("F" + str(ws_ini.cells.last_cell.row)).end("up").row
-    last_base_row = ws_base.range("F" + str(ws_base.cells.last_cell.row)).end("up").row
-    dict_base = {}
-    dict_clients = {}
-    for j in range(2, last_base_row + 1):
-        cellF = ws_base.range(f"F{j}").value
-        cellG = ws_base.range(f"G{j}").value
-        cellJ = ws_base.range(f"J{j}").value
-        key = f"{cellF}|{cellG}|{cellJ}"
-        dict_base[key] = j
-        dict_clients[cellG] = j
-    gest_dict = {row[0]: row[2] for row in wb.sheets["CUENTAS CON GESTOR"].range("A1:C100").value if row and row[0]}
-    for i in range(2, last_ini_row):
-        cellF = ws_ini.range(f"F{i}").value
-        cellG = ws_ini.range(f"G{i}").value
-        cellJ = ws_ini.range(f"J{i}").value
-        key = f"{cellF}|{cellG}|{cellJ}"
-        if key in dict_base:
-            row = dict_base[key]
-            ws_ini.range(f"L{i}").value = ws_base.range(f"L{row}").value
-            ws_ini.range(f"M{i}").value = ws_base.range(f"M{row}").value
-            ws_ini.range(f"O{i}").value = ws_base.range(f"O{row}").value
-        ws_ini.range(f"N{i}").value = gest_dict.get(ws_ini.range(f"G{i}").value, "")
-    show_info("Fin", "Se han copiado los datos a la hoja {ws_ini.name}")
+    last_ini_row = last_row_of(ws_ini, "F")
+    last_base_row = last_row_of(ws_base, "F")
+    # Column offsets inside the F:O block
+    F, G, J, L, M, O = 0, 1, 4, 6, 7, 9
+    base_rows = read_block(ws_base, "F", "O", 2, last_base_row)
+    # Last row of ws_ini is the totals row and is left untouched
+    ini_rows = read_block(ws_ini, "F", "O", 2, last_ini_row - 1)
+    dict_base = {f"{row[F]}|{row[G]}|{row[J]}": row for row in base_rows}
+    ws_gest = wb.sheets["CUENTAS CON GESTOR"]
+    gest_rows = read_block(ws_gest, "A", "C", 1, last_row_of(ws_gest, "A"))
+    gest_dict = {row[0]: row[2] for row in gest_rows if row and row[0]}
+    matched, col_n = {}, []
+    for index, row in enumerate(ini_rows):
+        match = dict_base.get(f"{row[F]}|{row[G]}|{row[J]}")
+        if match is not None:
+            matched[index] = [match[L], match[M], match[O]]
+        col_n.append(gest_dict.get(row[G], ""))
+    write_rows(ws_ini, 2, matched, ["L", "M", "O"])
+    write_column(ws_ini, "N", 2, col_n)
+    show_info("Fin", f"Se han copiado los datos a la hoja {ws_ini.name}")
 
 
 
+def _join_comment_store(ws_ini):
+    """
+    Fills the new report from the local comment store instead of last month's workbook.
+    Same hash join as `_compare_and_copy`, but the reference side is the latest stored
+    comments/control/balance per F|G|J key and the stored "CUENTAS CON GESTOR" sheet.
+    
+    Workflow:
+    - Reads columns F:O of `ws_ini` with a single call
+    - Loads the latest stored values per key and the account manager map from the store
+    - Takes L, M and O from the store when the key matches; unmatched rows are not written (formulas are kept)
+    - Assigns account manager to column N based on client code
+    - Writes column N back as a single block and L, M, O per run of consecutive matched rows
+    
+    Parameters:
+    - ws_ini: Excel Worksheet with initial report data
+    
+    Returns:
+    - None: updates worksheet cells
+    """
+    last_ini_row = last_row_of(ws_ini, "F")
+    F, G, J = 0, 1, 4
+    # Last row of ws_ini is the totals row and is left untouched
+    ini_rows = read_block(ws_ini, "F", "O", 2, last_ini_row - 1)
+    stored = latest_report_comments()
+    gest_dict = {key_part(row[0]): row[2] for row in reference_sheet("CUENTAS CON GESTOR") if row and row[0]}
+    matched, col_n = {}, []
+    for index, row in enumerate(ini_rows):
+        match = stored.get((key_part(row[F]), key_part(row[G]), key_part(row[J])))
+        if match is not None:
+            matched[index] = list(match)
+        col_n.append(gest_dict.get(key_part(row[G]), ""))
+    write_rows(ws_ini, 2, matched, ["L", "M", "O"])
+    write_column(ws_ini, "N", 2, col_n)
+    show_info("Fin", f"Se han copiado los datos del histórico a la hoja {ws_ini.name}")
+
+def _restore_reference_sheets(wb, sheet_names):
+    """
+    Recreates the reference sheets (actions lists, account manager map, the other sheets copied
+    from last month's report) and the empty account manager sheets from the store, so validations,
+    lookups and `split_by_filter` work without opening last month's report.
+    
+    Parameters:
+    - wb: Excel Workbook
+    - sheet_names (list[str]): Reference sheet names to restore
+    
+    Returns:
+    - None: updates Excel file
+    """
+    for name in sheet_names:
+        rows = reference_sheet(name)
+        if not rows:
+            print(f"[WARNING] La hoja {name} no está en el histórico local")
+            continue
+        sheet = wb.sheets.add(after=wb.sheets[-1])
+        sheet.name = name
+        sheet.range("A1").value = rows
+
+def _stored_sheet_names() -> tuple:
+    # (reference sheets kept whole, account manager sheets kept as their header row only)
+    managers = Load_SAP_info.config["account_managers"]
+    references = list(Load_SAP_info.config["report_reference_sheets"])
+    references += [name for name in Load_SAP_info.config["report_sheets_copy"]
+                   if name not in managers and name not in references]
+    return references, managers
+
+def _store_returned_comments(rows, report_date):
+    """
+    Saves the comments, control and balance values the account managers sent back
+    (account manager sheets merged into 'Base datos' and per-manager files), keyed by F|G|J.
+    When a key appears more than once, the last row wins (per-manager files go last).
+    
+    Parameters:
+    - rows (list[list]): Report rows from column A (as in the report and the per-manager files)
+    - report_date (str): Date the comments are stored under, in ISO format
+    
+    Returns:
+    - None: updates the local store
+    """
+    F, G, J, L, M, O = 5, 6, 9, 11, 12, 14
+    by_key = {}
+    for row in rows:
+        if row and len(row) > O and row[F] is not None:
+            by_key[(key_part(row[F]), key_part(row[G]), key_part(row[J]))] = (row[F], row[G], row[J], row[L], row[M], row[O])
+    changed = save_report_comments(by_key.values(), report_date)
+    mark_report_run("returned")
+    print(f"[INFO] Histórico de comentarios actualizado con los comentarios de los gestores: {changed} cambios")
+
+def _store_report(wb, reference_sheets, manager_sheets):
+    """
+    Saves the report's reference sheets (and the header of each account manager sheet) into the
+    local store and records that a report was generated: next month's run joins against the
+    store only after the account managers' comments come back.
+    
+    Parameters:
+    - wb: Excel Workbook of the saved report
+    - reference_sheets (list[str]): Reference sheet names to store whole
+    - manager_sheets (list[str]): Account manager sheet names to store as their header row
+    
+    Returns:
+    - None: updates the local store
+    """
+    for name in reference_sheets + manager_sheets:
+        try:
+            sheet = wb.sheets[name]
+        except Exception:
+            continue
+        rows = sheet.used_range.options(ndim=2).value
+        save_reference_sheet(name, rows[:1] if name in manager_sheets else rows)
+    mark_report_run("generated")
+
+def _write_manager_files(wb, ws_ini, folder, report_name):
+    """
+    Writes one standalone workbook per account manager (column N) next to the main report,
+    with the same headers and ACCIONES dropdown lists. Rows are read from Excel once and the
+    files are written concurrently in worker processes, without Excel.
+    
+    Parameters:
+    - wb: Excel Workbook of the report
+    - ws_ini: Excel Worksheet with the full report data
+    - folder (str): Destination folder
+    - report_name (str): Prefix for the file names
+    
+    Returns:
+    - list[tuple]: (path, rows written) per account manager file
+    """
+    N = 13
+    data = ws_ini.used_range.options(ndim=2).value
+    header, rows = data[0], data[1:]
+    by_manager = {}
+    for row in rows:
+        by_manager.setdefault(row[N] or "SIN DATOS", []).append(row)
+    # Header colors come from the same config used by setup_headers
+    header_colors = {}
+    for item in Load_SAP_info.config["large_retail_report_detail"]["headers"]:
+        col_letter = "".join(ch for ch in item["cell"] if ch.isalpha())
+        header_colors[ws_ini.range(f"{col_letter}1").column - 1] = item["color"]
+    acciones = wb.sheets["ACCIONES"].used_range.options(ndim=2).value
+    validations = [(header.index("GESTION"), "ACCIONES", 2), (header.index("CUADRE"), "ACCIONES", 0)]
+    jobs = []
+    for manager, manager_rows in by_manager.items():
+        name = sanitize_sheet_name(str(manager))
+        jobs.append({
+            "path": os.path.join(folder, f"{report_name} {name}.xlsx"),
+            "sheet_name": name,
+            "header": header,
+            "rows": manager_rows,
+            "header_colors": header_colors,
+            "reference_sheets": {"ACCIONES": acciones},
+            "validations": validations,
+        })
+    return write_workbooks(jobs)
+
 def large_format_retailers_file():
     """
      Orchestrates the entire report processing flow:
@@ -155,13 +389,17 @@ def large_format_retailers_file():
      - Constructs file path for today’s export
      - Optionally triggers SAP export (commented out)
      - Opens generated workbook and sets header formatting
-     - Loads previous report and copies relevant sheets
-     - Creates base sheet and merges account manager data
-     - Compares and copies values between sheets
+     - Optionally reads the per-manager files sent back by the account managers
+     - Loads the previous report, copies its sheets, merges the account manager sheets (and the
+       returned per-manager files) into a base sheet, stores them as the managers' comments and
+       compares them; only when the managers' comments already reached the store since the last
+       report, the user can join against the local comment store instead
      - Deletes final empty row to clean up layout
      - Applies data validation to management columns
      - Splits data into individual sheets per account manager
      - Prompts user to rename the initial sheet and save the final output
+     - Stores the saved report's reference sheets in the local comment store
+     - Optionally writes a standalone workbook per account manager (in parallel, without Excel)
      - Closes workbook and deletes temporary working file
     
      Parameters:
@@ -179,14 +417,41 @@ def large_format_retailers_file():
     wb = check_wb_open(full_path)
     ws_ini = wb.sheets[0]
     setup_headers(ws_ini,"large_retail_report")
-    last_report_path = ask_open_file("Abre el Informe del Mes Anterior")
-    _copy_previous_report(wb, last_report_path, Load_SAP_info.config["report_sheets_copy"])
-    # Add sheet named 'Base datos'
-    base_sheet = wb.sheets.add(after=wb.sheets[-1])
-    base_sheet.name = "Base datos"
-    ws_ini.range("1:1").copy(base_sheet.range("1:1"))
-    merge_sheets(wb, base_sheet, Load_SAP_info.config["account_managers"])
-    _compare_and_copy(ws_ini, base_sheet, wb)
+    reference_sheets, manager_sheets = _stored_sheet_names()
+    report_date = datetime.today().date().isoformat()
+    # Per-manager files (see _write_manager_files) come back with the managers' comments
+    returned_rows = []
+    ask = show_question("Comentarios", "¿Hay ficheros por gestor devueltos con comentarios?")
+    if ask == YES:
+        for path in ask_open_files("Abre los ficheros por gestor devueltos") or []:
+            returned_rows += read_values(path)[1:]
+    if Load_SAP_info.ContinueProgram == False: return
+    # Last month's report is the default: the store is only offered once the managers' comments reached it
+    use_store = False
+    if returned_rows:
+        _store_returned_comments(returned_rows, report_date)
+    if has_returned_comments():
+        ask = show_question("Comentarios",
+                            "El histórico local ya tiene los comentarios devueltos por los gestores.\n"
+                            "¿Usar el histórico local?\n(No = abrir el Informe del Mes Anterior)")
+        use_store = ask == YES
+    if use_store:
+        _restore_reference_sheets(wb, reference_sheets + manager_sheets)
+        _join_comment_store(ws_ini)
+    else:
+        last_report_path = ask_open_file("Abre el Informe del Mes Anterior")
+        if Load_SAP_info.ContinueProgram == False: return
+        _copy_previous_report(wb, last_report_path, Load_SAP_info.config["report_sheets_copy"])
+        # Add sheet named 'Base datos'
+        base_sheet = wb.sheets.add(after=wb.sheets[-1])
+        base_sheet.name = "Base datos"
+        ws_ini.range("1:1").copy(base_sheet.range("1:1"))
+        merge_sheets(wb, base_sheet, manager_sheets)
+        # Returned per-manager files go after the manager sheets, so their comments win
+        if returned_rows:
+            base_sheet.range(f"A{last_row_of(base_sheet, 'A') + 1}").value = returned_rows
+        _store_returned_comments(base_sheet.used_range.options(ndim=2).value[1:], report_date)
+        _compare_and_copy(ws_ini, base_sheet, wb)
     last_row = ws_ini.range("J" + str(ws_ini.cells.last_cell.row)).end("up").row
     ws_ini.range(f"{last_row}:{last_row}").delete()
     last_row = ws_ini.range("J" + str(ws_ini.cells.last_cell.row)).end("up").row
@@ -209,7 +474,14 @@ def large_format_retailers_file():
             if not save_path.endswith(".xlsx"):
                 save_path += ".xlsx"
             wb.save(save_path)
+            _store_report(wb, reference_sheets, manager_sheets)
             show_info("Fin",f"Archivo guardado en '{save_path}'")
+            ask = show_question("Ficheros por gestor", "¿Generar también un fichero independiente por gestor?")
+            if ask == YES:
+                folder = ask_folder("Carpeta para los ficheros por gestor")
+                if folder:
+                    written = _write_manager_files(wb, ws_ini, folder, new_name)
+                    show_info("Fin", f"Se han generado {len(written)} ficheros en '{folder}'")
     wb.close()
     os.remove(full_path)
 
@@ -334,71 +606,64 @@ def download_files_balance_report():
             session.findById(f"wnd[0]/usr/chk[1,{job_row}]").Selected = False  # Deselect Job
         except Exception as e:
             show_warning("Error",f"[ERROR] in row {job_row}: {e}")
+            Load_SAP_info.ContinueProgram = False
     # Final status update
     show_info("Fin","Ya se han descargado los ficheros.")
 
 
-def create_balance_report():
+def create_balance_report(file_paths: list | None = None, output_path: str | None = None):
     """
     SAP Balance Report Step 3:  
     Generates formatted Excel report by combining monthly TXT exports into structured sheets.
+    The spool files are parsed line by line and streamed into a new xlsx, so no Excel instance is needed.
     
     Workflow:
-    - Prompts user to select TXT files (one per month + annual)
-    - Creates Excel workbook with named sheets per month
-    - For each file:
-      - Opens TXT as Excel
-      - Filters column C to remove non-matching rows
-      - Deletes visible filtered rows
-      - Copies cleaned sheet to main workbook
-    - Deletes initial blank sheet
-    - Displays completion message and allows user to save
+    - Prompts user to select TXT files (one per month + annual) unless given
+    - Prompts user for the destination xlsx unless given
+    - Parses the files in parallel worker processes, reusing the columnar cache for files
+      already parsed in earlier runs (see `SpoolReader.load_spool_months`)
+    - For each file (see `SpoolReader.iter_spool_rows`):
+      - Detects the header from row 9 and the column layout (tab, pipe or fixed width)
+      - Drops rows with blank column C (subtotals, page titles and totals)
+      - Decodes SAP amounts and dates
+      - Streams the cleaned rows into its named sheet
+    - Displays completion message with the saved path
     
     Parameters:
-    - None (file selection handled via GUI prompt)
+    - file_paths (list[str], optional): Spool TXT files, annual first then January to December
+    - output_path (str, optional): Destination xlsx path
     
     Returns:
-    - None: process concludes with open Excel file ready for saving
+    - None: process concludes with the report saved to disk
     """
+    report_detail = Load_SAP_info.config["balance_report_detail"]
     # Sheet names corresponding to periods
-    sheet_names = [
-        "ANUAL", "ENERO", "FEBRERO", "MARZO", "ABRIL", "MAYO",
-        "JUNIO", "JULIO", "AGOSTO", "SEPTIEMBRE", "OCTUBRE", "NOVIEMBRE", "DICIEMBRE"
-    ]
+    sheet_names = report_detail["sheet_names"]
     # Prompt user to select downloaded TXT files
-    file_paths = ask_open_files("Selecciona todos los TXT descargados.")
+    if not file_paths:
+        file_paths = ask_open_files("Selecciona todos los TXT descargados.")
     if not file_paths:
         show_warning("Error","No se seleccionaron archivos o el proceso fue cancelado.")
+        Load_SAP_info.ContinueProgram = False
+        return
+    if len(file_paths) > len(sheet_names):
+        show_warning("Error",f"Se esperaban como máximo {len(sheet_names)} ficheros y se seleccionaron {len(file_paths)}.")
+        Load_SAP_info.ContinueProgram = False
+        return
+    # Prompt user for the destination workbook
+    if not output_path:
+        output_path = ask_save_file("Guardar Informe de Saldos", "Informe de Saldos.xlsx")
+    if not output_path:
+        return
+    try:
+        cache_dir = os.path.join(Load_SAP_info.config["local_data_path"], "spool_cache")
+        build_balance_report(file_paths, output_path, sheet_names, report_detail, cache_dir)
+    except Exception as e:
+        show_warning("Error",f"Error generando el informe: {e}")
+        Load_SAP_info.ContinueProgram = False
         return
-    # Create new Excel workbook
-    app = xw.App(visible=True)
-    wb = app.books.add()
-    for i, path in enumerate(file_paths):
-        try:
-            temp_wb = app.books.open(path)
-            temp_ws = temp_wb.sheets[0]
-            # Identify range and apply filter
-            last_row = temp_ws.range("O" + str(temp_ws.cells.last_cell.row)).end("up").row
-            data_range = temp_ws.range(f"A9:P{last_row}")
-            data_range.api.AutoFilter(Field=3, Criteria1="=")
-            # Delete filtered visible rows
-            try:
-                visible_rows = data_range.offset(1, 0).special_cells(xw.constants.CellType.visible)
-                visible_rows.api.EntireRow.Delete()
-            except:
-                pass  # No rows to delete
-            # Disable filter and copy sheet to main workbook
-            temp_ws.api.AutoFilterMode = False
-            temp_ws.copy(after=wb.sheets[-1])
-            wb.sheets[-1].name = sheet_names[i]
-            temp_wb.close(False)
-        except Exception as e:
-            show_warning("Error",f"Error procesando {path}: {e}")
-    # Delete default blank sheet
-    if len(wb.sheets) > len(file_paths):
-        wb.sheets[0].delete()
     # Final notification
-    show_info("Fin","✅ Informe Generado. Guarde el fichero como quiera.")
+    show_info("Fin",f"✅ Informe Generado en '{output_path}'.")
 
 def zaging_1():
     """
@@ -514,10 +779,12 @@ def zaging_2():
     path_zaging = ask_open_file("Abre el fichero del Zaging")
     if not path_zaging:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     path_sgl = ask_open_file("Abre el fichero de Partidas CME")
     if not path_sgl:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     # Open workbooks
     wb_zaging = check_wb_open(path_zaging)
@@ -574,24 +841,28 @@ def zaging_3():
     file_zaging = ask_open_file("Abre el fichero del Zaging")
     if not file_zaging:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     
     # Ask user to select Open Items file
     file_pa = ask_open_file("Abre el fichero de Partidas Abiertas")
     if not file_pa:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     
     # Ask user to select Cleared Items file
     file_pc = ask_open_file("Abre el fichero de Partidas Compensadas")
     if not file_pc:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
 
     # Ask user to select Modifications file
     file_modi = ask_open_file("Abre el fichero de Modificaciones")
     if not file_modi:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
 
     # Open the selected Excel files as workbooks
@@ -712,7 +983,7 @@ def zaging_3():
 
             dif = abs(ws_zaging.cells(i, 19).value)
             if dif > 1:
-                show_warning("Fallo", f"El zaging ha fallado en la fila {i}")
+                log_event(ERROR, "El zaging ha fallado", row=i)
                 ws_zaging.range(f"{i}:{i}").color = (255, 0, 0)
 
     # Final confirmation and save
@@ -722,18 +993,22 @@ def zaging_3():
     file_zaging = ask_open_file("Abre el fichero del Zaging")
     if not file_zaging:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     file_pa = ask_open_file("Abre el fichero de Partidas Abiertas")
     if not file_pa:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     file_pc = ask_open_file("Abre el fichero de Partidas Compensadas")
     if not file_pc:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     file_modi = ask_open_file("Abre el fichero de Modificaciones")
     if not file_modi:
         show_warning("Error","No se ha seleccionado el archivo. Se cancela el proceso")
+        Load_SAP_info.ContinueProgram = False
         return
     # Open workbooks
     wb_zaging = check_wb_open(file_zaging)
@@ -854,7 +1129,7 @@ def zaging_3():
                     ws_zaging.cells(i,j+10).color=(255,255,0)
             dif = abs(ws_zaging.cells(i,19).value)
             if dif > 1:
-                show_warning("Fallo", f"El zaging a fallado en el la fila {i}")
+                log_event(ERROR, "El zaging ha fallado", row=i)
                 ws_zaging.range(f"{i}:{i}").color = (255,0,0)
     # Wrap-up
     show_info("Fin","Zaging generado")
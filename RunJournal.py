@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+import Load_SAP_info
+
+# -----------------------------------
+# Posting run journal (append-only)
+# -----------------------------------
+INTENT = "intent"
+POSTED = "posted"
+SPOOL = "spool"
+FAILED = "failed"
+
+def journal_path(workflow: str) -> str:
+    """
+    Returns the path of a workflow's journal inside the configured local data folder.
+
+    Parameters:
+    - workflow (str): Workflow key (e.g. 'daily_payments')
+
+    Returns:
+    - str: Full path to 'journal/<workflow>.jsonl'
+    """
+    return os.path.join(Load_SAP_info.config["local_data_path"], "journal", f"{workflow}.jsonl")
+
+def row_fingerprints(keys) -> list:
+    """
+    Builds one fingerprint per row from the values that identify it (date, description, amount…).
+    Identical rows are told apart by their occurrence number in file order.
+
+    Parameters:
+    - keys (iterable[tuple]): Identifying values per row
+
+    Returns:
+    - list[str]: Hex fingerprint per row, aligned with `keys`
+    """
+    seen = {}
+    fingerprints = []
+    for key in keys:
+        text = "|".join(str(value).strip() if value is not None else "" for value in key)
+        seen[text] = seen.get(text, 0) + 1
+        fingerprints.append(hashlib.sha1(f"{text}#{seen[text]}".encode("utf-8")).hexdigest())
+    return fingerprints
+
+def plan_hash(plan: dict) -> str:
+    """
+    Hashes a posting plan (action, client, amounts, decisions…) so a resumed run can tell
+    whether an interrupted row is about to be posted the same way.
+
+    Parameters:
+    - plan (dict): Values that decide how the row is posted
+
+    Returns:
+    - str: Short hex hash
+    """
+    text = json.dumps(plan, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+class RunJournal:
+    """
+    Append-only JSON Lines journal of the postings of one workflow.
+
+    Every record is flushed and fsynced before the workflow goes on, so after a crash the
+    journal knows, per row fingerprint, what was about to be posted (intent + plan hash),
+    which entry number SAP gave it (posted), whether its spool was saved and why it failed.
+
+    Record keys:
+    - ts (str): ISO timestamp
+    - kind (str): INTENT, POSTED, SPOOL or FAILED
+    - fingerprint (str): Row fingerprint
+    - plus the kind's data (row, plan, entry_num, saved, reason…)
+    """
+    def __init__(self, workflow: str):
+        self.path = journal_path(workflow)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.rows = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut by the crash itself is ignored
+                        continue
+                    self._apply(record)
+
+    def _apply(self, record: dict):
+        state = self.rows.setdefault(record["fingerprint"], {})
+        kind = record["kind"]
+        if kind == INTENT:
+            state.update(status=INTENT, plan=record.get("plan"), row=record.get("row"))
+        elif kind == POSTED:
+            state.update(status=POSTED, entry_num=record.get("entry_num"))
+        elif kind == SPOOL:
+            state["spool"] = record.get("saved", False)
+        elif kind == FAILED and state.get("status") != POSTED:
+            state.update(status=FAILED, reason=record.get("reason"))
+
+    def record(self, kind: str, fingerprint: str, **data):
+        """
+        Appends one record and forces it to disk before returning.
+
+        Parameters:
+        - kind (str): INTENT, POSTED, SPOOL or FAILED
+        - fingerprint (str): Row fingerprint
+        - **data: Record data (row, plan, entry_num, saved, reason…)
+
+        Returns:
+        - None
+        """
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "kind": kind, "fingerprint": fingerprint, **data}
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self._apply(record)
+
+    def entry_number(self, fingerprint: str):
+        """
+        Returns the SAP entry number already posted for a row, if any (idempotency check).
+
+        Parameters:
+        - fingerprint (str): Row fingerprint
+
+        Returns:
+        - str or None: Entry number, or None if the row was never posted
+        """
+        state = self.rows.get(fingerprint, {})
+        return state.get("entry_num") if state.get("status") == POSTED else None
+
+    def interrupted(self, fingerprint: str) -> bool:
+        """
+        Tells whether a row was left between its intent and its result (the run stopped while posting it).
+
+        Parameters:
+        - fingerprint (str): Row fingerprint
+
+        Returns:
+        - bool: True if the last record of the row is its intent
+        """
+        return self.rows.get(fingerprint, {}).get("status") == INTENT
+
+    def spool_pending(self, fingerprint: str) -> bool:
+        """
+        Tells whether a posted row still lacks its saved spool.
+
+        Parameters:
+        - fingerprint (str): Row fingerprint
+
+        Returns:
+        - bool: True if the row is posted and its spool was not saved
+        """
+        state = self.rows.get(fingerprint, {})
+        return state.get("status") == POSTED and not state.get("spool", False)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import queue
+from datetime import datetime
+
+# -----------------------------------
+# Run log (thread-safe, non-blocking)
+# -----------------------------------
+INFO = "INFO"
+WARNING = "WARNING"
+ERROR = "ERROR"
+SEVERITIES = [INFO, WARNING, ERROR]
+
+_events = queue.Queue()
+_workflow = ""
+_listener = None
+
+def set_workflow(name: str):
+    """
+    Sets the workflow name attached to the events logged from now on (e.g. 'Pagos Diarios').
+
+    Parameters:
+    - name (str): Workflow name
+
+    Returns:
+    - None
+    """
+    global _workflow
+    _workflow = name
+
+def set_listener(callback):
+    """
+    Sets a function called after every logged event, e.g. the log panel showing events as soon
+    as they are logged while a workflow keeps the GUI thread busy (None removes it).
+
+    Parameters:
+    - callback (callable or None): Function without arguments
+
+    Returns:
+    - None
+    """
+    global _listener
+    _listener = callback
+
+def log_event(severity: str, message: str, row: int | None = None, workflow: str | None = None):
+    """
+    Queues a run log event for the log panel and echoes it to the console.
+    Safe to call from any thread; never blocks the workflow waiting for a click.
+
+    Parameters:
+    - severity (str): INFO, WARNING or ERROR
+    - message (str): Event text
+    - row (int, optional): Excel row the event refers to
+    - workflow (str, optional): Workflow name (defaults to the one set with `set_workflow`)
+
+    Returns:
+    - None: event is queued
+    """
+    event = (datetime.now(), severity, workflow or _workflow, row, message)
+    _events.put(event)
+    where = f" fila {row}" if row is not None else ""
+    print(f"[{severity}]{where} {message}")
+    if _listener is not None:
+        try:
+            _listener()
+        except Exception as e:
+            print(f"[WARNING] No se pudo refrescar el registro: {e}")
+
+def drain(max_events: int = 500) -> list:
+    """
+    Takes the queued events (up to `max_events`) for display.
+
+    Parameters:
+    - max_events (int, optional): Maximum number of events returned
+
+    Returns:
+    - list[tuple]: (timestamp, severity, workflow, row, message)
+    """
+    events = []
+    while len(events) < max_events:
+        try:
+            events.append(_events.get_nowait())
+        except queue.Empty:
+            break
+    return events
@@ -3,13 +3,13 @@
 @author: JesusMMA
 """
 
-import win32com.client
 import gc
-import pythoncom
-from PyQt5.QtWidgets import QMessageBox
 from UserInputs import (ask_user_date,ask_user_string,
-                        show_question,show_info,show_warning,dif_popup
+                        show_question,show_info,show_warning,dif_popup,
+                        YES,NO,OK,CANCEL
                         )                 
+from RunLog import log_event, WARNING, ERROR
+from DifferencePolicy import auto_difference
 import Load_SAP_info
 from datetime import datetime
 
@@ -59,6 +59,8 @@ class SAPSessionManager:
             return cls.session
 
         try:
+            # win32com is only loaded when SAP is actually needed (headless report runs never touch it)
+            import win32com.client
             cls.SapGuiAuto = win32com.client.GetObject("SAPGUI")
             cls.application = cls.SapGuiAuto.GetScriptingEngine
             cls.connection = cls.application.Children(0)
@@ -84,6 +86,7 @@ class SAPSessionManager:
                 setattr(cls, attr, None)
 
             gc.collect()
+            import pythoncom
             pythoncom.CoUninitialize()
             print("[INFO] SAP session disconnected.")
         except Exception as e:
@@ -150,7 +153,7 @@ def chk_window():
 def chk_status_bar():
     """
     Reads the SAP status bar message and returns it.
-    Displays warning if the message is classified as an error.
+    Logs an error in the run log if the message is classified as an error.
 
     Parameters:
     - None (uses active session and SAP GUI commands internally)
@@ -166,7 +169,7 @@ def chk_status_bar():
         msg = session.findById("wnd[0]/sbar").Text
         msg_type = session.findById("wnd[0]/sbar").MessageType
         if msg_type =="E":
-            show_warning("Error", msg)
+            log_event(ERROR, msg)
         return msg
     except Exception:
         return ""
@@ -202,16 +205,21 @@ def run_background_job():
     session.findById("wnd[1]/tbar[0]/btn[11]").press()
     
     
-def call_transaction(txn_code:str):
+# Initial screen (program, screen number) of each transaction, recorded when it is entered
+_INITIAL_SCREENS = {}
+
+def call_transaction(txn_code:str, reuse:bool=False) -> bool:
     """
     Executes a given SAP transaction code from the Easy Access screen.
     Automatically resets to main menu if necessary.
 
     Parameters:
     - txn_code (str): SAP transaction code to execute (e.g. 'FB03', 'F-04')
+    - reuse (bool, optional): Stays in the transaction when the session is already back on its
+      initial screen (e.g. F-04 after saving the previous entry) instead of re-entering it
 
     Returns:
-    - None: launches specified transaction
+    - bool: True if the initial screen was reused, False if the transaction was launched
     """
     session = SAPSessionManager.session
     if session == None:
@@ -219,6 +227,10 @@ def call_transaction(txn_code:str):
         session = SAPSessionManager.session
         
     try:
+        if reuse and session.Info.Transaction == txn_code \
+                and _INITIAL_SCREENS.get(txn_code) == (session.Info.Program, session.Info.ScreenNumber):
+            return True
+
         current_title = chk_window()
         if current_title is None:
             raise RuntimeError("Unable to determine current SAP window.")
@@ -230,10 +242,12 @@ def call_transaction(txn_code:str):
 
         session.findById("wnd[0]/tbar[0]/okcd").Text = txn_code
         session.findById("wnd[0]").sendVKey(0)
+        _INITIAL_SCREENS[txn_code] = (session.Info.Program, session.Info.ScreenNumber)
 
     except Exception as e:
         print(f"[ERROR] Failed to execute transaction '{txn_code}': {e}")
         Load_SAP_info.ContinueProgram = False
+    return False
 
 def back_to_main():
     """
@@ -386,15 +400,10 @@ def batch_input(batch_template_path:str):
         sbar = chk_status_bar()
         if sbar == "Por favor, seleccione primero las partidas.":
             try:
-                from PyQt5.QtWidgets import QMessageBox
-                msg = QMessageBox()
-                msg.setWindowTitle("Confirmación")
-                msg.setText("No se han seleccionado PAs.\n¿Es un pago sin PA?")
-                msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                result = msg.exec_()
-
-                if result == QMessageBox.No:
-                    QMessageBox.information(None, "Cancelación", "Se cancela el proceso.")
+                result = show_question("Confirmación", "No se han seleccionado PAs.\n¿Es un pago sin PA?")
+
+                if result != YES:
+                    show_info("Cancelación", "Se cancela el proceso.")
                     back_to_main()
                     if Load_SAP_info.ContinueProgram == False: return
                     Load_SAP_info.ContinueProgram = False
@@ -570,7 +579,7 @@ def new_entry(Posting_key:str, account:str, SGL_Ind:str="", doc_date:str=""):
 
         # Validate SGL indicator if required
         if Posting_key in {"09", "19"} and not SGL_Ind:
-            QMessageBox.warning(None, "Advertencia", "Clave CME no introducida.")
+            show_warning("Advertencia", "Clave CME no introducida.")
             back_to_main()
             if Load_SAP_info.ContinueProgram == False: return
             Load_SAP_info.ContinueProgram = False
@@ -668,14 +677,16 @@ def new_entry_add_data(amount: float,due_date: str,commentary: str = "",
         # Ensure commentary is provided
         while not commentary:
             commentary = ask_user_string("Comentario para el apunte")
+            if Load_SAP_info.ContinueProgram == False: return
         session.findById(fields["commentary"]).Text = commentary
 
         # Handle payment method input and validation
         if not payment_method:
-            answer = show_question("Confirmación de Vía de Pago", "¿El apunte tiene vía de pago?", QMessageBox.Yes | QMessageBox.No)
-            if answer == QMessageBox.Yes:
+            answer = show_question("Confirmación de Vía de Pago", "¿El apunte tiene vía de pago?", YES | NO)
+            if answer == YES:
                 while not payment_method:
                     payment_method = ask_user_string("Introduce la vía de pago (2, 3, R, T)")
+                    if Load_SAP_info.ContinueProgram == False: return
                     if payment_method not in {"2", "3", "R", "T"}:
                         show_warning("No válida", "Por favor introduce una vía de pago válida: 2, 3, R o T")
                         payment_method = ""
@@ -802,6 +813,46 @@ def enter_ajd(amount: float, assignment: str, commentary: str, due_date: str):
         Load_SAP_info.ContinueProgram = False
         
 
+def _selection_rows(session, tab_code: str, field: str, col: int) -> int:
+    # Number of selection rows visible at once on the screen (probed once per call)
+    rows = 0
+    while rows < 100:
+        try:
+            session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field}[{rows},{col}]")
+        except Exception:
+            break
+        rows += 1
+    return max(rows, 1)
+
+def _fill_selection_rows(session, tab_code: str, from_field: tuple, to_field: tuple, values):
+    """
+    Fills the multiple-selection rows of an open item search, one value (or from/to pair) per row.
+    When there are more values than visible rows, the screen is scrolled one page at a time and
+    the visible rows are filled again (scrolling keeps the rows already entered).
+
+    Parameters:
+    - session: Active SAP session
+    - tab_code (str): Selection subscreen (e.g. '0731' for references)
+    - from_field (tuple): (field name, column) of the 'from' value
+    - to_field (tuple): (field name, column) of the 'to' value
+    - values (list): Values or (from, to) pairs
+
+    Returns:
+    - None: selection screen is filled
+    """
+    field1, col1 = from_field
+    field2, col2 = to_field
+    page = _selection_rows(session, tab_code, field1, col1)
+    for start in range(0, len(values), page):
+        if start:
+            session.findById("wnd[0]/usr").verticalScrollbar.position = start
+        for offset, value in enumerate(values[start:start + page]):
+            low, high = value if isinstance(value, (list, tuple)) else (value, "")
+            session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field1}[{offset},{col1}]").Text = low
+            if high:
+                session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field2}[{offset},{col2}]").Text = high
+    session.findById("wnd[0]").sendVKey(0)
+
 def search_items(category: str, position: int, search_data: str = "",
                  company_code: str = "", account: str = "", additional_data: str = ""):
     """
@@ -818,6 +869,8 @@ def search_items(category: str, position: int, search_data: str = "",
         - Pos 5: Filter by reference
         - Pos 16: Filter by net due date
     - Applies search data and additional filters where applicable
+    - A list of values (or from/to pairs) fills one multiple-selection row each, paging through
+      the selection screen, so one pass selects every target item
     - Handles user cancellation and missing views
     - Selects all matching open items for processing
 
@@ -843,7 +896,8 @@ def search_items(category: str, position: int, search_data: str = "",
     Parameters:
     - category (str): SAP account category ('D' for customer, 'K' for vendor)
     - position (int): Selection mode for filtering open items
-    - search_data (str, optional): Primary search value (e.g. amount, reference)
+    - search_data (str | list, optional): Primary search value (e.g. amount, reference), or a list of
+      values / (from, to) pairs for positions 1, 5 and 16
     - company_code (str, optional): SAP company code to restrict search
     - account (str, optional): SAP account number
     - additional_data (str, optional): Secondary search value (e.g. end date for range)
@@ -867,9 +921,9 @@ def search_items(category: str, position: int, search_data: str = "",
             response = show_question(
                 "Confirmación",
                 "No estás en la ventana apropiada.\nVe a Visualizar Resumen y presiona OK.",
-                QMessageBox.Ok | QMessageBox.Cancel
+                OK | CANCEL
             )
-            if response == QMessageBox.Cancel:
+            if response == CANCEL:
                 back_to_main()
                 if Load_SAP_info.ContinueProgram == False: return
                 Load_SAP_info.ContinueProgram = False
@@ -885,26 +939,30 @@ def search_items(category: str, position: int, search_data: str = "",
         if account:
             session.findById("wnd[0]/usr/ctxtRF05A-AGKON").Text = account
     
-        # Field mapping for supported positions
+        # Field mapping for supported positions: (screen, from field, from column, to field, to column)
         field_map = {
-            1: ("0730", "txtRF05A-VONWT[0,0]", "txtRF05A-BISWT[0,21]"),
-            16: ("0732", "ctxtRF05A-VONDT[0,0]", "ctxtRF05A-BISDT[0,20]"),
-            5: ("0731", "txtRF05A-SEL01[0,0]", "txtRF05A-SEL02[0,31]"),
+            1: ("0730", "txtRF05A-VONWT", 0, "txtRF05A-BISWT", 21),
+            16: ("0732", "ctxtRF05A-VONDT", 0, "ctxtRF05A-BISDT", 20),
+            5: ("0731", "txtRF05A-SEL01", 0, "txtRF05A-SEL02", 31),
         }
     
         if position == 0:
             session.findById("wnd[0]").sendVKey(0)  # Select all open items
         elif position in field_map:
-            tab_code, field1, field2 = field_map[position]
+            tab_code, field1, col1, field2, col2 = field_map[position]
             session.findById(f"wnd[0]/usr/sub:SAPMF05A:0710/radRF05A-XPOS1[{position},0]").Select()
             session.findById("wnd[0]").sendVKey(0)
     
-            if search_data:
-                session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field1}").Text = search_data
-                session.findById("wnd[0]").sendVKey(0)
-            if additional_data:
-                session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field2}").Text = additional_data
-                session.findById("wnd[0]").sendVKey(0)
+            if isinstance(search_data, (list, tuple)):
+                # One selection row per value (or from/to pair), all processed in a single pass
+                _fill_selection_rows(session, tab_code, (field1, col1), (field2, col2), search_data)
+            else:
+                if search_data:
+                    session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field1}[0,{col1}]").Text = search_data
+                    session.findById("wnd[0]").sendVKey(0)
+                if additional_data:
+                    session.findById(f"wnd[0]/usr/sub:SAPMF05A:{tab_code}/{field2}[0,{col2}]").Text = additional_data
+                    session.findById("wnd[0]").sendVKey(0)
     
             session.findById("wnd[0]/tbar[1]/btn[16]").press()
         else:
@@ -917,12 +975,12 @@ def search_items(category: str, position: int, search_data: str = "",
         # Check for no results
         msg = chk_status_bar()
         if "No se encontró" in msg:
-            show_info("Aviso", msg)
+            log_event(WARNING, msg)
     
         # Validate transition to open items screen
         if "Procesar partidas abiertas" not in chk_window():
             if Load_SAP_info.ContinueProgram == False: return
-            show_warning("Error", "No se han encontrado Partidas Abiertas")
+            log_event(ERROR, "No se han encontrado Partidas Abiertas")
             back_to_main()
             if Load_SAP_info.ContinueProgram == False: return
             Load_SAP_info.ContinueProgram = False
@@ -974,13 +1032,36 @@ def get_entry_number() -> str:
         Load_SAP_info.ContinueProgram = False
         return ""
 
-def save_entry(path: str):
+def posted_entry_number() -> str:
+    """
+    Reads the document number from the status bar message SAP shows right after saving an entry
+    ('Documento ... contabilizado', message F5 312), so the session stays in the posting transaction.
+
+    Parameters:
+    - None (uses active session and SAP GUI commands internally)
+
+    Returns:
+    - str: Document number, or "" if the status bar does not show the posting message
+    """
+    session=SAPSessionManager.session
+    if session == None:
+        SAPSessionManager.connect()
+        session = SAPSessionManager.session
+    try:
+        sbar = session.findById("wnd[0]/sbar")
+        if sbar.MessageId.strip() == "F5" and sbar.MessageNumber == "312":
+            return sbar.MessageParameter(0)
+    except Exception:
+        pass
+    return ""
+
+def save_entry(path: str, entry_number: str = ""):
     """
     Saves the PDF spool of the current SAP accounting entry to a specified file path.
     Navigates through SAP GUI to extract and store the spool document using entry metadata.
 
     Workflow:
-    - Retrieves entry number from the active session
+    - Retrieves entry number from the active session, or opens the given one in FB03
     - Clears status bar messages and resets SAP view
     - Navigates to spool print menu and disables print preview
     - Launches transaction SP01 to access spool
@@ -990,6 +1071,7 @@ def save_entry(path: str):
 
     Parameters:
     - path (str): Destination folder path where the PDF file will be saved
+    - entry_number (str, optional): Entry to print (e.g. saved earlier in the run); defaults to the last one posted
 
     Returns:
     - None: saves file directly to disk and resets SAP interface
@@ -999,8 +1081,12 @@ def save_entry(path: str):
         SAPSessionManager.connect()
         session = SAPSessionManager.session
     try:
-        entry_number = get_entry_number()
+        current_entry = get_entry_number()
         if Load_SAP_info.ContinueProgram == False: return
+        if entry_number:
+            session.findById("wnd[0]/usr/txtRF05L-BELNR").Text = entry_number
+        else:
+            entry_number = current_entry
         if not entry_number:
             raise ValueError("No se pudo obtener el número de documento.")
 
@@ -1199,11 +1285,13 @@ def round_dif(dif_sap: float, due_date:str, commentary:str="",due_date_assigment
 # Handler
 def handle_dif(diff_sap:float, account:str, due_date:str, commentary:str="",due_date_assigment:str=""):
     """
-    Handles SAP posting differences during simulation by prompting the user for correction strategy.
-    Applies rounding adjustments or redirects difference to specified account, based on user selection.
+    Handles SAP posting differences during simulation, by the configured difference policy or by
+    prompting the user for correction strategy.
+    Applies rounding adjustments or redirects difference to specified account, based on that choice.
     
     Workflow:
-    - Displays popup with options for resolving the posting discrepancy
+    - Applies 'difference_policy' first (small differences are resolved without UI and logged)
+    - Otherwise displays popup with options for resolving the posting discrepancy
     - If user selects 'round_dif', applies correction via `round_dif()` handler
     - If user selects 'to_account', redirects difference to the designated account via `to_account_dif()`
     - Navigates to accounting summary view before each correction
@@ -1224,8 +1312,8 @@ def handle_dif(diff_sap:float, account:str, due_date:str, commentary:str="",due_
         SAPSessionManager.connect()
         session = SAPSessionManager.session
     try:
-        # Prompt user for correction strategy
-        response = dif_popup(diff_sap)
+        # Resolve by policy, or prompt user for correction strategy
+        response = auto_difference(diff_sap, account) or dif_popup(diff_sap)
 
         if response == "round_dif":
             session.findById("wnd[0]/tbar[1]/btn[14]").press()  # Proceed to accounting summary
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import re
+import os
+import hashlib
+import pickle
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+# -----------------------------------
+# SAP value decoding
+# -----------------------------------
+_DATE_RE = re.compile(r"^(\d{2})[./](\d{2})[./](\d{4})$")
+_SEPARATOR_CHARS = set("-|+= \t")
+_TOKEN_RE = re.compile(r"\S+(?: \S+)*")
+
+def decode_number(text: str, decimal_sep: str = ","):
+    """
+    Converts an SAP list amount (e.g. '1.234,56-' or '-1.234,56') into a float.
+    Only values carrying the decimal separator are treated as amounts, so document
+    numbers, client codes and years keep their leading zeros as text.
+
+    Parameters:
+    - text (str): Raw cell text from the spool
+    - decimal_sep (str, optional): Decimal separator used by the SAP user profile
+
+    Returns:
+    - float or None: Decoded amount, or None if the text is not an amount
+    """
+    value = text.strip()
+    if not value or decimal_sep not in value:
+        return None
+    negative = value.endswith("-") or value.startswith("-")
+    value = value.strip("-").strip()
+    thousands_sep = "." if decimal_sep == "," else ","
+    value = value.replace(thousands_sep, "").replace(decimal_sep, ".")
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+def decode_date(text: str):
+    """
+    Converts an SAP list date ('dd.mm.yyyy' or 'dd/mm/yyyy') into a date.
+
+    Parameters:
+    - text (str): Raw cell text from the spool
+
+    Returns:
+    - date or None: Decoded date, or None if the text is not a date
+    """
+    match = _DATE_RE.match(text.strip())
+    if not match:
+        return None
+    day, month, year = (int(part) for part in match.groups())
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def decode_cell(text: str, decimal_sep: str = ","):
+    """
+    Decodes a single spool cell into date, float or stripped text, in that order.
+
+    Parameters:
+    - text (str): Raw cell text
+    - decimal_sep (str, optional): Decimal separator used by the SAP user profile
+
+    Returns:
+    - date, float, str or None: Typed cell value (None for blank cells)
+    """
+    value = text.strip()
+    if not value:
+        return None
+    decoded = decode_date(value)
+    if decoded is not None:
+        return decoded
+    decoded = decode_number(value, decimal_sep)
+    if decoded is not None:
+        return decoded
+    return value
+
+# -----------------------------------
+# Line layouts
+# -----------------------------------
+def _is_separator(line: str) -> bool:
+    # Ruler lines such as '|-----|' or '=====' carry no data
+    stripped = line.strip()
+    return not stripped or set(stripped) <= _SEPARATOR_CHARS
+
+def _detect_layout(header_line: str):
+    """
+    Determines how the spool columns are laid out from its header line.
+
+    Workflow:
+    - Tab characters → 'tab' delimited export
+    - Two or more pipes → 'pipe' list output ('| a | b |')
+    - Otherwise → 'fixed' width, keeping the (start, end) span of every header label
+      (labels are separated by runs of at least two blanks)
+
+    Parameters:
+    - header_line (str): Raw header line of the spool
+
+    Returns:
+    - tuple: (layout name, list of label spans for fixed width or None)
+    """
+    if "\t" in header_line:
+        return "tab", None
+    if header_line.count("|") >= 2:
+        return "pipe", None
+    spans = [m.span() for m in _TOKEN_RE.finditer(header_line.rstrip())]
+    return "fixed", spans
+
+def _cut_position(line: str, previous_span: tuple, next_span: tuple) -> int:
+    """
+    Returns where a fixed-width line is cut between two neighbouring header labels.
+    The cut sits at the midpoint of the gap between the labels. When a value runs over the
+    midpoint (codes longer than their label, right-aligned amounts starting before theirs),
+    the cut moves to the edge of that value, which goes to the label it overlaps most.
+
+    Parameters:
+    - line (str): Raw spool line
+    - previous_span (tuple): (start, end) of the label on the left
+    - next_span (tuple): (start, end) of the label on the right
+
+    Returns:
+    - int: Position of the first character of the right-hand column
+    """
+    middle = (previous_span[1] + next_span[0]) // 2
+    if middle >= len(line) or line[middle - 1].isspace() or line[middle].isspace():
+        return middle
+    start = middle
+    while start > 0 and not line[start - 1].isspace():
+        start -= 1
+    end = middle
+    while end < len(line) and not line[end].isspace():
+        end += 1
+    overlap_previous = min(end, previous_span[1]) - max(start, previous_span[0])
+    overlap_next = min(end, next_span[1]) - max(start, next_span[0])
+    return start if overlap_next > overlap_previous else end
+
+def _split_fixed(line: str, spans: list) -> list:
+    """
+    Splits a fixed-width line into one cell per header label, cutting between labels
+    (see `_cut_position`). Values separated by a single blank stay in their own columns
+    and blank cells stay blank.
+
+    Example (fixed-width FBL5N spool, checked with `python -m doctest SpoolReader.py`):
+    >>> _, spans = _detect_layout("St  Cuenta     Asignacion  Nº doc.        Importe")
+    >>> _split_fixed("@5  0000123457 X           1800000013   1.234,56-", spans)
+    ['@5', '0000123457', 'X', '1800000013', '1.234,56-']
+    >>> _split_fixed("    0000123457 ABONO 03/26 1800000013  1.234.567,89", spans)
+    ['', '0000123457', 'ABONO 03/26', '1800000013', '1.234.567,89']
+
+    Parameters:
+    - line (str): Raw spool line without line break
+    - spans (list[tuple]): (start, end) of each header label
+
+    Returns:
+    - list[str]: One text cell per header label
+    """
+    cuts = [0]
+    for previous_span, next_span in zip(spans, spans[1:]):
+        cuts.append(max(cuts[-1], _cut_position(line, previous_span, next_span)))
+    cuts.append(max(len(line), cuts[-1]))
+    return [line[start:end].strip() for start, end in zip(cuts, cuts[1:])]
+
+def _split_line(line: str, layout: str, spans=None) -> list:
+    # Split a raw spool line into its text cells for the detected layout
+    line = line.rstrip("\r\n")
+    if layout == "tab":
+        return line.split("\t")
+    if layout == "pipe":
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            stripped = stripped[1:]
+        if stripped.endswith("|"):
+            stripped = stripped[:-1]
+        return stripped.split("|")
+    return _split_fixed(line, spans)
+
+# -----------------------------------
+# Streaming reader
+# -----------------------------------
+def iter_spool_rows(path: str, header_row: int = 9, filter_col: int = 3,
+                    encoding: str = "cp1252", decimal_sep: str = ","):
+    """
+    Streams an FBL5N list spool (SM37 TXT download) line by line in constant memory.
+    Replaces the Excel open → AutoFilter(column C = blank) → delete visible rows sequence.
+
+    Workflow:
+    - Skips the page banner until the header line (first non-ruler line from `header_row`)
+    - Detects the column layout (tab, pipe or fixed width) from the header
+    - Yields the header cells first, then each data row decoded into dates, floats and text
+    - Drops ruler lines, repeated page headers and rows whose `filter_col` cell is blank
+      (subtotals, page titles and totals)
+
+    Parameters:
+    - path (str): Path to the downloaded TXT spool
+    - header_row (int, optional): 1-based line where the header is expected (default 9)
+    - filter_col (int, optional): 1-based column that must be filled for a row to be kept (default 3 → C)
+    - encoding (str, optional): Text encoding of the SAP download
+    - decimal_sep (str, optional): Decimal separator used by the SAP user profile
+
+    Returns:
+    - Generator[list]: header list first, followed by one list per kept data row
+    """
+    with open(path, "r", encoding=encoding, errors="replace", newline="") as file:
+        header_key = None
+        layout, spans = None, None
+        for line_number, line in enumerate(file, start=1):
+            if line_number < header_row or _is_separator(line):
+                continue
+            if header_key is None:
+                layout, spans = _detect_layout(line)
+                header_key = line.strip()
+                yield [cell.strip() for cell in _split_line(line, layout, spans)]
+                continue
+            if line.strip() == header_key:
+                continue  # Header repeated on every spool page
+            cells = _split_line(line, layout, spans)
+            if len(cells) < filter_col or not cells[filter_col - 1].strip():
+                continue
+            yield [decode_cell(cell, decimal_sep) for cell in cells]
+
+# -----------------------------------
+# Columnar month cache
+# -----------------------------------
+# Bump when the parsed layout changes so old cache files are ignored
+_CACHE_VERSION = 2
+# Null markers inside the typed arrays
+_NULL_CENTS = -(2 ** 63)
+_NULL_DATE = 0
+
+def file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 of a file, read in 1 MB blocks.
+
+    Parameters:
+    - path (str): File to hash
+
+    Returns:
+    - str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _compact_column(values: list):
+    """
+    Packs one parsed column into the smallest typed container that holds it.
+
+    Workflow:
+    - All dates (or blanks) → 'date' array('l') of ordinals, 0 for blank
+    - All amounts (or blanks) → 'cents' array('q') of integer cents, min int64 for blank
+    - Anything else → 'text' list
+
+    Parameters:
+    - values (list): Decoded cells of one column
+
+    Returns:
+    - tuple: (kind, container)
+    """
+    filled = [value for value in values if value is not None]
+    if filled and all(isinstance(value, date) for value in filled):
+        return "date", array("l", (_NULL_DATE if value is None else value.toordinal() for value in values))
+    if filled and all(isinstance(value, float) for value in filled):
+        return "cents", array("q", (_NULL_CENTS if value is None else round(value * 100) for value in values))
+    return "text", values
+
+def parse_spool_columns(path: str, report_detail: dict) -> dict:
+    """
+    Parses one spool file into a compact columnar month (typed arrays, amounts as integer cents).
+    Top-level so it can run inside a worker process.
+
+    Parameters:
+    - path (str): Spool TXT path
+    - report_detail (dict): 'balance_report_detail' block from SAP_info.json
+
+    Returns:
+    - dict: {'header': list[str], 'rows': int, 'columns': list[(kind, container)]}
+    """
+    rows = iter_spool_rows(
+        path,
+        header_row=report_detail["header_row"],
+        filter_col=report_detail["filter_col"],
+        encoding=report_detail["encoding"],
+        decimal_sep=report_detail["decimal_sep"],
+    )
+    header = next(rows, [])
+    columns = [[] for _ in header]
+    count = 0
+    for values in rows:
+        # Pad/trim ragged lines to the header width
+        for index, column in enumerate(columns):
+            column.append(values[index] if index < len(values) else None)
+        count += 1
+    return {"header": header, "rows": count, "columns": [_compact_column(column) for column in columns]}
+
+def iter_columnar_rows(month: dict):
+    """
+    Rebuilds row lists from a columnar month (cents → float, ordinals → date).
+
+    Parameters:
+    - month (dict): Result of `parse_spool_columns`
+
+    Returns:
+    - Generator[list]: one list per data row
+    """
+    decoders = []
+    for kind, container in month["columns"]:
+        if kind == "cents":
+            decoders.append((container, lambda v: None if v == _NULL_CENTS else v / 100))
+        elif kind == "date":
+            decoders.append((container, lambda v: None if v == _NULL_DATE else date.fromordinal(v)))
+        else:
+            decoders.append((container, None))
+    for index in range(month["rows"]):
+        yield [decode(container[index]) if decode else container[index] for container, decode in decoders]
+
+def _cache_file(cache_dir: str, digest: str, report_detail: dict) -> str:
+    # Cache key: file content + parser settings that change the parsed result
+    settings = repr((_CACHE_VERSION, report_detail["header_row"], report_detail["filter_col"],
+                     report_detail["encoding"], report_detail["decimal_sep"]))
+    settings_key = hashlib.sha256(settings.encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{digest}_{settings_key}.pkl")
+
+def load_spool_months(file_paths: list, report_detail: dict, cache_dir: str,
+                      max_workers: int | None = None) -> list:
+    """
+    Returns the columnar month of every spool file, parsing only the files not already cached.
+
+    Workflow:
+    - Hashes every file and looks for its columnar month in `cache_dir`
+    - Fans the cache misses out over a process pool, one file per worker
+    - Stores each new month in the cache (atomic replace) for later rebuilds/comparisons
+    - Returns the months in the same order as `file_paths`
+
+    Parameters:
+    - file_paths (list[str]): Spool TXT paths
+    - report_detail (dict): 'balance_report_detail' block from SAP_info.json
+    - cache_dir (str): Folder holding the columnar cache
+    - max_workers (int, optional): Worker processes (defaults to one per CPU, capped by misses)
+
+    Returns:
+    - list[dict]: Columnar months, aligned with `file_paths`
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    months = [None] * len(file_paths)
+    misses = {}
+    for index, path in enumerate(file_paths):
+        cache_path = _cache_file(cache_dir, file_hash(path), report_detail)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as file:
+                    months[index] = pickle.load(file)
+                continue
+            except Exception as e:
+                print(f"[WARNING] Cache ilegible para {path}, se vuelve a leer: {e}")
+        misses[index] = cache_path
+    if misses:
+        workers = min(len(misses), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {index: pool.submit(parse_spool_columns, file_paths[index], report_detail)
+                           for index in misses}
+                for index, future in futures.items():
+                    months[index] = future.result()
+        else:
+            for index in misses:
+                months[index] = parse_spool_columns(file_paths[index], report_detail)
+        for index, cache_path in misses.items():
+            temp_path = f"{cache_path}.tmp"
+            with open(temp_path, "wb") as file:
+                pickle.dump(months[index], file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+    return months
+
+def build_balance_report(file_paths: list, output_path: str, sheet_names: list,
+                         report_detail: dict, cache_dir: str) -> dict:
+    """
+    Builds the annual balance workbook (ANUAL + ENERO–DICIEMBRE) straight from the spool files,
+    without Excel. Spools are parsed in parallel (or read from the columnar cache) and then
+    streamed into a constant-memory xlsx writer.
+
+    Workflow:
+    - Loads the columnar month of every file via `load_spool_months`
+    - Opens a streaming workbook at `output_path`
+    - Writes each month's header and rows to its sheet, in selection order
+    - Closes the workbook and returns the number of rows written per sheet
+
+    Parameters:
+    - file_paths (list[str]): Spool TXT paths, annual first then one per month
+    - output_path (str): Destination xlsx path
+    - sheet_names (list[str]): Sheet names assigned to the files in order
+    - report_detail (dict): 'balance_report_detail' block from SAP_info.json
+    - cache_dir (str): Folder holding the columnar month cache
+
+    Returns:
+    - dict: {sheet name: data rows written}
+    """
+    from HeadlessExcel import open_workbook, write_sheet
+    months = load_spool_months(file_paths, report_detail, cache_dir)
+    workbook, formats = open_workbook(output_path)
+    written = {}
+    try:
+        for month, sheet_name in zip(months, sheet_names):
+            written[sheet_name] = write_sheet(workbook, sheet_name, month["header"],
+                                              iter_columnar_rows(month), formats)
+    finally:
+        workbook.close()
+    return written
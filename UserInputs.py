@@ -3,22 +3,261 @@
 @author: JesusMMA
 """
 
-from DiffUI import Ui_Form
+import os
+import json
 import datetime
-import sys
+from abc import ABC, abstractmethod
 import Load_SAP_info
-from PyQt5.QtWidgets import (
-    QApplication, QMessageBox, QInputDialog, QFileDialog,
-    QDialog
-)
-from PyQt5.QtCore import QLocale
+from RunLog import log_event, INFO, WARNING, ERROR
+
+# -----------------------------------------------
+#  Answer codes
+# -----------------------------------------------
+# Same values as QMessageBox.StandardButton, so answers compare equal to QMessageBox.Yes, … without Qt
+OK = 0x00000400
+YES = 0x00004000
+NO = 0x00010000
+RETRY = 0x00080000
+CANCEL = 0x00400000
+_BUTTONS = {"ok": OK, "yes": YES, "no": NO, "retry": RETRY, "cancel": CANCEL}
+_BUTTON_NAMES = {code: name for name, code in _BUTTONS.items()}
+# Kinds that only inform (nothing to answer, never recorded)
+_NOTICES = {"info", "warning", "table"}
+
+# -----------------------------------------------
+#  Input providers
+# -----------------------------------------------
+class InputProvider(ABC):
+    """
+    Source of every answer a workflow asks for. The dialog helpers below never talk to Qt
+    directly: they call `ask` on the active provider, so the same workflow runs with an
+    operator (QtInputProvider, in QtInputs), from a decision file (ScriptedInputProvider) or
+    recording a live session for replay (RecordingInputProvider).
+    PyQt5 is only imported once a Qt provider is actually used.
+
+    Kinds and their raw answers (None = cancelled / no answer):
+    - info, warning, table: None (notices)
+    - question: button code (YES, NO, OK, CANCEL, RETRY)
+    - open_file, save_file, folder: path; open_files: list of paths
+    - date, text: typed text; number: float; choice: chosen item
+    - difference: 'round_dif' or 'to_account'
+    - row_decisions: {row number: decisions}; payment_queue: [(path, client name, total)]
+
+    Context keys: 'title', 'buttons', … as each kind needs, and 'explicit' for prompts that
+    must not be answered by a generic rule (see ScriptedInputProvider).
+    """
+    interactive = True
+
+    @abstractmethod
+    def ask(self, kind: str, prompt: str, **context):
+        """
+        Asks one prompt.
+
+        Parameters:
+        - kind (str): Kind of prompt (see above)
+        - prompt (str): Text shown to the operator (and matched by decision files)
+        - context: Kind-specific values
+
+        Returns:
+        - Raw answer of the kind, or None
+        """
+
+def _read_decision_file(path: str) -> dict:
+    # YAML is optional (PyYAML is only needed for .yml/.yaml decision files)
+    with open(path, encoding="utf-8") as file:
+        if path.lower().endswith((".yml", ".yaml")):
+            import yaml
+            return yaml.safe_load(file) or {}
+        return json.load(file)
+
+def _encode(kind: str, value):
+    # Raw answer → decision file value
+    if kind == "question" and value in _BUTTON_NAMES:
+        return _BUTTON_NAMES[value]
+    if kind == "payment_queue" and value is not None:
+        return [list(job) for job in value]
+    return value
+
+def _decode(kind: str, value):
+    # Decision file value → raw answer
+    if value is None:
+        return None
+    if kind == "question":
+        return _BUTTONS[str(value).lower()] if not isinstance(value, int) else value
+    if kind == "number":
+        return float(value)
+    if kind == "row_decisions":
+        return {int(row): decision for row, decision in value.items()}
+    if kind == "payment_queue":
+        return [(path, client, round(float(total), 2)) for path, client, total in value]
+    if kind == "open_files":
+        return list(value)
+    return str(value)
+
+class ScriptedInputProvider(InputProvider):
+    """
+    Answers from a decision file (JSON, or YAML with PyYAML), so a workflow runs unattended.
+
+    File keys:
+    - answers (list[dict]): {'kind', 'match', 'value', 'repeat'}; the first unused answer of the
+      same kind whose 'match' is contained in the prompt (case-insensitive, empty matches any) is
+      used once, or every time if 'repeat' is true
+    - defaults (dict, optional): Answer per kind when no entry matches
+
+    Prompts asked as explicit (e.g. whether an interrupted entry was saved in SAP) only take an
+    answer whose non-empty 'match' is in the prompt: empty matches and defaults are skipped.
+
+    Notices go to the run log. Without an answer the fallback provider is asked if there is one;
+    otherwise a question gets CANCEL (or NO), anything else None, and the miss is logged as an
+    error and kept in `missing`.
+
+    Parameters:
+    - path (str, optional): Decision file
+    - answers (list[dict], optional): Answers checked before the file ones (e.g. command line paths)
+    - fallback (InputProvider, optional): Provider asked when nothing matches
+    """
+    interactive = False
+
+    def __init__(self, path: str | None = None, answers: list | None = None, fallback: InputProvider | None = None):
+        data = _read_decision_file(path) if path else {}
+        self.path = path or "la línea de comandos"
+        self.answers = [dict(answer) for answer in (answers or []) + data.get("answers", [])]
+        self.defaults = data.get("defaults", {})
+        self.fallback = fallback
+        self.missing = []
+
+    def ask(self, kind: str, prompt: str, **context):
+        title = context.get("title", "")
+        if kind in _NOTICES:
+            severity = WARNING if kind == "warning" else INFO
+            rows = context.get("rows") or []
+            log_event(severity, f"{title}: {prompt}" + (f" ({len(rows)} filas)" if kind == "table" else ""))
+            return None
+        explicit = context.pop("explicit", False)
+        text = prompt.lower()
+        for answer in self.answers:
+            if answer.get("kind") != kind or answer.get("used"):
+                continue
+            match = str(answer.get("match") or "").lower()
+            if explicit and not match:
+                continue
+            if match in text:
+                if not answer.get("repeat"):
+                    answer["used"] = True
+                return _decode(kind, answer.get("value"))
+        if kind in self.defaults and not explicit:
+            return _decode(kind, self.defaults[kind])
+        if self.fallback is not None:
+            return self.fallback.ask(kind, prompt, **context)
+        self.missing.append((kind, prompt))
+        log_event(ERROR, f"Sin respuesta en {os.path.basename(self.path)} para {kind}: {prompt}")
+        if kind == "question":
+            return CANCEL if context.get("buttons", YES | NO) & CANCEL else NO
+        return None
+
+class RecordingInputProvider(InputProvider):
+    """
+    Asks through another provider (the operator by default) and writes every answer to a
+    decision file as it is given, ready to be replayed with ScriptedInputProvider.
+
+    Parameters:
+    - path (str): Decision file to write (JSON)
+    - inner (InputProvider, optional): Provider that actually answers
+    """
+    def __init__(self, path: str, inner: InputProvider | None = None):
+        self.path = path
+        if inner is None:
+            from QtInputs import QtInputProvider
+            inner = QtInputProvider()
+        self.inner = inner
+        self.interactive = self.inner.interactive
+        self.answers = []
+
+    def ask(self, kind: str, prompt: str, **context):
+        value = self.inner.ask(kind, prompt, **context)
+        if kind not in _NOTICES:
+            self.answers.append({"kind": kind, "match": prompt, "value": _encode(kind, value)})
+            with open(self.path, "w", encoding="utf-8") as file:
+                json.dump({"answers": self.answers}, file, ensure_ascii=False, indent=1, default=str)
+        return value
+
+_provider = None
+
+def input_provider() -> InputProvider:
+    """
+    Returns the active input provider (Qt dialogs unless another one was set).
+
+    Returns:
+    - InputProvider: Active provider
+    """
+    global _provider
+    if _provider is None:
+        # Qt (and PyQt5) is loaded the first time a dialog is needed
+        from QtInputs import QtInputProvider
+        _provider = QtInputProvider()
+    return _provider
+
+_auto_save = None
+
+def set_auto_save(enabled: bool | None):
+    """
+    Allows (or forbids) saving entries in SAP when nobody is at the dialogs, overriding
+    'auto_save' in SAP_info.json (None goes back to it). Used by CLIRunner --auto-save.
+
+    Parameters:
+    - enabled (bool or None): True to save confirmed entries with Ctrl+S
+
+    Returns:
+    - None
+    """
+    global _auto_save
+    _auto_save = enabled
+
+def auto_save() -> bool:
+    """
+    Tells whether save_confirmation may save entries itself (opt-in, off by default).
+
+    Returns:
+    - bool: True if set with set_auto_save, or 'auto_save' is true in SAP_info.json
+    """
+    if _auto_save is not None:
+        return _auto_save
+    return bool(Load_SAP_info.config.get("auto_save", False))
+
+def set_input_provider(provider: InputProvider | None):
+    """
+    Replaces the active input provider (None goes back to Qt dialogs).
+
+    Parameters:
+    - provider (InputProvider or None): New provider
+
+    Returns:
+    - None
+    """
+    global _provider
+    _provider = provider
+
+def use_decision_file(path: str, record: bool = False) -> InputProvider:
+    """
+    Answers from a decision file, or records the operator's answers into it.
+
+    Parameters:
+    - path (str): Decision file (JSON or YAML)
+    - record (bool, optional): True to record a live session instead of replaying it
+
+    Returns:
+    - InputProvider: Provider now active
+    """
+    provider = RecordingInputProvider(path) if record else ScriptedInputProvider(path)
+    set_input_provider(provider)
+    return provider
 
 # -----------------------------------------------
 #  Centralized Dialog Helpers
 # -----------------------------------------------
 def show_info(title: str, message: str):
     """
-    Displays an informational popup dialog using PyQt5.
+    Displays an informational popup dialog (logged instead when answers come from a decision file).
     
     Parameters:
     - title (str): Title of the popup window
@@ -27,11 +266,11 @@ def show_info(title: str, message: str):
     Returns:
     - None: shows modal info dialog
     """
-    QMessageBox.information(None, title, message)
+    input_provider().ask("info", message, title=title)
 
 def show_warning(title: str, message: str):
     """
-    Displays a warning popup dialog using PyQt5.
+    Displays a warning popup dialog (logged instead when answers come from a decision file).
 
     Parameters:
     - title (str): Title of the popup window
@@ -40,21 +279,51 @@ def show_warning(title: str, message: str):
     Returns:
     - None: shows modal warning dialog
     """
-    QMessageBox.warning(None, title, message)
+    input_provider().ask("warning", message, title=title)
 
-def show_question(title: str, message: str, buttons=QMessageBox.Yes | QMessageBox.No) -> int:
+def show_question(title: str, message: str, buttons=YES | NO, explicit: bool = False) -> int:
     """
     Displays a question dialog with customizable buttons.
 
     Parameters:
     - title (str): Window title
     - message (str): Question prompt
-    - buttons (int, optional): Button set (e.g. Yes/No, Retry/Cancel)
+    - buttons (int, optional): Button set (e.g. YES | NO, RETRY | CANCEL)
+    - explicit (bool, optional): Decision files must answer this prompt by its text (no defaults)
 
     Returns:
-    - int: User-selected button value
+    - int: User-selected button value (equal to the QMessageBox one)
+    """
+    return input_provider().ask("question", message, title=title, buttons=int(buttons), explicit=explicit)
+
+def show_table(title: str, message: str, headers: list, rows: list):
     """
-    return QMessageBox.question(None, title, message, buttons)
+    Displays a non-modal table window (e.g. every problem found in a file) and returns immediately.
+
+    Parameters:
+    - title (str): Window title
+    - message (str): Text shown above the table
+    - headers (list[str]): Column labels
+    - rows (list[list]): Table values
+
+    Returns:
+    - QDialog or None: Open window (kept alive until the user closes it), None without dialogs
+    """
+    return input_provider().ask("table", message, title=title, headers=headers, rows=rows)
+
+def ask_choice(title: str, message: str, items: list) -> str | None:
+    """
+    Lets the user pick one item of a list.
+
+    Parameters:
+    - title (str): Window title
+    - message (str): Prompt
+    - items (list[str]): Items offered
+
+    Returns:
+    - str or None: Chosen item or None if canceled
+    """
+    return input_provider().ask("choice", message, title=title, items=items)
 
 # -----------------------------------------------
 #  Retry Decorator
@@ -74,12 +343,14 @@ def retry_input(func):
             result = func(*args, **kwargs)
             if result is not None:
                 return result
+            # Explicit: a default answer would retry forever without an operator
             retry = show_question(
                 "¿Reintentar?",
                 "No se recibió una entrada válida.\n¿Desea intentarlo de nuevo?",
-                QMessageBox.Retry | QMessageBox.Cancel
+                RETRY | CANCEL,
+                explicit=True
             )
-            if retry == QMessageBox.Cancel:
+            if retry == CANCEL:
                 show_info("Cancelado", "Operación cancelada por el usuario.")
                 Load_SAP_info.ContinueProgram = False
                 return None
@@ -88,52 +359,62 @@ def retry_input(func):
 # -----------------------------------------------
 #  Utilities
 # -----------------------------------------------
-class DiffDialog(QDialog):
+def dif_popup(dif):
     """
-    PyQt5 dialog for selecting SAP difference handling strategy (rounding or account assignment).
+    Opens a modal dialog for SAP difference strategy selection.
+    
+    Parameters:
+    - dif: Difference value displayed in dialog
     
     Returns:
-    - result: Set to 'round_dif' or 'to_account' based on user action
+    - str or None: Selected strategy ('round_dif', 'to_account') or None if canceled
     """
-    def __init__(self, diff_value):
-        super().__init__()
-        self.ui = Ui_Form()
-        self.ui.setupUi(self)
-        self.ui.retranslateUi(self, diff_value)
+    return input_provider().ask("difference", f"Diferencia {dif}", dif=dif)
 
-        self.result:str |None = None
-        self.ui.RoundBtn.clicked.connect(self.handle_round)
-        self.ui.ToAccountBtn.clicked.connect(self.handle_to_account)
 
-    def handle_round(self):
-        self.result = "round_dif"
-        self.accept()  # closes the dialog and sets result to Accepted
+def ask_row_decisions(rows, defaults=None) -> dict | None:
+    """
+    Opens the decision grid for all pending rows and waits until the operator confirms it.
 
-    def handle_to_account(self):
-        self.result = "to_account"
-        self.accept()
+    Parameters:
+    - rows (list[tuple]): (row number, action, client code, amount, concept) per pending row
+    - defaults (dict, optional): Preselected decisions per row number
 
+    Returns:
+    - dict or None: Decisions per row number, or None if canceled
+    """
+    if not rows:
+        return {}
+    decisions = input_provider().ask("row_decisions", f"{len(rows)} pagos pendientes", rows=rows, defaults=defaults)
+    if decisions is not None:
+        return decisions
+    show_info("Cancelado", "Proceso cancelado por el usuario.")
+    Load_SAP_info.ContinueProgram = False
+    return None
 
-def dif_popup(dif):
+
+def ask_payment_queue(paths, clients, guesses=None) -> list | None:
     """
-    Opens a modal dialog for SAP difference strategy selection.
-    
+    Opens the payment queue grid and waits until the operator confirms it.
+
     Parameters:
-    - dif: Difference value displayed in dialog
-    
+    - paths (list[str]): Detail file paths
+    - clients (list[str]): Client names offered
+    - guesses (dict, optional): Preselected client per path
+
     Returns:
-    - str or None: Selected strategy ('round_dif', 'to_account') or None if canceled
+    - list or None: [(path, client name, total)], or None if canceled
     """
-    app = QApplication.instance()
-    if not app:
-        app = QApplication(sys.argv)
-
-    dialog = DiffDialog(dif)
-    if dialog.exec_() == QDialog.Accepted:
-        return dialog.result
+    if not paths:
+        return []
+    jobs = input_provider().ask("payment_queue", f"{len(paths)} ficheros de detalle",
+                                paths=paths, clients=clients, guesses=guesses)
+    if jobs is not None:
+        return jobs
+    show_info("Cancelado", "Proceso cancelado por el usuario.")
+    Load_SAP_info.ContinueProgram = False
     return None
 
-
 def distinct_vals(ws, column_letter: str) -> list:
     """
     Returns a list of distinct non-empty values from a specified Excel column.
@@ -171,15 +452,17 @@ def ask_open_file(msg: str) -> str | None:
     """
     try:
         while True:
-            file_path, _ = QFileDialog.getOpenFileName(None, msg)
+            file_path = input_provider().ask("open_file", msg)
             if file_path:
                 return file_path
+            # Explicit: a default answer would retry forever without an operator
             retry = show_question(
                 "Confirmación",
                 "No se ha seleccionado fichero.\n¿Desea continuar?",
-                QMessageBox.Retry | QMessageBox.Cancel
+                RETRY | CANCEL,
+                explicit=True
             )
-            if retry == QMessageBox.Cancel:
+            if retry == CANCEL:
                 show_info("Cancelado", "Proceso cancelado por el usuario.")
                 Load_SAP_info.ContinueProgram = False
                 return None
@@ -200,15 +483,17 @@ def ask_open_files(msg: str) -> list[str] | None:
     """
     try:
         while True:
-            file_paths, _ = QFileDialog.getOpenFileNames(None, msg)
+            file_paths = input_provider().ask("open_files", msg)
             if file_paths:
                 return file_paths
+            # Explicit: a default answer would retry forever without an operator
             retry = show_question(
                 "Confirmación",
                 "No se ha seleccionado ningún fichero.\n¿Desea continuar?",
-                QMessageBox.Retry | QMessageBox.Cancel
+                RETRY | CANCEL,
+                explicit=True
             )
-            if retry == QMessageBox.Cancel:
+            if retry == CANCEL:
                 show_info("Cancelado", "Proceso cancelado por el usuario.")
                 Load_SAP_info.ContinueProgram = False
                 return None
@@ -217,6 +502,53 @@ def ask_open_files(msg: str) -> list[str] | None:
         Load_SAP_info.ContinueProgram = False
         return None
 
+def ask_save_file(msg: str, default_name: str = "") -> str | None:
+    """
+    Prompts the user to choose where to save a new Excel file using QFileDialog.
+
+    Parameters:
+    - msg (str): Message shown in the dialog
+    - default_name (str, optional): Suggested file name
+
+    Returns:
+    - str or None: Selected path (always ending in .xlsx) or None if canceled
+    """
+    try:
+        file_path = input_provider().ask("save_file", msg, default_name=default_name)
+        if not file_path:
+            show_info("Cancelado", "Proceso cancelado por el usuario.")
+            Load_SAP_info.ContinueProgram = False
+            return None
+        if not file_path.endswith(".xlsx"):
+            file_path += ".xlsx"
+        return file_path
+    except Exception as e:
+        print(f"[ERROR] Error al seleccionar destino: {e}")
+        Load_SAP_info.ContinueProgram = False
+        return None
+
+def ask_folder(msg: str) -> str | None:
+    """
+    Prompts the user to choose a folder using QFileDialog.
+
+    Parameters:
+    - msg (str): Message shown in the dialog
+
+    Returns:
+    - str or None: Selected folder path or None if canceled
+    """
+    try:
+        folder = input_provider().ask("folder", msg)
+        if not folder:
+            show_info("Cancelado", "Proceso cancelado por el usuario.")
+            Load_SAP_info.ContinueProgram = False
+            return None
+        return folder
+    except Exception as e:
+        print(f"[ERROR] Error al seleccionar carpeta: {e}")
+        Load_SAP_info.ContinueProgram = False
+        return None
+
 @retry_input
 def ask_user_date(prompt="Introduce la fecha (dd/mm/yyyy)") -> str | None:
     """
@@ -228,8 +560,8 @@ def ask_user_date(prompt="Introduce la fecha (dd/mm/yyyy)") -> str | None:
     Returns:
     - str or None: Formatted date string (dd.mm.yyyy) or None
     """
-    text, ok = QInputDialog.getText(None, "Introduce Fecha", prompt)
-    if not ok:
+    text = input_provider().ask("date", prompt)
+    if text is None:
         return None
     try:
         dt = datetime.datetime.strptime(text, "%d/%m/%Y")
@@ -249,36 +581,30 @@ def ask_user_number(msg: str) -> float | None:
     Returns:
     - float or None: Rounded numeric input or None
     """
-    dialog = QInputDialog()
-    dialog.setInputMode(QInputDialog.DoubleInput)
-    dialog.setLabelText(f"Introduce el importe de {msg}:")
-    dialog.setWindowTitle("Introduce importe")
-    dialog.setLocale(QLocale(QLocale.English, QLocale.UnitedStates))  # Forces dot as decimal
-    dialog.setDoubleDecimals(2)
-    dialog.setDoubleRange(0.0, 9999999999.0)
-    dialog.setDoubleValue(0.0)
-
-    if dialog.exec_() == QInputDialog.Accepted:
-        return round(dialog.doubleValue(), 2)
-    return None
+    value = input_provider().ask("number", msg)
+    return round(value, 2) if value is not None else None
 
 @retry_input
-def ask_user_string(msg: str) -> str | None:
+def ask_user_string(msg: str, explicit: bool = False) -> str | None:
     """
     Prompts user for a string input, ensuring non-empty response.
 
     Parameters:
     - msg (str): Descriptor for input prompt
+    - explicit (bool, optional): Decision files must answer this prompt by its text (no defaults)
 
     Returns:
     - str or None: Cleaned user string input or None
     """
-    text, ok = QInputDialog.getText(None, "Introduce comentario", f"Introduce el {msg}:")
-    return text.strip() if ok and text.strip() else None
+    text = input_provider().ask("text", msg, explicit=explicit)
+    return text.strip() if text and text.strip() else None
 
 def save_confirmation() -> bool:
     """
     Asks the user for final confirmation before saving data to SAP.
+    With answers from a decision file nobody saves by hand: a confirmed entry is saved here (Ctrl+S)
+    only if auto save was enabled ('auto_save' in SAP_info.json or CLIRunner --auto-save);
+    otherwise the run stops before the entry is saved.
 
     Parameters:
     - None (uses active session and SAP GUI commands internally)
@@ -286,18 +612,25 @@ def save_confirmation() -> bool:
     Returns:
     - bool: True if user confirms, False if canceled
     """
-    from SAPAux import chk_window
+    from SAPAux import chk_window, SAPSessionManager
     win_text=chk_window()
     if Load_SAP_info.ContinueProgram == False: return
     while "Visualizar Resumen" in win_text:
+        if not input_provider().interactive and not auto_save():
+            log_event(ERROR, "Asiento sin grabar: el grabado automático no está activado (auto_save / --auto-save)")
+            Load_SAP_info.ContinueProgram = False
+            return False
         reply = show_question(
             "Confirmación",
-            "¿Conforme con los apuntes?\n¿Desea continuar y guardar en SAP?"
+            "¿Conforme con los apuntes?\n¿Desea continuar y guardar en SAP?",
+            explicit=True
         )
-        if reply == QMessageBox.No:
+        if reply != YES:
             show_info("Cancelado", "Proceso cancelado por el usuario.")
             Load_SAP_info.ContinueProgram = False
             return False
+        if not input_provider().interactive:
+            SAPSessionManager.session.findById("wnd[0]").sendVKey(11)
         win_text=chk_window()
         if Load_SAP_info.ContinueProgram == False: return
     return True
@@ -306,9 +639,5 @@ def save_confirmation() -> bool:
 # ---------   
 # Saveguard
 if __name__ == "__main__":
-    app = QApplication.instance()
-    if not app:
-        app = QApplication(sys.argv)
-
     # Optional: test a dialog or widget
     show_info("Módulo cargado", "Este módulo se ejecuta directamente.")
@@ -6,98 +6,17 @@
 import xlwings as xw
 import os
 import re
-from datetime import date,datetime
-from UserInputs import ask_open_file, show_info,show_warning,ask_user_number
-
-from PyQt5.QtWidgets import (QLabel,QPushButton, QVBoxLayout, QApplication,QDialog)
 import sys
+from datetime import date,datetime
+from UserInputs import ask_open_file,show_warning,ask_user_number,input_provider
+from RunLog import log_event, ERROR
+from RemittanceClassifier import detail_classifier, profile_keys, display_text, is_plain_format
+from LocalStore import open_item_references
+from WarmUp import template_path
 import Load_SAP_info
 # -----------------------------------
 # Aux Functions
 # -----------------------------------
-class RangeSelectorWindow(QDialog):
-    """
-    PyQt5 dialog for selecting a cell range in Excel to either store or transfer into a template.
-    Used in SAP-related workflows to handle manual input of invoice ranges and posting entries.
-
-    Workflow:
-    - Launches a modal window prompting the user to select a cell range in Excel
-    - Offers two actions:
-        - 'Pasar a Template': Copies the selected range into a target template sheet
-        - 'Almacenar rango': Saves the selected range to use later in the script
-    - Handles cancellations gracefully by notifying the user
-    - On confirmation, the selected data is either transferred or stored for downstream logic
-
-    Parameters:
-    - wbTemplate (Workbook): The Excel workbook containing the destination sheet
-    - destination_start_cell (str): Top-left cell where copied data should begin (e.g. 'D10')
-
-    Attributes:
-    - selected_range: Stores the user-selected cell range for external use
-
-    Usage:
-    This dialog is typically triggered via `_launch_range_selector()` after a workbook is loaded.
-    """
-    def __init__(self, wbTemplate, destination_start_cell):
-        super().__init__()
-        self.wbTemplate = wbTemplate
-        self.destination_start_cell = destination_start_cell
-        self.selected_range = None 
-        self.setWindowTitle("Confirmar Selección")
-        self.setFixedSize(300, 150)
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QVBoxLayout()
-
-        label = QLabel("Selecciona el rango en Excel\nLuego haz clic en OK para copiar.")
-        layout.addWidget(label)
-
-        to_template_btn = QPushButton("Pasar a Template")
-        to_template_btn.clicked.connect(self.on_to_template_btn)
-        layout.addWidget(to_template_btn)
-        
-        save_range_btn = QPushButton("Almacenar rango")
-        save_range_btn.clicked.connect(self.on_save_range_btn)
-        layout.addWidget(save_range_btn)
-
-        cancel_btn = QPushButton("Cancelar")
-        cancel_btn.clicked.connect(self.on_cancel)
-        layout.addWidget(cancel_btn)
-
-        self.setLayout(layout)
-        self.show()  # Modeless by default
-
-    def on_to_template_btn(self):
-        selected_range = self.wbTemplate.app.selection
-
-        if not selected_range:
-            show_info("Cancelar","No hay una selección válida.")
-            return
-        self.transfer_range(selected_range)
-        self.accept()
-    def on_save_range_btn(self):
-        selected_range = self.wbTemplate.app.selection
-        if not selected_range:
-            show_info("Cancelar","No hay una selección válida.")
-            return
-        self.selected_range = selected_range
-        self.accept()  # Close the dialog and return control
-        
-    def on_cancel(self):
-        show_info("Cancelar","Selección cancelada por el usuario.")
-        self.cancel()
-
-    def transfer_range(self, selected_range):
-        wsTemplate = self.wbTemplate.sheets[0]
-        start_row = xw.Range(self.destination_start_cell).row
-        start_col = xw.Range(self.destination_start_cell).column
-
-        for i, row in enumerate(selected_range.rows):
-            for j, cell in enumerate(row):
-                wsTemplate.cells(start_row + i, start_col + j).value = cell.value
-        self.wbTemplate.app.status_bar = "Listo"
-
 # Launch the PyQt5 window after workbook is open
 def launch_range_selector(wbTemplate, destination_start_cell='D10'):
     """
@@ -110,6 +29,7 @@ def launch_range_selector(wbTemplate, destination_start_cell='D10'):
     - Waits for user interaction via dialog box
     - If selection is confirmed, returns the selected range
     - If canceled, returns None
+    - Without an operator (answers from a decision file), stops the run and returns None
     
     Parameters:
     - wbTemplate (Workbook): The workbook object to enable range selection in
@@ -118,6 +38,13 @@ def launch_range_selector(wbTemplate, destination_start_cell='D10'):
     Returns:
     - Range or None: Selected cell range if accepted; otherwise None
     """
+    # The selection is made by hand in Excel: without an operator the run stops here instead of waiting
+    if not input_provider().interactive:
+        log_event(ERROR, "La selección de un rango en Excel necesita un operador; no se puede responder desde un fichero de decisiones")
+        Load_SAP_info.ContinueProgram = False
+        return None
+    # The selection is made by hand in Excel, so this always needs Qt
+    from QtInputs import RangeSelectorWindow, QApplication, QDialog
     app = QApplication.instance()
     if not app:
         app = QApplication(sys.argv)
@@ -155,9 +82,12 @@ def check_wb_open(path):
         book_path = os.path.normcase(os.path.normpath(book.fullname))
         if book_path == path:
             return book
-    # If not open, then open it
+    # If not open, then open it (the warm-up Excel instance stays hidden until its first workbook)
     if wb is None:
-        return xw.Book(path)
+        wb = xw.Book(path)
+        if not wb.app.visible:
+            wb.app.visible = True
+        return wb
 
 # Aux function to convert number to Excel letter column
 def letter_from_number(n):
@@ -180,6 +110,22 @@ def letter_from_number(n):
         result = chr(65 + remainder) + result
     return result 
 
+# Aux function to convert Excel letter column to number
+def number_from_letter(letters: str) -> int:
+    """
+    Converts an Excel column letter into its 1-indexed column number (A → 1, AA → 27).
+
+    Parameters:
+    - letters (str): Excel-style column letter
+
+    Returns:
+    - int: 1-based column number
+    """
+    n = 0
+    for ch in letters.strip().upper():
+        n = n * 26 + ord(ch) - 64
+    return n
+
 # Aux function to clean str in order to name a Worksheet or file
 def sanitize_sheet_name(name):
     # Remove invalid characters: : \ / ? * [ ]
@@ -189,6 +135,117 @@ def sanitize_sheet_name(name):
     # Optional: replace empty name with a default one
     return name if name else "Sheet1"
 
+# Aux function to find the last filled row of a column
+def last_row_of(ws, column_letter: str) -> int:
+    """
+    Returns the last filled row of a column, scanning up from the bottom of the sheet.
+
+    Parameters:
+    - ws: Excel Worksheet
+    - column_letter (str): Column reference (e.g. 'F')
+
+    Returns:
+    - int: Row number of the last non-empty cell (1 if the column is empty)
+    """
+    return ws.range(column_letter + str(ws.cells.last_cell.row)).end("up").row
+
+# Aux function to read a block of rows in a single COM call
+def read_block(ws, first_col: str, last_col: str, first_row: int, last_row: int) -> list:
+    """
+    Reads a rectangular range with one COM call and always returns a list of row lists.
+
+    Parameters:
+    - ws: Excel Worksheet
+    - first_col (str): First column letter (e.g. 'F')
+    - last_col (str): Last column letter (e.g. 'O')
+    - first_row (int): First row to read
+    - last_row (int): Last row to read
+
+    Returns:
+    - list[list]: Cell values by row (empty list if last_row < first_row)
+    """
+    if last_row < first_row:
+        return []
+    return ws.range(f"{first_col}{first_row}:{last_col}{last_row}").options(ndim=2).value
+
+# Aux function to read a remittance detail with its reference cells as displayed text
+def read_detail_block(ws, classifier, last_row: int, last_col: int) -> list:
+    """
+    Reads a detail sheet from A1 in one COM call, with the classifier text cells as Excel displays them.
+
+    Workflow:
+    - Reads the values block (A1 to `last_row`, `last_col`)
+    - Text columns with one plain format (General, text or zero-padded) are formatted from the values
+    - Text columns with mixed or other formats, and the payment number header cell, are read as cell text
+
+    Parameters:
+    - ws: Excel Worksheet
+    - classifier (DetailClassifier): Classifier of the detail profile
+    - last_row (int): Last row to read
+    - last_col (int): Last column to read
+
+    Returns:
+    - list[list]: Cell values by row, ready for `DetailClassifier.read_rows`
+    """
+    values = ws.range((1, 1), (last_row, last_col)).options(ndim=2).value
+    first_row = classifier.start_row
+    if last_row >= first_row:
+        for col in classifier.text_cols:
+            if col > last_col:
+                continue
+            number_format = ws.range((first_row, col), (last_row, col)).number_format
+            for row in range(first_row, last_row + 1):
+                if is_plain_format(number_format):
+                    values[row - 1][col - 1] = display_text(values[row - 1][col - 1], number_format)
+                else:
+                    values[row - 1][col - 1] = ws.cells(row, col).api.Text
+    for row, col in classifier.text_cells:
+        if row <= last_row and col <= last_col:
+            values[row - 1][col - 1] = ws.cells(row, col).api.Text
+    return values
+
+# Aux function to write a whole column in a single COM call
+def write_column(ws, column_letter: str, first_row: int, values: list):
+    """
+    Writes a list of values down a column with one COM call.
+
+    Parameters:
+    - ws: Excel Worksheet
+    - column_letter (str): Target column (e.g. 'L')
+    - first_row (int): Row where the first value is written
+    - values (list): Values to write, top to bottom
+
+    Returns:
+    - None: updates Excel file
+    """
+    if not values:
+        return
+    ws.range(f"{column_letter}{first_row}").options(transpose=True).value = list(values)
+
+def write_rows(ws, first_row: int, rows: dict, column_letters: list):
+    """
+    Writes values only into the given rows, with one COM call per column and run of consecutive rows.
+    Cells of the other rows (and their formulas) are left untouched.
+
+    Parameters:
+    - ws: Excel Worksheet
+    - first_row (int): Sheet row of row index 0
+    - rows (dict[int, list]): Row index → values, one per column in `column_letters`
+    - column_letters (list[str]): Target columns (e.g. ['L', 'M', 'O'])
+
+    Returns:
+    - None: updates Excel file
+    """
+    indexes = sorted(rows)
+    start = 0
+    for end in range(1, len(indexes) + 1):
+        if end < len(indexes) and indexes[end] == indexes[end - 1] + 1:
+            continue
+        run = indexes[start:end]
+        for col_index, column_letter in enumerate(column_letters):
+            write_column(ws, column_letter, first_row + run[0], [rows[i][col_index] for i in run])
+        start = end
+
 # Aux function to setup headears in a Worksheet
 def setup_headers(ws,report_name):
     """
@@ -216,7 +273,21 @@ def setup_headers(ws,report_name):
     if len(insert_columns) > 0:
         for col in insert_columns:
             ws.range(col).api.Insert()
-    headers = report_detail["headers"]
+    format_headers(ws, report_name)
+
+def format_headers(ws, report_name):
+    """
+    Writes the configured header labels and colors and formats the header row (bold, borders),
+    without touching the columns. Used directly when the table was already laid out in Python.
+
+    Parameters:
+    - ws: Excel Worksheet
+    - report_name (str): Prefix of the '<report_name>_detail' block in SAP_info.json
+
+    Returns:
+    - None: updates Excel file
+    """
+    headers = Load_SAP_info.config[f"{report_name}_detail"]["headers"]
     for item in headers:
         cell = item["cell"]
         text = item["text"]
@@ -229,6 +300,27 @@ def setup_headers(ws,report_name):
     ws.range(f"A1:{last_col_letter}1").api.Borders.Weight = 2
     ws.range(f"A1:{last_col_letter}1").font.bold = True
 
+# Aux function to apply the configured column deletions to rows already read into Python
+def drop_columns(rows: list, delete_columns: list) -> list:
+    """
+    Applies a list of Excel column deletions (e.g. ["B:B", "D:F"]) to rows held in memory,
+    in the same order and with the same shifting as deleting them one by one in Excel.
+
+    Parameters:
+    - rows (list[list]): Row values
+    - delete_columns (list[str]): Column ranges as written in SAP_info.json
+
+    Returns:
+    - list[list]: New rows without the deleted columns
+    """
+    rows = [list(row) for row in rows]
+    for col in delete_columns:
+        first, last = col.split(":")
+        first_index, last_index = number_from_letter(first) - 1, number_from_letter(last)
+        for row in rows:
+            del row[first_index:last_index]
+    return rows
+
 # Aux function to sett Validation data in a indicated range
 def set_data_validation(ws, col_val_index, last_row, validation_source, use_range=False, wb=None):
     """
@@ -409,6 +501,56 @@ def merge_sheets(wb, base_sheet, sheet_names):
 
 
 
+def fill_batch_template(client_name, client_detail, clients_dic, doc_date, template_refs):
+    """
+    Populates the SAP batch template with the invoice references of one payment and saves it.
+
+    Workflow:
+    - Clears the references left in column D from row 10
+    - Writes document dates and client category in the header
+    - Adds the client code when the client has a single account, so only its items are selected
+    - Leaves out the references the open-items mirror knows are not open (when refreshed in this run), so SAP
+      only searches items it will find; `payment_batch_template` enters those invoices manually
+    - Writes all invoice references in one call
+
+    Parameters:
+    - client_name (str): Primary client identifier
+    - client_detail (dict): '<client>_detail' profile
+    - clients_dic (dict): Client keys → SAP codes
+    - doc_date (str): Document date ('dd.mm.yyyy')
+    - template_refs (list[str]): Invoice references, in template order
+
+    Returns:
+    - None: saves and closes the batch template
+    """
+    # Load SAP batch template and clear previously populated rows
+    batch_template_path = template_path("batch_template_path2")
+    wb_template = check_wb_open(batch_template_path)
+    ws_template = wb_template.sheets[0]
+    # Clear template before insert data
+    temp_ini_row = 10
+    temp_end_row = ws_template.range(f"D{temp_ini_row}").end("down").row
+    if temp_ini_row < temp_end_row:
+        ws_template.range(f'D{temp_ini_row}:D{temp_end_row}').clear_contents()
+    # Populate template header with metadata
+    client_category =client_detail["client_category"]
+    ws_template.cells(2,5).value = doc_date
+    ws_template.cells(2, 7).value = doc_date
+    ws_template.cells(6, 6).value = client_category
+    # If there is only one client code add it into template so only Items from that account are selected
+    if len(clients_dic) == 1:
+        client_code = clients_dic[client_name.upper()]
+        ws_template.cells(6,5).value = client_code
+    # Only select references still open in SAP (e.g. X/V variants of 7-character references)
+    open_refs = open_item_references(clients_dic.values())
+    if open_refs is not None:
+        template_refs = [reference for reference in template_refs if reference in open_refs]
+    # Copy invoice references to the template in one write
+    write_column(ws_template, "D", temp_ini_row, template_refs)
+    # Save and close populated SAP template
+    wb_template.save()
+    wb_template.close()
+
 def detail_handler(client_name,client_aux_name=""):
     """
     From invoices detail, categorizes data and populates a SAP-compatible template,
@@ -418,8 +560,8 @@ def detail_handler(client_name,client_aux_name=""):
     - Loads client configuration based on provided names
     - Opens invoice payment detail Excel file
     - Validates total invoice amount against user input
-    - Extracts and classifies invoice references by type
-    - Populates a template Excel file with structured invoice entries
+    - Reads each detail sheet in one block and classifies it with the profile's compiled classifier
+    - Populates a template Excel file with structured invoice entries (one write)
     - Clears template and payment file cells if needed for recalculation
     - Assembles all relevant data into a final dictionary for SAP processing
 
@@ -433,15 +575,11 @@ def detail_handler(client_name,client_aux_name=""):
     # Final dictionary with all required fields for SAP processing
     payment_dic = {}
     # Load client-specific dictionaries and configurations based on provided names from JSON
-    client_name_lower=client_name.lower()
-    if client_aux_name:
-       client_detail = Load_SAP_info.config[f"{client_aux_name}_detail"]
-       if "_" in client_aux_name:
-           client_aux_name=client_aux_name.split("_")[0]
-       clients_dic=Load_SAP_info.config[f"{client_aux_name}_dic"]
-    else:
-        clients_dic=Load_SAP_info.config[f"{client_name_lower}_dic"]
-        client_detail = Load_SAP_info.config[f"{client_name_lower}_detail"]    
+    profile, clients_key = profile_keys(client_name, client_aux_name)
+    clients_dic=Load_SAP_info.config[clients_key]
+    client_detail = Load_SAP_info.config[profile]
+    # Classifier compiled once per profile (sets + corporate name matcher)
+    classifier = detail_classifier(profile, clients_key)
     """
     client_detail structure
     "amount_col": int,
@@ -507,6 +645,7 @@ def detail_handler(client_name,client_aux_name=""):
     # Exit if amounts don't match (payment details might be incomplete)
     if user_amount != detail_amount:
         show_warning("Cancelación", "El importe introducido no cuadra con el detalle")
+        Load_SAP_info.ContinueProgram = False
         return
     # Clean invoice reference column (remove hyphens)
     inv_ref_col = client_detail["inv_ref_col"]
@@ -535,8 +674,6 @@ def detail_handler(client_name,client_aux_name=""):
                 sheet.delete()
         else:
             break
-    # Load SAP batch template and clear previously populated rows
-    batch_template_path = Load_SAP_info.config["batch_template_path2"]
     for sheet in wb.sheets:
         # Define date-related variables
         due_date_cell = client_detail["due_date"]
@@ -553,106 +690,15 @@ def detail_handler(client_name,client_aux_name=""):
         doc_date = date.today().strftime("%d.%m.%Y")
         # Define end_row
         end_row = sheet.range(f"{amount_col_letter}{start_row}").end("down").row
-        wb_template = check_wb_open(batch_template_path)
-        ws_template = wb_template.sheets[0]
-        # Clear template before insert data
-        temp_ini_row = 10
-        temp_end_row = ws_template.range(f"D{temp_ini_row}").end("down").row
-        if temp_ini_row < temp_end_row:
-            ws_template.range(f'D{temp_ini_row}:D{temp_end_row}').clear_contents()
-        # Populate template header with metadata
-        client_category =client_detail["client_category"]
-        ws_template.cells(2,5).value = doc_date
-        ws_template.cells(2, 7).value = doc_date
-        ws_template.cells(6, 6).value = client_category
-        # If there is only one client code add it into template so only Items from that account are selected
-        if len(clients_dic) == 1:
-            client_code = clients_dic[client_name.upper()]
-            ws_template.cells(6,5).value = client_code
-        # Initialize containers for invoice, credit, and debit aggregation
-        invoices = float(0)
-        ajd_amount = float(0)
-        credit_amounts ={}
-        debit_amounts ={}
-        for key_name in clients_dic:
-            credit_amounts[key_name]=float(0)
-            debit_amounts[key_name]=float(0)
-        # Define empty dictionaries for future use
-        entries_dic = {}
-        invoices_dic = {}
-        invoices_allowed = client_detail["invoices_allowed"]
-        debit_allowed = client_detail["debit_allowed"]
-        credit_allowed = client_detail["credit_allowed"]
-        entry_match = client_detail["entry_match"]
-        doc_type_col = client_detail["doc_type_col"]
-        ajd_allowed = client_detail["ajd_allowed"]
-        corp_name_detail = client_detail["corp_name"]
-        if isinstance(corp_name_detail, list):
-            corp_name_row = corp_name_detail[0]
-            corp_name_col = corp_name_detail[1]
-            corp_name = (sheet.cells(corp_name_row,corp_name_col).api.Text).strip().upper()
-        elif isinstance(corp_name_detail, str):
-            corp_name = corp_name_detail
-        # Iterate through invoice rows to classify and extract data based on document type
-        for i in range(start_row,end_row + 1):
-            inv_ref = sheet.cells(i,inv_ref_col).api.Text
-            amount = round(float(sheet.cells(i,amount_col).value),2)
-            if doc_type_col:
-                doc_type = sheet.cells(i,doc_type_col).api.Text.upper()
-            else:
-                doc_type = inv_ref[0]
-            left_ref = inv_ref[0]
-            len_ref = len(inv_ref)
-            if isinstance(corp_name_detail, int):
-                corp_name = (sheet.cells(i,corp_name_detail).api.Text).strip().upper()
-            # For known invoice types, copy references to template and update totals
-            if all(ref in invoices_allowed for ref in [doc_type, left_ref]):
-                if len_ref == 8:
-                    ws_template.cells(temp_ini_row,4).value = inv_ref 
-                    temp_ini_row += 1
-                    invoices = round(invoices + amount,2)
-                    invoices_dic[inv_ref] = i
-                elif len_ref == 7:
-                    inv_ref = "X{inv_ref}"
-                    ws_template.cells(temp_ini_row,4).value = inv_ref
-                    temp_ini_row += 1
-                    invoices_dic[inv_ref] = i
-                    inv_ref = "V{inv_ref}"
-                    ws_template.cells(temp_ini_row,4).value = inv_ref
-                    temp_ini_row += 1
-                    invoices_dic[inv_ref] = i
-                    invoices = round(invoices + amount,2)
-                else:
-                    show_warning("Error", f"Tipo de factura no contemplada\nEn la fila {i}")
-                    return
-            # For credit notes, classify based on matching criteria or corporate name
-            elif doc_type in credit_allowed and amount > 0:
-                if left_ref in entry_match:
-                    entries_dic[i] = i 
-                else:
-                    # Categorize data under the appropriate client
-                    for key in credit_amounts:
-                        if key in corp_name:
-                            credit_amounts[key] = round(credit_amounts[key] + amount,2)
-            # For debit notes, classify based on matching criteria or corporate name
-            elif doc_type in debit_allowed and amount < 0:
-                if left_ref in entry_match:
-                    entries_dic[i] = i # Add data to the entries_dic
-                else:
-                    # Categorize data under the appropriate client
-                    for key in debit_amounts:
-                        if key in corp_name:
-                            debit_amounts[key] = round(debit_amounts[key] + amount,2)
-            elif doc_type in ajd_allowed:
-                if amount < 0:
-                    amount = abs(amount)
-                ajd_amount = amount
-            # All non-classified types are individual entries
-            else:
-                entries_dic[i] = i
-        # Save and close populated SAP template
-        wb_template.save()
-        wb_template.close()
+        # Read the detail in one block and classify every row in one pass
+        values = read_detail_block(sheet, classifier, end_row, classifier.last_col)
+        result = classifier.classify(classifier.read_rows(values, end_row))
+        if result.error_row is not None:
+            show_warning("Error", f"Tipo de factura no contemplada\nEn la fila {result.error_row}")
+            Load_SAP_info.ContinueProgram = False
+            return
+        # Populate and save the SAP batch template
+        fill_batch_template(client_name, client_detail, clients_dic, doc_date, result.template_refs)
         # Fill final dictionary with structured payment data
         payment_dic["client_name"] = client_name
         payment_dic["due_date"] = due_date
@@ -660,12 +706,13 @@ def detail_handler(client_name,client_aux_name=""):
         payment_dic["doc_date"] = doc_date
         payment_dic["doc_date_assignment"] = doc_date_assignment
         payment_dic["payment_amount"] = user_amount
-        payment_dic["invoices_amount"] = invoices
-        payment_dic["ajd_amount"] = ajd_amount
-        payment_dic["debit_amounts"] = debit_amounts
-        payment_dic["credit_amounts"] = credit_amounts
-        payment_dic["entries_dic"] = entries_dic
-        payment_dic["invoices_dic"] = invoices_dic
+        payment_dic["invoices_amount"] = result.invoices_amount
+        payment_dic["ajd_amount"] = result.ajd_amount
+        payment_dic["debit_amounts"] = result.debit_amounts
+        payment_dic["credit_amounts"] = result.credit_amounts
+        payment_dic["entries_dic"] = result.entries_dic
+        payment_dic["invoices_dic"] = result.invoices_dic
+        payment_dic["detail_rows"] = result.rows
         # Invoke template loader for further processing and SAP upload
         from PaymentsModule import payment_batch_template
         payment_batch_template(clients_dic, client_detail, payment_dic, wb, sheet, payment_detail_path)
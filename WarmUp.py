@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+@author: JesusMMA
+"""
+
+import os
+import shutil
+import importlib
+import threading
+from LocalStore import cached_template, save_cached_template
+from RunLog import log_event, WARNING
+import Load_SAP_info
+
+# -----------------------------------
+# Local template copies
+# -----------------------------------
+_CACHE_LOCK = threading.Lock()
+
+def template_path(config_key: str) -> str:
+    """
+    Returns a local copy of a template kept on the shared drive (e.g. 'batch_template_path').
+    Only for templates that are filled and loaded into SAP: a workbook the workflow saves its
+    results into (e.g. 'unify_template_path') must be opened on the share.
+
+    Workflow:
+    - Compares the shared file (modification time and size) with the copy recorded in the local store
+    - Copies it into '<local_data_path>/templates' when it changed or the copy is missing
+    - Uses the last local copy if the share is not reachable, and the shared path if there is
+      no copy (or the copy is open in Excel and cannot be replaced)
+
+    Parameters:
+    - config_key (str): SAP_info.json key with the template path
+
+    Returns:
+    - str: Path the workflow opens (and SAP loads)
+    """
+    source = Load_SAP_info.config[config_key]
+    cached_path = os.path.join(Load_SAP_info.config["local_data_path"], "templates", os.path.basename(source))
+    with _CACHE_LOCK:
+        cached = cached_template(config_key)
+        has_copy = cached is not None and cached[3] == cached_path and os.path.exists(cached_path)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            if has_copy:
+                log_event(WARNING, f"Plantilla {source} no accesible, se usa la copia local")
+                return cached_path
+            return source
+        if has_copy and tuple(cached[:3]) == (source, stat.st_mtime, stat.st_size):
+            return cached_path
+        try:
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            shutil.copy2(source, cached_path)
+        except OSError as e:
+            print(f"[WARNING] No se pudo copiar la plantilla {source}: {e}")
+            return cached_path if has_copy else source
+        save_cached_template(config_key, source, stat.st_mtime, stat.st_size, cached_path)
+        return cached_path
+
+# -----------------------------------
+# Background warm-up
+# -----------------------------------
+WORKFLOW_MODULES = ("DailyPaymentsModule", "PaymentsModule", "ReportsModule")
+
+class WarmUp(threading.Thread):
+    """
+    Background warm-up started by the main window while the operator is still choosing a tab.
+
+    Workflow:
+    - Imports the workflow modules (xlwings, win32com…) so the first click does not wait for them
+    - Copies the templates listed in 'warm_up' → 'templates' to the local cache
+    - Starts a hidden Excel instance if none is running (shown when a workflow opens its first workbook)
+
+    The SAP session is attached afterwards on the GUI thread with `attach_sap`: COM objects
+    cannot be shared between threads and SAPSessionManager keeps the session for the workflows.
+
+    Results are kept in `steps` as {step: (ready, status text)}.
+    """
+    def __init__(self):
+        super().__init__(name="WarmUp", daemon=True)
+        self.config = Load_SAP_info.config.get("warm_up", {})
+        self.steps = {}
+        self.excel_pid = None
+
+    def run(self):
+        for step, action in (("modules", self.import_modules),
+                             ("templates", self.prefetch_templates),
+                             ("excel", self.start_excel)):
+            try:
+                self.steps[step] = action()
+            except Exception as e:
+                print(f"[WARNING] Precarga '{step}' fallida: {e}")
+                self.steps[step] = (False, f"Precarga '{step}' fallida")
+
+    def import_modules(self) -> tuple:
+        for module_name in WORKFLOW_MODULES:
+            importlib.import_module(module_name)
+        return True, "Procesos cargados"
+
+    def prefetch_templates(self) -> tuple:
+        keys = [key for key in self.config.get("templates", []) if key in Load_SAP_info.config]
+        local = [key for key in keys if template_path(key) != Load_SAP_info.config[key]]
+        if len(local) < len(keys):
+            return False, f"Plantillas locales {len(local)}/{len(keys)}"
+        return True, f"Plantillas locales {len(local)}"
+
+    def start_excel(self) -> tuple:
+        if not self.config.get("excel", True):
+            return True, "Excel bajo demanda"
+        import pythoncom
+        import xlwings as xw
+        pythoncom.CoInitialize()
+        try:
+            if xw.apps.count:
+                return True, "Excel abierto"
+            app = xw.App(visible=False, add_book=False)
+            # Keeps Excel running once this thread releases it
+            app.api.UserControl = True
+            self.excel_pid = app.pid
+            del app
+            return True, "Excel preparado"
+        finally:
+            pythoncom.CoUninitialize()
+
+def attach_sap() -> tuple:
+    """
+    Attaches SAPSessionManager to the open SAP GUI session and checks it is on the Easy Access screen.
+    Runs on the GUI thread. Leaves the SAP screen (the operator may be in a transaction) and the
+    run flag as they were.
+
+    Returns:
+    - tuple[bool, str]: (ready, status text)
+    """
+    from SAPAux import SAPSessionManager, chk_window
+    flag = Load_SAP_info.ContinueProgram
+    try:
+        if not SAPSessionManager.connect():
+            return False, "SAP no disponible"
+        title = chk_window()
+        if title is None:
+            return False, "SAP sin ventana"
+        if "SAP Easy Access" not in title:
+            return False, f"SAP en '{title}'"
+        return True, "SAP listo"
+    finally:
+        Load_SAP_info.ContinueProgram = flag
+
+def close_warm_excel(pid):
+    """
+    Quits the Excel instance started by the warm-up if no workflow has used it (still hidden, no books).
+
+    Parameters:
+    - pid (int or None): Process id of the warm-up Excel instance
+    """
+    if pid is None:
+        return
+    try:
+        import xlwings as xw
+        for app in xw.apps:
+            if app.pid == pid and not app.visible and not app.books:
+                app.quit()
+    except Exception as e:
+        print(f"[WARNING] No se pudo cerrar Excel: {e}")
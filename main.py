@@ -4,23 +4,120 @@
 """
 import sys
 import locale
-# Set locale to Spanish (Spain)
-locale.setlocale(locale.LC_ALL, 'es_ES.UTF-8')
+import argparse
+import importlib
 
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QMessageBox
+    QApplication, QMainWindow, QMessageBox, QDockWidget, QWidget, QVBoxLayout, QHBoxLayout,
+    QComboBox, QLineEdit, QTableWidget, QTableWidgetItem, QAbstractItemView, QLabel
 )
+from PyQt5.QtCore import Qt, QTimer, QThread, QEventLoop
 from MainUI import Ui_MainUI
-from AutoZagingUI import Ui_ZagingReportUI
-from BalanceReportUI import Ui_BalanceReport
-from DailyPaymentsModule import bank_file,daily_payments
-from PaymentsModule import payment
-from ReportsModule import (large_format_retailers_file,generate_sap_files_balance_report,
-                           download_files_balance_report,create_balance_report,
-                           zaging_1,zaging_2,zaging_3
-)
+import RunLog
+import Load_SAP_info
+
+# Workflow modules (and with them xlwings, win32com and the sub-window forms) are imported
+# the first time a button needs them, so the main window shows up without waiting for them.
+# 'python -m CLIRunner startup' fails if any of them is imported at startup
+DEFERRED_MODULES = ("DailyPaymentsModule", "PaymentsModule", "ReportsModule",
+                    "AutoZagingUI", "BalanceReportUI", "HotFolder", "WarmUp")
+
+def run_workflow(module_name, function_name, *args):
+    """
+    Thin dispatcher: imports the workflow module on first use and calls the workflow.
+
+    Parameters:
+    - module_name (str): Module with the workflow (e.g. 'PaymentsModule')
+    - function_name (str): Workflow function
+    - *args: Arguments of the workflow
+
+    Returns:
+    - Whatever the workflow returns
+    """
+    if module_name not in DEFERRED_MODULES:
+        raise ValueError(f"{module_name} no está en DEFERRED_MODULES")
+    return getattr(importlib.import_module(module_name), function_name)(*args)
+
+class RunLogDock(QDockWidget):
+    """
+    Non-modal run log panel:  
+    Shows the events queued through `RunLog.log_event` (per-row skips, SAP status bar errors, …)
+    without stopping the workflow, filterable by severity and text.
+    
+    Workflow:
+    - Polls the thread-safe event queue every 200 ms and appends new events to the table
+    - Events logged from the GUI thread (workflows run there) are shown straight away
+    - Hides rows not matching the selected severity or the text filter
+    
+    Parameters:
+    - parent: Main window hosting the dock
+    
+    Returns:
+    - None: panel updates itself while the application runs
+    """
+    HEADERS = ["Hora", "Nivel", "Proceso", "Fila", "Mensaje"]
+
+    def __init__(self, parent=None):
+        super().__init__("Registro de ejecución", parent)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        filters = QHBoxLayout()
+        self.severity = QComboBox()
+        self.severity.addItem("Todos", None)
+        for severity in RunLog.SEVERITIES:
+            self.severity.addItem(severity, severity)
+        self.severity.currentIndexChanged.connect(self.apply_filter)
+        self.text = QLineEdit()
+        self.text.setPlaceholderText("Filtrar…")
+        self.text.textChanged.connect(self.apply_filter)
+        filters.addWidget(self.severity)
+        filters.addWidget(self.text)
+        layout.addLayout(filters)
+        self.table = QTableWidget(0, len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(200)
+        RunLog.set_listener(self.show_now)
+
+    def show_now(self):
+        # The timer cannot fire while a workflow runs on the GUI thread: paint its events as they come
+        if QThread.currentThread() != self.thread():
+            return
+        self.poll()
+        # User input stays queued so a click cannot start another workflow mid-run
+        QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
+    def poll(self):
+        events = RunLog.drain()
+        if not events:
+            return
+        for timestamp, severity, workflow, row, message in events:
+            index = self.table.rowCount()
+            self.table.insertRow(index)
+            values = [timestamp.strftime("%H:%M:%S"), severity, workflow, "" if row is None else str(row), message]
+            for col_index, value in enumerate(values):
+                self.table.setItem(index, col_index, QTableWidgetItem(value))
+            self.table.setRowHidden(index, not self.matches(index))
+        self.table.scrollToBottom()
+
+    def matches(self, index):
+        severity = self.severity.currentData()
+        text = self.text.text().strip().lower()
+        if severity and self.table.item(index, 1).text() != severity:
+            return False
+        if text and not any(text in self.table.item(index, col).text().lower() for col in range(len(self.HEADERS))):
+            return False
+        return True
+
+    def apply_filter(self):
+        for index in range(self.table.rowCount()):
+            self.table.setRowHidden(index, not self.matches(index))
 
-from SAPAux import SAPSessionManager
 class MainWindow(QMainWindow):
     """
     Main Application Window:  
@@ -31,8 +128,10 @@ class MainWindow(QMainWindow):
     - Handles 'Aceptar' by checking selected items and routing to appropriate submodules:
       - Pagos Diarios → either Movimientos Bancarios or Pagos Diarios
       - Informes → Zaging, Informe de Saldos, Grandes Superficies
-      - Other tabs → routed via payment function
+      - Other tabs → routed via payment function (several selected clients → payment queue)
     - Handles 'Cancelar' by prompting user confirmation and closing SAP session if active
+    - Hosts the non-modal run log panel where workflows report per-row events
+    - Warms up SAP, Excel and the templates in the background, showing readiness in the status bar
     - Includes utility method for retrieving user selections based on current tab
     
     Parameters:
@@ -51,10 +150,55 @@ class MainWindow(QMainWindow):
         self.zag_wnd = None
         self.blnc_wnd = None
 
+        # Non-modal run log panel
+        self.log_dock = RunLogDock(self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.log_dock)
+
+        # Inbox watcher: identifies and pre-parses files dropped into the hot folder
+        # (started once the event loop runs, so it does not delay showing the window)
+        self.inbox_watcher = None
+        QTimer.singleShot(0, self.start_inbox_watcher)
+
+        # Background warm-up (workflow modules, local templates, hidden Excel, SAP session)
+        self.warm_up = None
+        self.warm_label = QLabel("Preparando SAP y Excel…")
+        self.statusBar().addPermanentWidget(self.warm_label)
+        QTimer.singleShot(0, self.start_warm_up)
+
+        # Several clients can be selected at once to post their remittances as a payment queue
+        self.ui.PagList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.ui.ConfList.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
         # Connect buttons
         self.ui.OkBtn.clicked.connect(self.OkClick)
         self.ui.CancelBtn.clicked.connect(self.CancelClick)
 
+    def start_inbox_watcher(self):
+        from HotFolder import start_watcher
+        self.inbox_watcher = start_watcher()
+
+    def start_warm_up(self):
+        from WarmUp import WarmUp
+        self.warm_up = WarmUp()
+        self.warm_up.start()
+        self.warm_timer = QTimer(self)
+        self.warm_timer.timeout.connect(self.poll_warm_up)
+        self.warm_timer.start(200)
+
+    def poll_warm_up(self):
+        if self.warm_up.is_alive():
+            return
+        self.warm_timer.stop()
+        steps = dict(self.warm_up.steps)
+        # SAP is attached here: the session has to live on the GUI thread
+        if Load_SAP_info.config.get("warm_up", {}).get("sap", True):
+            from WarmUp import attach_sap
+            steps["sap"] = attach_sap()
+        ready = all(ok for ok, _ in steps.values())
+        text = " · ".join(message for _, message in steps.values())
+        self.warm_label.setText(f"{'Listo' if ready else 'Listo con avisos'}: {text}")
+        RunLog.log_event(RunLog.INFO if ready else RunLog.WARNING, f"Precarga: {text}")
+
     def OkClick(self):
         tab_index = self.ui.tabWidget.currentIndex()
         tab_name = self.ui.tabWidget.tabText(tab_index)
@@ -67,14 +211,15 @@ class MainWindow(QMainWindow):
         self.statusBar().showMessage(f"Procesando {tab_name}...", 3000)
         print("Pestaña:", tab_name)
         print("Elementos seleccionados:", selected_items)
+        RunLog.set_workflow(selected_items[0])
         # Call the appropriate function
         if tab_name == "Pagos Diarios":
             print(tab_name)
             print(selected_items[0])
             if selected_items[0]  == "Movimientos Bancarios":
-                bank_file()
+                run_workflow("DailyPaymentsModule", "bank_file")
             elif selected_items[0]  == "Pagos Diarios":
-                daily_payments()
+                run_workflow("DailyPaymentsModule", "daily_payments")
             else:
                 print(selected_items[0])
         elif tab_name == "Informes":
@@ -85,11 +230,13 @@ class MainWindow(QMainWindow):
                 self.blnc_wnd = BalanceReportWindow()
                 self.blnc_wnd.show()
             elif selected_items[0] == "Fichero Grandes Superficies":
-                large_format_retailers_file()
+                run_workflow("ReportsModule", "large_format_retailers_file")
             else:
                 print(selected_items[0])
+        elif len(selected_items) > 1:
+            run_workflow("PaymentsModule", "payment_queue", selected_items)
         else:
-            payment(selected_items[0])
+            run_workflow("PaymentsModule", "payment", selected_items[0])
         
     def CancelClick(self):
         reply = QMessageBox.question(
@@ -97,10 +244,19 @@ class MainWindow(QMainWindow):
             QMessageBox.Yes | QMessageBox.No
         )
         if reply == QMessageBox.Yes:
-            if SAPSessionManager.session:
-                SAPSessionManager.disconnect(False)
+            # Only a workflow that already ran can have opened a SAP session
+            sap_aux = sys.modules.get("SAPAux")
+            if sap_aux and sap_aux.SAPSessionManager.session:
+                sap_aux.SAPSessionManager.disconnect(False)
             self.close()
 
+    def closeEvent(self, event):
+        # Quit the warm-up Excel instance if no workflow used it
+        if self.warm_up and self.warm_up.excel_pid:
+            from WarmUp import close_warm_excel
+            close_warm_excel(self.warm_up.excel_pid)
+        super().closeEvent(event)
+
     def get_selected_items_for_tab(self, tab_name):
         tab_mapping = {
             "Pagarés": self.ui.PagList,
@@ -132,6 +288,7 @@ class AutoZagingWindow(QMainWindow):
 
     def __init__(self):
         super().__init__()
+        from AutoZagingUI import Ui_ZagingReportUI
         self.ui = Ui_ZagingReportUI()
         self.ui.setupUi(self)
 
@@ -141,15 +298,18 @@ class AutoZagingWindow(QMainWindow):
         self.ui.Zaging_3.clicked.connect(self.handle_zaging_3)
 
     def handle_zaging_1(self):
-        zaging_1()
+        RunLog.set_workflow("Zaging")
+        run_workflow("ReportsModule", "zaging_1")
         print("Paso 1 ejecutado: Zaging automático iniciado.")
 
     def handle_zaging_2(self):
-        zaging_2()
+        RunLog.set_workflow("Zaging")
+        run_workflow("ReportsModule", "zaging_2")
         print("Paso 2 ejecutado: Procesando etapa intermedia.")
 
     def handle_zaging_3(self):
-        zaging_3()
+        RunLog.set_workflow("Zaging")
+        run_workflow("ReportsModule", "zaging_3")
         print("Paso 3 ejecutado: Generando informe.")
 
 class BalanceReportWindow(QMainWindow):
@@ -172,6 +332,7 @@ class BalanceReportWindow(QMainWindow):
     """
     def __init__(self):
         super().__init__()
+        from BalanceReportUI import Ui_BalanceReport
         self.ui = Ui_BalanceReport()
         self.ui.setupUi(self)
 
@@ -181,15 +342,18 @@ class BalanceReportWindow(QMainWindow):
         self.ui.BalanceReport_3.clicked.connect(self.handle_BalanceReport_3)
 
     def handle_BalanceReport_1(self):
-        generate_sap_files_balance_report()
+        RunLog.set_workflow("Informe de Saldos")
+        run_workflow("ReportsModule", "generate_sap_files_balance_report")
         print("Paso 1 ejecutado: Generando ficheros.")
 
     def handle_BalanceReport_2(self):
-        download_files_balance_report()
+        RunLog.set_workflow("Informe de Saldos")
+        run_workflow("ReportsModule", "download_files_balance_report")
         print("Paso 2 ejecutado: Descargando ficheros.")
 
     def handle_BalanceReport_3(self):
-        create_balance_report()
+        RunLog.set_workflow("Informe de Saldos")
+        run_workflow("ReportsModule", "create_balance_report")
         print("Paso 3 ejecutado: Finalizando reporte de Saldos.")
 
 def main():
@@ -198,6 +362,10 @@ def main():
     Initializes and launches the main application window.
     
     Workflow:
+    - Sets the Spanish locale (skipped with a warning if the machine does not have it)
+    - Reads the optional decision file options:
+        - '--record <file>' records every answer given in the session
+        - '--answers <file>' answers from a recorded or hand-written decision file
     - Ensures QApplication instance is active
     - Instantiates and displays MainWindow
     - Starts application event loop
@@ -208,9 +376,25 @@ def main():
     Returns:
     - None: enters blocking Qt exec loop
     """
+    # Set locale to Spanish (Spain); set here and not at import so the startup benchmark runs anywhere
+    try:
+        locale.setlocale(locale.LC_ALL, 'es_ES.UTF-8')
+    except locale.Error as e:
+        print(f"[WARNING] Locale es_ES.UTF-8 no disponible: {e}")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", help="Fichero donde grabar las respuestas de la sesión")
+    parser.add_argument("--answers", help="Fichero de decisiones con las respuestas (JSON/YAML)")
+    args, qt_args = parser.parse_known_args()
+    if args.record or args.answers:
+        from UserInputs import use_decision_file
+    if args.record:
+        use_decision_file(args.record, record=True)
+    elif args.answers:
+        use_decision_file(args.answers)
+
     app = QApplication.instance()
     if not app:
-        app = QApplication(sys.argv)
+        app = QApplication(sys.argv[:1] + qt_args)
 
     window = MainWindow()
     window.show()